@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import time
+import datetime
+import remedy_functions
+import db
+import metrics
+import event_log
+
+# the alert types that generate tickets, and the type of device each one is about
+DOWN_ALERTS = {
+    "Cellular went down": "router",
+    "switches went down": "switch",
+    "APs went down": "AP"
+}
+# the alert types that mark a device as up again
+UP_ALERTS = {
+    "Cellular came up": "router",
+    "switches came up": "switch",
+    "APs came up": "AP"
+}
+ALERT_TYPES = tuple(DOWN_ALERTS) + tuple(UP_ALERTS)
+# the alert type that opens a ticket for each type of device
+TICKET_ALERTS = {device_type: alert_type for alert_type, device_type in DOWN_ALERTS.items()}
+
+# the name used for each type of device in the ticket description
+TICKET_NAMES = {
+    "router": "Router",
+    "switch": "switch",
+    "AP": "AP"
+}
+# the most affected devices listed in one ticket
+MAX_LISTED_DEVICES = 100
+
+# the lanes alerts are queued in, from the highest priority to the lowest - routers before switches before APs,
+# since the alerts of upstream devices decide whether the ones behind them create tickets, and within a tier,
+# down alerts before up alerts, since they are the ones that create tickets
+PRIORITY_LANES = ("router down", "router up", "switch down", "switch up", "AP down", "AP up")
+
+# return the priority lane of an alert
+def alert_lane(data):
+    alert_type = data.get("alertType")
+    if alert_type in DOWN_ALERTS:
+        return DOWN_ALERTS[alert_type] + " down"
+    if alert_type in UP_ALERTS:
+        return UP_ALERTS[alert_type] + " up"
+
+    return PRIORITY_LANES[-1]
+
+# return the time an alert happened according to Meraki, as a Unix timestamp, or None if the alert doesn't say
+def occurred_at(data):
+    value = data.get("occurredAt")
+    if not isinstance(value, str):
+        return None
+
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+# apply a batch of alerts in the order they arrived, then create one ticket for each device that went down
+# without anything upstream of it being down, listing the devices behind it that went down in the same batch
+# tickets are recorded in the incident registry, so a device that already has an open ticket never gets another
+def handle_alerts(conn, remedy, topology, incidents, batch):
+    # the devices that went down in this batch and are still down at the end of it, with the alert for each
+    went_down = {}
+    # the devices that went down in this batch while nothing upstream of them was down, so they failed on their own
+    independent = set()
+
+    for data in batch:
+        started = time.perf_counter()
+        alert_type = data["alertType"]
+        if alert_type in DOWN_ALERTS:
+            serial = data["deviceSerial"]
+            device = topology.get(serial, data.get("networkId"))
+            if device is None:
+                metrics.TICKETS_SUPPRESSED.inc(device_type=DOWN_ALERTS[alert_type], reason="unknown_device")
+                event_log.log_event("alert_decision", decision="unknown_device", alert_type=alert_type, serial=serial,
+                                    network_id=data.get("networkId"), hint="run populate.py to add the device")
+            # mark the device as down - if it already was, a ticket should have already been created
+            elif topology.update_status(conn, serial, "down", occurred_at(data)):
+                went_down[serial] = data
+                if topology.down_ancestor(serial) is None:
+                    independent.add(serial)
+            else:
+                metrics.TICKETS_SUPPRESSED.inc(device_type=device.device_type, reason="already_down")
+                event_log.log_event("alert_decision", decision="already_down", alert_type=alert_type, serial=serial,
+                                    network_id=device.network_id, device_type=device.device_type)
+        elif alert_type in UP_ALERTS:
+            serial = data["deviceSerial"]
+            device = topology.get(serial, data.get("networkId"))
+            if device is None:
+                continue
+            # The device is up, so we need to update the database to reflect this
+            topology.update_status(conn, serial, "up", occurred_at(data))
+            # a device that came back up within the same batch doesn't need a ticket
+            if went_down.pop(serial, None) is not None:
+                metrics.TICKETS_SUPPRESSED.inc(device_type=device.device_type, reason="came_up")
+            # the devices behind it are back up too, even if their own came up alerts were lost or are still on the way -
+            # except the ones that failed on their own earlier in this batch, whose tickets are still to be opened
+            recover_subtree(conn, topology, device, went_down, occurred_at(data), independent & went_down.keys())
+            # the device's open ticket can be closed
+            incident = incidents.close(conn, serial, TICKET_ALERTS[device.device_type])
+            if incident is not None:
+                close_incident(remedy, incident, device)
+        metrics.ALERT_STAGE_SECONDS.observe(time.perf_counter() - started, alert_type=alert_type, stage="status")
+        if alert_type in UP_ALERTS:
+            event_log.log_event("alert_decision", decision="came_up", alert_type=alert_type, serial=data["deviceSerial"],
+                                network_id=data.get("networkId"), duration_ms=event_log.elapsed_ms(started))
+
+    # Now we group the devices by the device furthest upstream of them that is down
+    affected = {}
+    for serial in went_down:
+        device = topology.get(serial)
+        root = topology.root_cause(serial)
+        if root is None:
+            affected.setdefault(serial, [])
+        elif root.serial in went_down:
+            affected.setdefault(root.serial, []).append(device)
+        else:
+            # the upstream device was already down before this batch, so its ticket covers this device
+            metrics.TICKETS_SUPPRESSED.inc(device_type=device.device_type, reason="upstream_down")
+            event_log.log_event("alert_decision", decision="upstream_down", alert_type=went_down[serial]["alertType"], serial=serial,
+                                network_id=device.network_id, device_type=device.device_type, upstream=root.serial)
+
+    for serial, children in affected.items():
+        started = time.perf_counter()
+        try:
+            open_ticket(conn, remedy, incidents, topology.get(serial), went_down[serial], children)
+        finally:
+            metrics.ALERT_STAGE_SECONDS.observe(time.perf_counter() - started, alert_type=went_down[serial]["alertType"], stage="ticket")
+
+# mark the devices behind a device that came back up as up, apart from the ones in exclude and the devices behind
+# them - any of them that went down earlier in the batch no longer need a ticket
+def recover_subtree(conn, topology, device, went_down, occurred_at=None, exclude=()):
+    started = time.perf_counter()
+    recovered = topology.recover_subtree(conn, device.serial, occurred_at, exclude)
+    if not recovered:
+        return
+
+    for child in recovered:
+        metrics.DEVICES_RECOVERED.inc(device_type=child.device_type)
+        if went_down.pop(child.serial, None) is not None:
+            metrics.TICKETS_SUPPRESSED.inc(device_type=child.device_type, reason="upstream_came_up")
+    event_log.log_event("subtree_recovered", serial=device.serial, network_id=device.network_id, device_type=device.device_type,
+                        recovered=len(recovered), duration_ms=event_log.elapsed_ms(started))
+
+# create or queue the ticket for a device that went down, listing the devices behind it that went down with it
+def open_ticket(conn, remedy, incidents, device, data, children):
+    serial = device.serial
+    event = {
+        "description": "Meraki REST API: Incident Creation\n " + TICKET_NAMES[device.device_type] + " " + serial + " in network " + data["networkName"] + " is down."
+    }
+    if children:
+        listed = [TICKET_NAMES[child.device_type] + " " + child.serial for child in children[:MAX_LISTED_DEVICES]]
+        if len(children) > MAX_LISTED_DEVICES:
+            listed.append("and " + str(len(children) - MAX_LISTED_DEVICES) + " more")
+        event["description"] += "\n Affected downstream devices: " + ", ".join(listed)
+
+    # a ticket may already be open for this device, if Meraki retried the alert or the status was reset
+    alert_type = data["alertType"]
+    if incidents.get(serial, alert_type) is not None:
+        metrics.TICKETS_SUPPRESSED.inc(device_type=device.device_type, reason="already_open")
+        event_log.log_event("alert_decision", decision="already_open", alert_type=alert_type, serial=serial,
+                            network_id=device.network_id, device_type=device.device_type,
+                            incident=_ticket_name(incidents.get(serial, alert_type)))
+
+        return
+
+    # with an outbox, the ticket is stored and sent to Remedy in the background - it is recorded as open right away
+    # so alerts that arrive before it is sent don't queue it again, in the same transaction as the outbox row, so an
+    # open ticket is never left behind without anything to send
+    outbox = remedy.get("outbox")
+    if outbox is not None:
+        try:
+            with db.batch(conn) as batch_conn:
+                opened = incidents.open(batch_conn, serial, alert_type, device.network_id, None, None) is not None
+                if opened:
+                    outbox.submit(batch_conn, serial, alert_type, device.network_id, event["description"])
+        except Exception:
+            incidents.discard(serial, alert_type)
+            raise
+        if not opened:
+            metrics.TICKETS_SUPPRESSED.inc(device_type=device.device_type, reason="already_open")
+            event_log.log_event("alert_decision", decision="already_open", alert_type=alert_type, serial=serial,
+                                network_id=device.network_id, device_type=device.device_type, note="opened by another receiver")
+
+            return
+        metrics.TICKETS_QUEUED.inc(device_type=device.device_type)
+        event_log.log_event("alert_decision", decision="ticket_queued", alert_type=alert_type, serial=serial,
+                            network_id=device.network_id, device_type=device.device_type, affected=len(children))
+
+        return
+
+    response = remedy_functions.create_incident(remedy, event)
+    entry_id, incident_number = remedy_functions.get_incident_ids(response)
+    if entry_id is None and incident_number is None:
+        event_log.error("alert_decision", decision="ticket_failed", alert_type=alert_type, serial=serial,
+                        network_id=device.network_id, device_type=device.device_type, status_code=response.status_code)
+
+        return
+
+    incidents.open(conn, serial, alert_type, device.network_id, entry_id, incident_number)
+    metrics.TICKETS_CREATED.inc(device_type=device.device_type)
+    event_log.log_event("alert_decision", decision="ticket_created", alert_type=alert_type, serial=serial,
+                        network_id=device.network_id, device_type=device.device_type, affected=len(children),
+                        incident=incident_number or entry_id)
+
+# resolve the ticket of a device that came back up, if automatic resolution is turned on
+def close_incident(remedy, incident, device):
+    if incident.incident_number is None and incident.entry_id is None:
+        event_log.log_event("incident_closed", decision="not_sent", serial=device.serial, device_type=device.device_type)
+    elif remedy.get("auto_resolve") and incident.incident_number is not None:
+        resolution = TICKET_NAMES[device.device_type] + " " + device.serial + " is back up according to Meraki."
+        # with an outbox, the ticket is resolved in the background like tickets are created
+        outbox = remedy.get("outbox")
+        if outbox is not None:
+            outbox.resolve(incident.incident_number, resolution)
+        else:
+            remedy_functions.resolve_incident(remedy, incident.incident_number, resolution)
+        event_log.log_event("incident_closed", decision="resolved", serial=device.serial, device_type=device.device_type,
+                            incident=_ticket_name(incident))
+    else:
+        event_log.log_event("incident_closed", decision="resolve_manually", serial=device.serial, device_type=device.device_type,
+                            incident=_ticket_name(incident))
+
+def _ticket_name(incident):
+    return incident.incident_number or incident.entry_id or "(unknown)"
@@ -15,22 +15,103 @@ writing, software distributed under the License is distributed on an "AS
 IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
-from flask import Flask, request, json
+from flask import Flask, Response, request, json, jsonify
 import os
-from dotenv import load_dotenv
-from pprint import pprint
+import atexit
+import time
+import logging
 import remedy_functions
+import alerts
 import db
-
-# Global variables
-load_dotenv()
-
-# The remedy data structure will hold all the info to make API requests to Remedy
-remedy = {
-    "url": os.environ["REMEDY_URL"],
-    "username": os.environ["REMEDY_USERNAME"],
-    "password": os.environ["REMEDY_PASSWORD"]
-}
+import metrics
+import event_log
+import profiling
+from outbox import OutboxDispatcher
+from correlator import AlertCorrelator
+from worker import AlertWorkerPool
+from cluster import FORWARDED_HEADER
+
+# the Remedy settings, the database, and the topology and open tickets are shared with asgi.py
+from bootstrap import (remedy, history, incidents, cluster, outbox_networks, process_alerts, CORRELATION_WINDOW, DB_FILE,
+                       OUTBOX_BASE_DELAY, OUTBOX_MAX_DELAY, OUTBOX_BREAKER_THRESHOLD, OUTBOX_BREAKER_COOLDOWN,
+                       OUTBOX_LEASE)
+
+# The token manager logs in to Remedy lazily and caches the token until it expires
+remedy["token_manager"] = remedy_functions.TokenManager(remedy)
+
+# "sync" processes each alert before responding, "queue" acknowledges right away and processes alerts on background workers
+INGEST_MODE = os.getenv("ALERT_INGEST_MODE", "sync")
+ALERT_WORKERS = int(os.getenv("ALERT_WORKERS", 4))
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", 10000))
+# the bounds of individual priority lanes, such as "AP down=2000,AP up=2000" - the other lanes hold ALERT_QUEUE_SIZE alerts each
+ALERT_LANE_SIZES = {lane.strip(): int(size) for lane, size in
+                    (item.rsplit("=", 1) for item in os.getenv("ALERT_LANE_SIZES", "").split(",") if item.strip())}
+# seconds Meraki is asked to wait before retrying an alert whose lane was full
+ALERT_RETRY_AFTER = int(os.getenv("ALERT_RETRY_AFTER", 5))
+SHUTDOWN_TIMEOUT = float(os.getenv("ALERT_SHUTDOWN_TIMEOUT", 30))
+# tickets in flight each hold a thread
+OUTBOX_MAX_IN_FLIGHT = int(os.getenv("OUTBOX_MAX_IN_FLIGHT", 4))
+
+
+# handle one alert, or buffer it in its network's correlation window
+def process_alert(data):
+    if correlator is not None:
+        correlator.add(data)
+    else:
+        process_alerts([data])
+
+
+# atexit runs handlers in reverse order, so the connections are closed after the queue and correlation windows below are drained
+atexit.register(db.close_all_connections)
+
+if history is not None:
+    history.start()
+    # write the changes still waiting in memory once the alerts are drained
+    atexit.register(history.shutdown)
+
+if cluster is not None:
+    cluster.start()
+    # leave the cluster once this receiver's alerts and tickets are drained, so the others take over its networks
+    atexit.register(cluster.shutdown)
+
+# The outbox dispatcher sends tickets to Remedy - tickets that are still waiting when the process exits are sent after the next start
+outbox = OutboxDispatcher(DB_FILE, remedy, incidents,
+                          max_in_flight=OUTBOX_MAX_IN_FLIGHT,
+                          base_delay=OUTBOX_BASE_DELAY,
+                          max_delay=OUTBOX_MAX_DELAY,
+                          breaker_threshold=OUTBOX_BREAKER_THRESHOLD,
+                          breaker_cooldown=OUTBOX_BREAKER_COOLDOWN,
+                          lease=OUTBOX_LEASE,
+                          network_ids=outbox_networks())
+remedy["outbox"] = outbox
+outbox.start()
+atexit.register(outbox.shutdown)
+
+correlator = None
+if CORRELATION_WINDOW > 0:
+    correlator = AlertCorrelator(process_alerts, CORRELATION_WINDOW)
+    correlator.start()
+    # decide the alerts still held in a window before the process exits
+    atexit.register(correlator.shutdown)
+
+worker_pool = None
+if INGEST_MODE == "queue":
+    worker_pool = AlertWorkerPool(process_alert, workers=ALERT_WORKERS, max_queue=ALERT_QUEUE_SIZE,
+                                  lanes=alerts.PRIORITY_LANES, lane_of=alerts.alert_lane, lane_sizes=ALERT_LANE_SIZES)
+    worker_pool.start()
+    # drain the alerts that are still queued before the process exits
+    atexit.register(worker_pool.shutdown, SHUTDOWN_TIMEOUT)
+
+# the gauges on /metrics are read when they are scraped
+metrics.OUTBOX_PENDING.set_function(lambda: outbox.stats()["pending"])
+if correlator is not None:
+    metrics.CORRELATION_BUFFERED.set_function(lambda: correlator.stats()["alerts"])
+if worker_pool is not None:
+    metrics.QUEUE_DEPTH.set_function(worker_pool.depth)
+if history is not None:
+    metrics.STATUS_EVENTS_PENDING.set_function(lambda: history.stats()["pending"])
+if cluster is not None:
+    metrics.CLUSTER_WORKERS.set_function(lambda: len(cluster.stats()["workers"]))
 
 
 app = Flask(__name__)
@@ -43,119 +124,87 @@ provides the logic to parse the Meraki alert and create a Remedy ticket
 def alert():
     # If the method is POST, then an alert has sent a webhook to the web server
     if request.method == "POST":
-        data = request.json # Retrieve the json data from the request - contains alert info
-        pprint(data)
-
-        # The database holds information about the status of the Meraki devices and the topology of the network
-        conn = db.create_connection("sqlite.db")
-
-        # Retrieve an API token from Remedy and save it to the data structure
-        token = remedy_functions.get_token(remedy)
-        remedy["token"] = token
-
-        # Now we will parse what the alert type is - we will generate tickets for alert types indicating switches, routers, and aps are down
-
-        if data["alertType"] == "switches went down":
-            serial = data["deviceSerial"]
-            # check what the switch status is
-            switch_status = db.query_switch_status(conn, serial)
-            if switch_status[0][0] == "up":
-                # The switch is now down, so we need to update the database to reflect this
-                db.update_device_status(conn, "switch", serial, "down")
-
-                # Now we need to check to see if the switch connection is also down before we create a ticket
-                connection = db.query_switch_connection(conn, serial)
-                if connection[0][0] is not None:
-                    router_status = db.query_router_status(conn, connection[0][0])
-                    # If the router status is up, we create a ticket
-                    if router_status[0][0] == "up":
-                        event = {
-                            "description": "Meraki REST API: Incident Creation\n switch " + serial + " in network " + data["networkName"] + " is down."
-                        }
-
-                        remedy_functions.create_incident(remedy, event)
-                        print("Ticket created for the switch")
-                    else:
-                        print("No ticket needed for the switch")
-                # there is no connection to the switch, we should create a ticket
-                else:
-                    event = {
-                        "description": "Meraki REST API: Incident Creation\n switch " + serial + " in network " + data["networkName"] + " is down."
-                    }
-
-                    remedy_functions.create_incident(remedy, event)
-                    print("Ticket created for the switch")
-            else:
-                # switch is already down, ticket should have already been created
-                print("No ticket created, switch is already down. Check for existing ticket")
-        elif data["alertType"] == "Cellular went down":
-            serial = data["deviceSerial"]
-            # check what the router status is
-            router_status = db.query_router_status(conn, serial)
-            if router_status[0][0] == "up":
-                # The router is now down, so we need to update the database to reflect this
-                db.update_device_status(conn, "router", serial, "down")
-
-                # Now we create the ticket
-                event = {
-                    "description": "Meraki REST API: Incident Creation\n Router " + serial + " in network " + data["networkName"] + " is down."
-                }
-
-                remedy_functions.create_incident(remedy, event)
-                print("Ticket created for the router")
-            else:
-                # router is already down, ticket should have already been created
-                print("No ticket created, router is already down. Check for existing ticket")
-        elif data["alertType"] == "APs went down":
-            serial = data["deviceSerial"]
-            # check what the ap status is
-            ap_status = db.query_ap_status(conn, serial)
-            if ap_status[0][0] == "up":
-                # The AP is down, so we need to update the database to reflect this
-                db.update_device_status(conn, "AP", serial, "down")
-
-                # Now we need to check to see if the AP connection is also down before we create a ticket
-                connection = db.query_ap_connection(conn, serial)
-                switch_status = db.query_switch_status(conn, connection[0][0])
-                # If the switch status is up, we create a ticket
-                if switch_status[0][0] is not None:
-                    if switch_status[0][0] == "up":
-                        event = {
-                            "description": "Meraki REST API: Incident Creation\n AP " + serial + " in network " + data["networkName"] + " is down."
-                        }
-
-                        remedy_functions.create_incident(remedy, event)
-                        print("Ticket created for the AP")
-                    else:
-                        print("No ticket created for the AP")
-                else:
-                    # ap is not connected to device in database, create a ticket
-                    event = {
-                        "description": "Meraki REST API: Incident Creation\n AP " + serial + " in network " + data["networkName"] + " is down."
-                    }
-
-                    remedy_functions.create_incident(remedy, event)
-                    print("Ticket created for the AP")
-            else:
-                # AP is already down, ticket should have already been created
-                print("No ticket created, AP is already down. Check for existing ticket")
-        elif data["alertType"] == "switches came up":
-            serial = data["deviceSerial"]
-            # The switch is up, so we need to update the database to reflect this
-            db.update_device_status(conn, "switch", serial, "up")
-        elif data["alertType"] == "Cellular came up":
-            serial = data["deviceSerial"]
-            # The router is up, so we need to update the database to reflect this
-            db.update_device_status(conn, "router", serial, "up")
-        elif data["alertType"] == "APs came up":
-            serial = data["deviceSerial"]
-            # The AP is up, so we need to update the database to reflect this
-            db.update_device_status(conn, "AP", serial, "up")
-
-        db.close_connection(conn)
+        data = request.get_json(silent=True) # Retrieve the json data from the request - contains alert info
+        if not isinstance(data, dict) or "alertType" not in data:
+            return "Request body is not a Meraki alert", 400
+        if data["alertType"] in alerts.ALERT_TYPES and "deviceSerial" not in data:
+            return "Alert is missing the device serial", 400
+
+        alert_type = data["alertType"]
+        metrics.ALERTS_RECEIVED.inc(alert_type=alert_type)
+        event_log.log_event("alert_received", alert_type=alert_type, serial=data.get("deviceSerial"),
+                            network_id=data.get("networkId"), network_name=data.get("networkName"))
+        started = time.perf_counter()
+        try:
+            # an alert forwarded by another receiver is handled here even if the two disagree on the owner for a moment,
+            # so it can't bounce between them
+            if cluster is not None and FORWARDED_HEADER not in request.headers:
+                owner_id, owner_url = cluster.owner(data.get("networkId"))
+                if owner_id != cluster.worker_id:
+                    event_log.log_event("alert_forwarded", alert_type=alert_type, serial=data.get("deviceSerial"),
+                                        network_id=data.get("networkId"), owner=owner_id)
+                    # the profiling header goes along, so the owner profiles the alert
+                    token = request.headers.get(profiling.TOKEN_HEADER)
+                    return cluster.forward(owner_url, request.get_data(),
+                                           {profiling.TOKEN_HEADER: token} if token is not None else None)
+
+            return receive_alert(data, profiling.should_profile(request.headers))
+        finally:
+            metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - started, alert_type=alert_type)
+
+    return 'Webhook receiver is running - check the terminal for alert information'
+
+
+# queue the alert, or process it right away in sync mode, and return the response for Meraki
+# a profiled alert is profiled where it is processed - on a worker thread in queue mode
+def receive_alert(data, profiled=False):
+    if worker_pool is not None:
+        # Alert types that don't concern routers, switches, or aps are acknowledged without queueing them
+        if data["alertType"] in alerts.ALERT_TYPES and not worker_pool.submit(data, profiled):
+            if not worker_pool.accepting:
+                return "Alert receiver is shutting down", 503
+
+            # only this alert's lane is full - alerts in the higher priority lanes are still accepted
+            return "Alert queue is full", 429, {"Retry-After": str(ALERT_RETRY_AFTER)}
+
+        return "Alert accepted", 202
+
+    try:
+        with profiling.profile(profiled, data["alertType"], data.get("deviceSerial")):
+            process_alert(data)
+    except Exception:
+        metrics.ALERT_ERRORS.inc(stage="request")
+        event_log.log_event("alert_failed", level=logging.ERROR, exc_info=True, alert_type=data["alertType"],
+                            serial=data.get("deviceSerial"), network_id=data.get("networkId"))
+        raise
 
     return 'Webhook receiver is running - check the terminal for alert information'
 
 
+# report the latency histograms and counters of the webhook pipeline in the Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# report the depth and processing lag of the alert queue
+@app.route("/queue", methods=["GET"])
+def queue_status():
+    stats = worker_pool.stats() if worker_pool is not None else {}
+    stats["mode"] = INGEST_MODE
+    if correlator is not None:
+        stats["correlation"] = correlator.stats()
+    stats["outbox"] = outbox.stats()
+    stats["remedy_token"] = remedy["token_manager"].stats()
+    stats["database"] = db.stats()
+    if cluster is not None:
+        stats["cluster"] = cluster.stats()
+    if history is not None:
+        stats["status_history"] = history.stats()
+
+    return jsonify(stats)
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # no debug reloader - its parent process would import this module too, and start a second set of background threads
+    app.run()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+An ASGI version of the webhook receiver in app.py, run with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Remedy is called with aiohttp on the event loop and the database is used from a small thread pool, so
+thousands of webhooks and tickets can be in flight at once without a thread for each of them.
+"""
+import asyncio
+import json
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import alerts
+import db
+import metrics
+import event_log
+from remedy_async import AsyncRemedyClient
+from outbox import AsyncOutboxDispatcher
+from correlator import AlertCorrelator
+from cluster import FORWARDED_HEADER
+
+# the Remedy settings, the database, and the topology and open tickets are shared with app.py
+from bootstrap import (remedy, history, incidents, cluster, outbox_networks, process_alerts, CORRELATION_WINDOW, DB_FILE,
+                       OUTBOX_BASE_DELAY, OUTBOX_MAX_DELAY, OUTBOX_BREAKER_THRESHOLD, OUTBOX_BREAKER_COOLDOWN,
+                       OUTBOX_LEASE)
+
+# tickets in flight cost a coroutine rather than a thread here, so many more can be sent at once than in app.py
+OUTBOX_MAX_IN_FLIGHT = int(os.getenv("OUTBOX_MAX_IN_FLIGHT", 100))
+# the largest webhook body that is read
+MAX_BODY_SIZE = 1024 * 1024
+
+# every database call runs on this pool, one thread for each pooled connection, so the event loop never waits on SQLite
+db_executor = ThreadPoolExecutor(max_workers=db.POOL_SIZE, thread_name_prefix="db")
+
+client = AsyncRemedyClient(remedy)
+outbox = AsyncOutboxDispatcher(DB_FILE, remedy, incidents, client, db_executor,
+                               max_in_flight=OUTBOX_MAX_IN_FLIGHT,
+                               base_delay=OUTBOX_BASE_DELAY,
+                               max_delay=OUTBOX_MAX_DELAY,
+                               breaker_threshold=OUTBOX_BREAKER_THRESHOLD,
+                               breaker_cooldown=OUTBOX_BREAKER_COOLDOWN,
+                               lease=OUTBOX_LEASE,
+                               network_ids=outbox_networks())
+remedy["outbox"] = outbox
+
+
+correlator = None
+if CORRELATION_WINDOW > 0:
+    correlator = AlertCorrelator(process_alerts, CORRELATION_WINDOW)
+
+# the gauges on /metrics are read when they are scraped
+metrics.OUTBOX_PENDING.set_function(lambda: outbox.stats()["pending"])
+if correlator is not None:
+    metrics.CORRELATION_BUFFERED.set_function(lambda: correlator.stats()["alerts"])
+if history is not None:
+    metrics.STATUS_EVENTS_PENDING.set_function(lambda: history.stats()["pending"])
+if cluster is not None:
+    metrics.CLUSTER_WORKERS.set_function(lambda: len(cluster.stats()["workers"]))
+
+
+# run a blocking function on the database thread pool
+async def run_in_db(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(db_executor, function, *args)
+
+
+# handle one alert, or buffer it in its network's correlation window
+async def process_alert(data):
+    if correlator is not None:
+        correlator.add(data)
+    else:
+        await run_in_db(process_alerts, [data])
+
+
+# parse the Meraki alert and return the status and body of the response for Meraki, like alert() in app.py
+async def receive_alert(body, forwarded=False):
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or "alertType" not in data:
+        return 400, "Request body is not a Meraki alert"
+    if data["alertType"] in alerts.ALERT_TYPES and "deviceSerial" not in data:
+        return 400, "Alert is missing the device serial"
+
+    alert_type = data["alertType"]
+    metrics.ALERTS_RECEIVED.inc(alert_type=alert_type)
+    event_log.log_event("alert_received", alert_type=alert_type, serial=data.get("deviceSerial"),
+                        network_id=data.get("networkId"), network_name=data.get("networkName"))
+    started = time.perf_counter()
+    try:
+        # an alert forwarded by another receiver is handled here even if the two disagree on the owner for a moment,
+        # so it can't bounce between them
+        if cluster is not None and not forwarded:
+            owner_id, owner_url = cluster.owner(data.get("networkId"))
+            if owner_id != cluster.worker_id:
+                event_log.log_event("alert_forwarded", alert_type=alert_type, serial=data.get("deviceSerial"),
+                                    network_id=data.get("networkId"), owner=owner_id)
+                # forwarding blocks on the owner, so it runs on the default thread pool rather than a database thread
+                text, status = await asyncio.get_running_loop().run_in_executor(None, cluster.forward, owner_url, body)
+
+                return status, text
+
+        await process_alert(data)
+    except Exception:
+        metrics.ALERT_ERRORS.inc(stage="request")
+        event_log.log_event("alert_failed", level=logging.ERROR, exc_info=True, alert_type=alert_type,
+                            serial=data.get("deviceSerial"), network_id=data.get("networkId"))
+
+        return 500, "Alert processing failed"
+    finally:
+        metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - started, alert_type=alert_type)
+
+    return 200, "Webhook receiver is running - check the terminal for alert information"
+
+
+# report the state of the correlation windows, the outbox, and the database, like /queue in app.py
+def queue_status():
+    stats = {"mode": "asgi"}
+    if correlator is not None:
+        stats["correlation"] = correlator.stats()
+    stats["outbox"] = outbox.stats()
+    stats["remedy_token"] = client.token_manager.stats()
+    stats["database"] = db.stats()
+    if cluster is not None:
+        stats["cluster"] = cluster.stats()
+    if history is not None:
+        stats["status_history"] = history.stats()
+
+    return stats
+
+
+async def startup():
+    await client.start()
+    if cluster is not None:
+        cluster.start()
+    outbox.start()
+    if history is not None:
+        history.start()
+    if correlator is not None:
+        correlator.start()
+
+
+# decide the alerts still held in a window and wait for the tickets being sent before the process exits -
+# tickets that are still waiting are sent after the next start
+async def shutdown():
+    if correlator is not None:
+        await run_in_db(correlator.shutdown)
+    await outbox.stop()
+    await client.close()
+    if history is not None:
+        await run_in_db(history.shutdown)
+    # leave the cluster once this receiver's alerts and tickets are drained, so the others take over its networks
+    if cluster is not None:
+        await run_in_db(cluster.shutdown)
+    db_executor.shutdown(wait=True)
+    db.close_all_connections()
+
+
+async def read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if len(body) > MAX_BODY_SIZE:
+            return None
+
+    return body
+
+
+async def respond(send, status, body, content_type="text/html; charset=utf-8"):
+    body = body.encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await startup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+
+            return
+
+
+"""
+The webhooks will send information to this application, which serves the same routes as app.py
+"""
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+
+        return
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    method = scope["method"]
+    if path == "/" and method == "POST":
+        body = await read_body(receive)
+        if body is None:
+            await respond(send, 413, "Request body is too large")
+        else:
+            forwarded = FORWARDED_HEADER.lower().encode() in (name for name, _ in scope["headers"])
+            await respond(send, *await receive_alert(body, forwarded))
+    elif path == "/" and method == "GET":
+        await respond(send, 200, "Webhook receiver is running - check the terminal for alert information")
+    elif path == "/metrics" and method == "GET":
+        # the outbox gauge is read from the database, so the metrics are rendered off the event loop
+        await respond(send, 200, await run_in_db(metrics.render), "text/plain; version=0.0.4")
+    elif path == "/queue" and method == "GET":
+        await respond(send, 200, json.dumps(await run_in_db(queue_status)), "application/json")
+    elif path in ("/", "/metrics", "/queue"):
+        await respond(send, 405, "Method Not Allowed")
+    else:
+        await respond(send, 404, "Not Found")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import meraki
+import os
+import time
+import datetime
+from dotenv import load_dotenv
+import alerts
+import db
+import populate
+import remedy_functions
+import status_history
+from topology import Topology
+from incidents import IncidentRegistry
+from outbox import OutboxDispatcher
+from status_history import StatusHistory
+
+# load environmental variables
+load_dotenv()
+
+API_KEY = os.getenv("MERAKI_TOKEN")
+ORG_NAME = os.getenv("MERAKI_ORG")
+DB_FILE = os.getenv("DB_FILE", "sqlite.db")
+# seconds of history fetched and applied at a time - only one window of changes is held in memory
+BACKFILL_WINDOW = float(os.getenv("BACKFILL_WINDOW", 3600))
+# seconds of history to replay the first time, before a cursor has been stored (at most MERAKI_HISTORY_LIMIT)
+BACKFILL_LOOKBACK = float(os.getenv("BACKFILL_LOOKBACK", 86400))
+# the change history API only accepts a start time up to 14 days back
+MERAKI_HISTORY_LIMIT = 14 * 86400
+# seconds to stay behind the current time, so changes Meraki is still recording are picked up by the next run
+BACKFILL_LAG = 60
+# seconds of each network's changes decided together, like the webhook receiver's correlation window - 0 replays
+# every change on its own, as the receiver handles alerts without a window
+CORRELATION_WINDOW = float(os.getenv("ALERT_CORRELATION_WINDOW", 0))
+
+# the alert that a change to each status stands for, by type of device
+STATUS_ALERTS = {
+    "down": alerts.TICKET_ALERTS,
+    "up": {device_type: alert_type for alert_type, device_type in alerts.UP_ALERTS.items()}
+}
+
+# the meta key holding the time up to which the organization's history has been applied
+def cursor_key(org_id):
+    return "backfill_cursor:" + str(org_id)
+
+# fetch every availability change of the organization's devices between t0 and t1
+def get_changes(dashboard, org_id, t0, t1):
+    return dashboard.organizations.getOrganizationDevicesAvailabilitiesChangeHistory(org_id,
+                                                                                     total_pages="all",
+                                                                                     perPage=1000,
+                                                                                     t0=_iso(t0),
+                                                                                     t1=_iso(t1))
+
+# turn availability changes into the alerts Meraki would have sent, grouped by network in the order they happened -
+# devices that aren't in the database are skipped, and a change that repeats the device's last status is dropped
+def get_alerts(changes, topology):
+    batches = {}
+    last_status = {}
+    for change in sorted(changes, key=lambda change: change["ts"]):
+        serial = change["device"]["serial"]
+        device = topology.get(serial)
+        if device is None:
+            continue
+
+        old_status = _status(change["details"].get("old", []))
+        status = _status(change["details"].get("new", []))
+        if status is None or status == last_status.get(serial, old_status):
+            continue
+        last_status[serial] = status
+
+        batches.setdefault(device.network_id, []).append({
+            "alertType": STATUS_ALERTS[status][device.device_type],
+            "deviceSerial": serial,
+            "networkId": device.network_id,
+            "networkName": change["network"]["name"],
+            "occurredAt": change["ts"]
+        })
+
+    return batches
+
+# split a network's alerts, in the order they happened, into the batches the webhook receiver would have decided
+# together - each batch holds the alerts within the correlation window of its first alert
+def get_batches(network_alerts, window=CORRELATION_WINDOW):
+    batches = []
+    started = None
+    for data in network_alerts:
+        occurred_at = alerts.occurred_at(data)
+        if not batches or window <= 0 or occurred_at is None or started is None or occurred_at >= started + window:
+            batches.append([])
+            started = occurred_at
+        batches[-1].append(data)
+
+    return batches
+
+# replay the changes between t0 and t1 through the same decision logic as the webhooks, batched by the correlation
+# window rather than all at once so tickets are decided as they were live, and then move the cursor to t1 - each batch
+# is its own transaction, so the receiver's writes wait for one batch at most, and the changes of a window that failed
+# part way are replayed by the next run, which skips the ones already applied - returns the number of changes fetched
+# and the number of alerts replayed
+def backfill_window(dashboard, conn, remedy, topology, incidents, org_id, t0, t1):
+    changes = get_changes(dashboard, org_id, t0, t1)
+    batches = get_alerts(changes, topology)
+
+    try:
+        for network_alerts in batches.values():
+            for batch in get_batches(network_alerts):
+                with db.batch(conn) as batch_conn:
+                    alerts.handle_alerts(batch_conn, remedy, topology, incidents, batch)
+    except BaseException:
+        # the statuses and tickets of the batch that was rolled back are already changed in memory, so read them
+        # back from the database
+        topology.load(conn)
+        incidents.load(conn)
+        raise
+    db.set_meta(conn, cursor_key(org_id), t1)
+
+    return len(changes), sum(len(batch) for batch in batches.values())
+
+# replay the organization's history from the stored cursor (or the lookback) up to now, one window at a time
+def backfill(dashboard, conn, remedy, topology, incidents, org_id):
+    now = time.time()
+    end = now - BACKFILL_LAG
+    t0 = db.query_meta(conn, cursor_key(org_id), end - BACKFILL_LOOKBACK)
+
+    # a cursor older than Meraki will answer for would fail every run, so start at the oldest change still available,
+    # a minute inside the limit so the request isn't rejected by the time it arrives
+    oldest = now - MERAKI_HISTORY_LIMIT + BACKFILL_LAG
+    if t0 < oldest:
+        print("Changes from " + _iso(t0) + " to " + _iso(oldest) + " are older than Meraki keeps and can't be replayed")
+        t0 = oldest
+
+    while t0 < end:
+        t1 = min(t0 + BACKFILL_WINDOW, end)
+        changes, replayed = backfill_window(dashboard, conn, remedy, topology, incidents, org_id, t0, t1)
+        print(_iso(t0) + " to " + _iso(t1) + ": " + str(changes) + " changes, " + str(replayed) + " alerts replayed")
+        t0 = t1
+
+# return the status of the device after a change, in the form used in the database
+def _status(details):
+    for detail in details:
+        if detail["name"] == "status":
+            return populate.get_device_status(detail["value"])
+
+    return None
+
+def _iso(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+if __name__ == "__main__":
+    # connect to Meraki dashboard
+    dashboard = meraki.DashboardAPI(API_KEY, suppress_logging=True)
+
+    # The remedy data structure will hold all the info to make API requests to Remedy
+    remedy = {
+        "url": os.environ["REMEDY_URL"],
+        "username": os.environ["REMEDY_USERNAME"],
+        "password": os.environ["REMEDY_PASSWORD"]
+    }
+    remedy["token_manager"] = remedy_functions.TokenManager(remedy)
+    remedy["auto_resolve"] = os.getenv("REMEDY_AUTO_RESOLVE", "false").lower() == "true"
+
+    # the replayed changes are recorded in the status history at the times they happened
+    history = StatusHistory(DB_FILE) if status_history.STATUS_HISTORY else None
+    topology = Topology(history=history)
+    incidents = IncidentRegistry()
+    with db.get_pool(DB_FILE).connection() as conn:
+        db.create_tables(conn)
+        topology.load(conn)
+        incidents.load(conn)
+
+        # tickets are only stored in the outbox here and sent by the web server - the dispatcher is never started, so
+        # only the process that serves the webhooks sends tickets
+        outbox = OutboxDispatcher(DB_FILE, remedy, incidents)
+        remedy["outbox"] = outbox
+        if history is not None:
+            history.start()
+
+        org_id = populate.get_org_id(dashboard, ORG_NAME)
+        try:
+            backfill(dashboard, conn, remedy, topology, incidents, org_id)
+        except meraki.exceptions.APIError as e:
+            print("Backfill failed: " + str(e))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if history is not None:
+                history.shutdown()
+            print(str(outbox.stats()["pending"]) + " tickets waiting in the outbox for the web server")
+
+    db.close_all_connections()
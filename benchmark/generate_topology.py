@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+
+# return a Meraki-style serial number for the nth device of a type
+def make_serial(prefix, n):
+    digits = "{:08d}".format(n)
+
+    return prefix + "-" + digits[:4] + "-" + digits[4:]
+
+# build a synthetic topology where every router has the same number of switches and every switch has the same number of aps
+# returns the routers, switches, and aps of each network, keyed by network id
+def generate(networks, routers_per_network, switches_per_router, aps_per_switch):
+    topology = {}
+    router_count = switch_count = ap_count = 0
+    for n in range(networks):
+        routers, switches, aps = [], [], []
+        for r in range(routers_per_network):
+            router = make_serial("Q2MX", router_count)
+            router_count += 1
+            routers.append((router, "up"))
+            for s in range(switches_per_router):
+                switch = make_serial("Q2MS", switch_count)
+                switch_count += 1
+                switches.append((switch, "up", router))
+                for a in range(aps_per_switch):
+                    aps.append((make_serial("Q2MR", ap_count), "up", switch))
+                    ap_count += 1
+        topology["L_" + str(n)] = (routers, switches, aps)
+
+    return topology
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a database with a synthetic router/switch/AP topology")
+    parser.add_argument("--db", default="bench.db", help="database file to create")
+    parser.add_argument("--networks", type=int, default=10)
+    parser.add_argument("--routers", type=int, default=1, help="routers per network")
+    parser.add_argument("--switches", type=int, default=10, help="switches per router")
+    parser.add_argument("--aps", type=int, default=20, help="aps per switch")
+    parser.add_argument("--org", default="bench-org", help="organization id to tag the devices with")
+    args = parser.parse_args()
+
+    # start from an empty database so repeated runs are comparable
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+    conn = db.create_connection(args.db)
+    db.create_tables(conn)
+    topology = generate(args.networks, args.routers, args.switches, args.aps)
+    for network_id, (routers, switches, aps) in topology.items():
+        db.add_devices(conn, routers, switches, aps, args.org, network_id)
+
+    print(str(len(db.query_all_routers(conn))) + " routers, " + str(len(db.query_all_switches(conn))) + " switches, "
+          + str(len(db.query_all_aps(conn))) + " aps in " + str(args.networks) + " networks written to " + args.db)
+    db.close_connection(conn)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the behaviour of the stub, set from the command line
+config = {"latency": 0.2, "jitter": 0.05, "error_rate": 0.0, "token_ttl": 3600}
+# what the stub has seen
+counters = {"logins": 0, "tickets": 0, "errors": 0, "unauthorized": 0}
+counters_lock = threading.Lock()
+
+def count(name):
+    with counters_lock:
+        counters[name] += 1
+
+        return counters[name]
+
+# return an AR-JWT shaped token with an exp claim, like the one Remedy hands out
+def make_token():
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    return encode({"alg": "HS256"}) + "." + encode({"exp": int(time.time() + config["token_ttl"])}) + ".stub"
+
+# this class answers the Remedy login and incident creation endpoints after a configurable delay
+class RemedyStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self):
+        time.sleep(max(0, random.gauss(config["latency"], config["jitter"])))
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+
+        if path == "/api/jwt/login":
+            self._delay()
+            count("logins")
+            self._respond(200, make_token().encode(), {"Content-Type": "text/plain"})
+        elif path == "/api/arsys/v1/entry/HPD:IncidentInterface_Create":
+            self._delay()
+            if not self.headers.get("Authorization", "").startswith("AR-JWT "):
+                count("unauthorized")
+                self._respond(401)
+            elif random.random() < config["error_rate"]:
+                count("errors")
+                self._respond(503)
+            else:
+                n = count("tickets")
+                body = json.dumps({"values": {"Incident Number": "INC{:012d}".format(n)}}).encode()
+                self._respond(201, body, {
+                    "Content-Type": "application/json",
+                    "Location": "http://{}/api/arsys/v1/entry/HPD:IncidentInterface_Create/{:015d}".format(self.headers.get("Host"), n)
+                })
+        else:
+            self._respond(404)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with counters_lock:
+                body = json.dumps(counters).encode()
+            self._respond(200, body, {"Content-Type": "application/json"})
+        else:
+            self._respond(404)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in for the Remedy login and incident creation APIs")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.2, help="mean seconds before each answer")
+    parser.add_argument("--jitter", type=float, default=0.05, help="standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of tickets answered with 503")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="lifetime of the tokens handed out")
+    args = parser.parse_args()
+
+    config.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, token_ttl=args.token_ttl)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), RemedyStubHandler)
+    server.daemon_threads = True
+    print("Remedy stub listening on http://127.0.0.1:" + str(args.port) + " - counters at /stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
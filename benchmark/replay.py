@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+
+# the down and up alert types for each table
+ALERTS = {
+    "router": ("Cellular went down", "Cellular came up"),
+    "switch": ("switches went down", "switches came up"),
+    "AP": ("APs went down", "APs came up")
+}
+
+# return a Meraki webhook payload for a device
+def make_alert(alert_type, serial, network_id):
+    return {
+        "version": "0.1",
+        "sharedSecret": "",
+        "sentAt": time.strftime("%Y-%m-%dT%H:%M:%S.000000Z", time.gmtime()),
+        "organizationId": "bench-org",
+        "organizationName": "Benchmark",
+        "networkId": network_id,
+        "networkName": "Network " + str(network_id),
+        "deviceSerial": serial,
+        "alertType": alert_type,
+        "alertData": {}
+    }
+
+# steady state: isolated devices going down and coming back up in random order
+def steady_scenario(devices, count):
+    down = []
+    alerts = []
+    while len(alerts) < count:
+        if down and random.random() < 0.5:
+            serial, device_type, network_id = down.pop(random.randrange(len(down)))
+            alerts.append(make_alert(ALERTS[device_type][1], serial, network_id))
+        else:
+            serial, device_type, network_id = random.choice(devices)
+            down.append((serial, device_type, network_id))
+            alerts.append(make_alert(ALERTS[device_type][0], serial, network_id))
+
+    return alerts
+
+# outage storms: whole routers go down, followed by every switch and ap behind them, with some children
+# arriving before their parents the way Meraki sometimes sends them
+def storm_scenario(devices, count):
+    children = {}
+    for serial, device_type, network_id, connection in devices:
+        children.setdefault(connection, []).append((serial, device_type, network_id))
+    routers = [device[:3] for device in devices if device[1] == "router"]
+    random.shuffle(routers)
+
+    alerts = []
+    for router in routers:
+        outage = [router]
+        for switch in children.get(router[0], []):
+            outage.append(switch)
+            outage.extend(children.get(switch[0], []))
+        storm = [make_alert(ALERTS[device_type][0], serial, network_id) for serial, device_type, network_id in outage]
+        # swap a few neighbours so the order is not perfect
+        for i in range(len(storm) // 10):
+            j = random.randrange(len(storm) - 1)
+            storm[j], storm[j + 1] = storm[j + 1], storm[j]
+        alerts.extend(storm)
+        if len(alerts) >= count:
+            break
+
+    return alerts[:count]
+
+# flapping: a small set of devices going down and up over and over
+def flap_scenario(devices, count):
+    flappers = random.sample(devices, min(len(devices), max(1, count // 20)))
+    alerts = []
+    while len(alerts) < count:
+        serial, device_type, network_id = random.choice(flappers)
+        alerts.append(make_alert(ALERTS[device_type][0], serial, network_id))
+        alerts.append(make_alert(ALERTS[device_type][1], serial, network_id))
+
+    return alerts[:count]
+
+# return every device in the database as (serial, device type, network id, connection)
+def load_devices(db_file):
+    conn = db.create_connection(db_file)
+    devices = [(serial, device_type, network_id, connection)
+               for serial, device_type, connection, status, network_id in db.query_topology(conn)]
+    db.close_connection(conn)
+
+    return devices
+
+def get_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, ValueError):
+        return {}
+
+# send one alert and return how long the receiver took to answer, and its status code
+def send_alert(url, alert):
+    body = json.dumps(alert).encode()
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+
+    return time.perf_counter() - started, status
+
+# send the alerts with the given concurrency, at most rate alerts per second (0 for as fast as possible)
+def replay(url, alerts, concurrency, rate):
+    results = []
+    results_lock = threading.Lock()
+
+    def send(alert):
+        result = send_alert(url, alert)
+        with results_lock:
+            results.append(result)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, alert in enumerate(alerts):
+            if rate > 0:
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(send, alert)
+    elapsed = time.perf_counter() - started
+
+    return results, elapsed
+
+# wait until the receiver has nothing left queued, buffered, or waiting in the outbox
+def wait_for_drain(queue_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = get_json(queue_url)
+        busy = stats.get("queue_depth", 0) + stats.get("in_flight", 0)
+        busy += stats.get("correlation", {}).get("alerts", 0)
+        busy += stats.get("outbox", {}).get("pending", 0) + stats.get("outbox", {}).get("in_flight", 0)
+        if busy == 0:
+            return True
+        time.sleep(0.5)
+
+    return False
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay synthetic Meraki alert streams at the webhook receiver")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/", help="webhook receiver URL")
+    parser.add_argument("--stub", default="http://127.0.0.1:8080", help="Remedy stub URL, to count tickets")
+    parser.add_argument("--db", default="bench.db", help="database created by generate_topology.py")
+    parser.add_argument("--scenario", choices=("steady", "storm", "flap"), default="steady")
+    parser.add_argument("--alerts", type=int, default=1000, help="number of alerts to send")
+    parser.add_argument("--concurrency", type=int, default=20, help="alerts in flight at once")
+    parser.add_argument("--rate", type=float, default=0, help="alerts per second (0 for as fast as possible)")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="seconds to wait for the receiver to finish")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    devices = load_devices(args.db)
+    if args.scenario == "storm":
+        alerts = storm_scenario(devices, args.alerts)
+    elif args.scenario == "flap":
+        alerts = flap_scenario([device[:3] for device in devices], args.alerts)
+    else:
+        alerts = steady_scenario([device[:3] for device in devices], args.alerts)
+
+    queue_url = args.url.rstrip("/") + "/queue"
+    stub_before = get_json(args.stub + "/stats")
+    receiver_before = get_json(queue_url).get("database", {})
+
+    results, elapsed = replay(args.url, alerts, args.concurrency, args.rate)
+    drained = wait_for_drain(queue_url, args.drain_timeout)
+
+    stub_after = get_json(args.stub + "/stats")
+    receiver_after = get_json(queue_url).get("database", {})
+    latencies = [latency for latency, status in results]
+    errors = sum(1 for latency, status in results if status == 0 or status >= 400)
+
+    print("scenario:        " + args.scenario)
+    print("alerts sent:     " + str(len(results)) + " (" + str(errors) + " errors)")
+    print("alerts/sec:      {:.1f}".format(len(results) / elapsed if elapsed else 0))
+    print("latency p50:     {:.1f} ms".format(percentile(latencies, 50) * 1000))
+    print("latency p99:     {:.1f} ms".format(percentile(latencies, 99) * 1000))
+    print("tickets created: " + str(stub_after.get("tickets", 0) - stub_before.get("tickets", 0)))
+    print("remedy logins:   " + str(stub_after.get("logins", 0) - stub_before.get("logins", 0)))
+    print("db lock waits:   " + str(receiver_after.get("lock_waits", 0) - receiver_before.get("lock_waits", 0)))
+    print("db pool waits:   " + str(receiver_after.get("pool_waits", 0) - receiver_before.get("pool_waits", 0)))
+    if not drained:
+        print("warning: the receiver had not finished processing after " + str(args.drain_timeout) + " seconds")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+The configuration and state shared by the Flask receiver in app.py and the ASGI receiver in asgi.py - importing
+this module reads the settings, brings the database up to the current schema, and loads the topology and open tickets.
+Only one of the two receivers runs in a process, and it adds its own Remedy client and outbox to the shared remedy settings.
+The cluster membership is set up here too, so either receiver can run as one copy of several sharing the database - each
+receiver starts it and leaves the cluster when it shuts down.
+"""
+import os
+from dotenv import load_dotenv
+import alerts
+import db
+import status_history
+from cluster import Cluster
+from topology import Topology
+from incidents import IncidentRegistry
+from status_history import StatusHistory
+
+# Global variables
+load_dotenv()
+
+# The remedy data structure will hold all the info to make API requests to Remedy
+remedy = {
+    "url": os.environ["REMEDY_URL"],
+    "username": os.environ["REMEDY_USERNAME"],
+    "password": os.environ["REMEDY_PASSWORD"]
+}
+# Resolve a device's ticket in Remedy when Meraki reports it came back up
+remedy["auto_resolve"] = os.getenv("REMEDY_AUTO_RESOLVE", "false").lower() == "true"
+
+# seconds to hold alerts per network so they are decided as one batch - 0 handles every alert on its own
+CORRELATION_WINDOW = float(os.getenv("ALERT_CORRELATION_WINDOW", 0))
+# seconds between checks for topology changes made by populate.py or sync.py
+TOPOLOGY_REFRESH_INTERVAL = float(os.getenv("TOPOLOGY_REFRESH_INTERVAL", 5))
+# tickets are stored in an outbox and sent to Remedy in the background, with these retry and circuit breaker settings -
+# the number of tickets in flight at once is set by each receiver, since it costs a thread in app.py and a coroutine in asgi.py
+OUTBOX_BASE_DELAY = float(os.getenv("OUTBOX_BASE_DELAY", 5))
+OUTBOX_MAX_DELAY = float(os.getenv("OUTBOX_MAX_DELAY", 600))
+OUTBOX_BREAKER_THRESHOLD = int(os.getenv("OUTBOX_BREAKER_THRESHOLD", 5))
+OUTBOX_BREAKER_COOLDOWN = float(os.getenv("OUTBOX_BREAKER_COOLDOWN", 60))
+# seconds a ticket is leased to the receiver sending it - another process sharing the database sends it only after that
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", 300))
+DB_FILE = os.getenv("DB_FILE", "sqlite.db")
+# to run several receivers on one database, give each one the URL the others can reach it at - every network is then
+# handled by exactly one of them, and alerts that arrive at another receiver are forwarded to it
+CLUSTER_WORKER_URL = os.getenv("CLUSTER_WORKER_URL")
+CLUSTER_WORKER_ID = os.getenv("CLUSTER_WORKER_ID", CLUSTER_WORKER_URL)
+CLUSTER_HEARTBEAT_INTERVAL = float(os.getenv("CLUSTER_HEARTBEAT_INTERVAL", 2))
+CLUSTER_LEASE_TIMEOUT = float(os.getenv("CLUSTER_LEASE_TIMEOUT", 10))
+# the devices and links are kept in this binary file between starts, so a large topology loads without reading every
+# table - it is rewritten whenever the topology changes, and an empty value turns it off
+TOPOLOGY_SNAPSHOT = os.getenv("TOPOLOGY_SNAPSHOT", DB_FILE + ".topology")
+
+# The status history records every status change from its own thread, so recording one never waits on the database
+history = StatusHistory(DB_FILE) if status_history.STATUS_HISTORY else None
+# The topology index holds every device, its upstream device and its status in memory, and writes status changes through to the database
+topology = Topology(snapshot_path=TOPOLOGY_SNAPSHOT or None, history=history)
+# The incident registry holds the open Remedy tickets, so repeated alerts are caught without calling Remedy
+incidents = IncidentRegistry()
+with db.get_pool(DB_FILE).connection() as conn:
+    # bring a database created by an older version of this code up to the current schema
+    db.create_tables(conn)
+    topology.load(conn)
+    incidents.load(conn)
+
+
+# reload the topology and the open tickets, which other receivers may have changed for the networks this one just took over
+def reload_state():
+    with db.get_pool(DB_FILE).connection() as conn:
+        topology.load(conn)
+        incidents.load(conn)
+
+
+# The cluster decides which receiver owns each network - it is None when this receiver runs on its own
+cluster = None
+if CLUSTER_WORKER_URL:
+    cluster = Cluster(DB_FILE, CLUSTER_WORKER_ID, CLUSTER_WORKER_URL,
+                      heartbeat_interval=CLUSTER_HEARTBEAT_INTERVAL,
+                      lease_timeout=CLUSTER_LEASE_TIMEOUT,
+                      on_change=reload_state)
+
+
+# the networks whose outbox tickets this receiver sends - with several receivers, only the ones it owns
+def outbox_networks():
+    return (lambda: cluster.owned_networks(topology)) if cluster is not None else None
+
+
+# handle a batch of alerts on a connection borrowed from the database connection pool
+def process_alerts(batch):
+    # The database holds information about the status of the Meraki devices and the topology of the network
+    with db.get_pool(DB_FILE).connection() as conn:
+        topology.refresh(conn, TOPOLOGY_REFRESH_INTERVAL)
+        alerts.handle_alerts(conn, remedy, topology, incidents, batch)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import bisect
+import hashlib
+import threading
+import time
+import requests
+import db
+import event_log
+import metrics
+
+# the header that marks an alert forwarded by another receiver, which is always handled where it lands
+FORWARDED_HEADER = "X-Alert-Forwarded-By"
+# points each worker gets on the hash ring - more points spread the networks more evenly
+RING_REPLICAS = 64
+
+def _hash(key):
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+# this class gives every network to exactly one of the receivers sharing the database - each receiver sends a heartbeat
+# to the workers table, and the live receivers are placed on a consistent hash ring keyed by network id, so a receiver
+# joining or leaving only moves the networks next to it on the ring and a receiver whose heartbeat stops is dropped
+# after the lease timeout
+class Cluster:
+    def __init__(self, db_file, worker_id, url, heartbeat_interval=2, lease_timeout=10, forward_timeout=10, on_change=None):
+        self.db_file = db_file
+        self.worker_id = worker_id
+        self.url = url.rstrip("/")
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_timeout = lease_timeout
+        self.forward_timeout = forward_timeout
+        self.on_change = on_change
+
+        self.session = requests.Session()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.workers = {}
+        self.ring = []
+        self.points = []
+        self.version = 0
+        self.owned = (None, None, None)
+
+    # join the cluster and start the thread that sends heartbeats and follows the other workers
+    def start(self):
+        self.running = True
+        self._heartbeat()
+        self.thread = threading.Thread(target=self._run, name="cluster-heartbeat", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait(self.heartbeat_interval)
+                if not self.running:
+                    return
+
+            try:
+                self._heartbeat()
+            except Exception as e:
+                event_log.error("cluster_heartbeat", worker_id=self.worker_id, error=str(e))
+
+    # record this worker's heartbeat and rebuild the ring if workers joined or left
+    def _heartbeat(self):
+        now = time.time()
+        with db.get_pool(self.db_file).connection() as conn:
+            db.heartbeat_worker(conn, self.worker_id, self.url, now)
+            workers = dict(db.query_live_workers(conn, now - self.lease_timeout))
+
+        if workers == self.workers:
+            return
+
+        ring = sorted((_hash(worker_id + "#" + str(i)), worker_id) for worker_id in workers for i in range(RING_REPLICAS))
+        with self.cond:
+            # the first ring is built as the worker starts, right after it loaded its state
+            first = not self.ring
+            joined = sorted(set(workers) - set(self.workers))
+            left = sorted(set(self.workers) - set(workers))
+            self.workers = workers
+            self.ring = ring
+            self.points = [point for point, worker_id in ring]
+            self.version += 1
+
+        event_log.log_event("cluster_changed", worker_id=self.worker_id, workers=len(workers), joined=joined, left=left)
+        if self.on_change is not None and not first:
+            self.on_change()
+
+    # return the id and URL of the worker that owns a network
+    def owner(self, network_id):
+        with self.cond:
+            if not self.ring:
+                return self.worker_id, self.url
+
+            i = bisect.bisect(self.points, _hash(network_id or "")) % len(self.ring)
+            worker_id = self.ring[i][1]
+
+            return worker_id, self.workers[worker_id]
+
+    def owns(self, network_id):
+        return self.owner(network_id)[0] == self.worker_id
+
+    # return the ids of the networks in the topology that this worker owns, recomputed only when the workers or the topology change
+    def owned_networks(self, topology):
+        version, topology_version, networks = self.owned
+        if version != self.version or topology_version != topology.version:
+            networks = frozenset(network_id for network_id in topology.network_ids() if self.owns(network_id))
+            self.owned = (self.version, topology.version, networks)
+
+        return networks
+
+    # send an alert to the worker that owns its network, along with any extra headers, returning the owner's response as (body, status)
+    def forward(self, url, body, extra_headers=None):
+        headers = dict(extra_headers or {})
+        headers["Content-Type"] = "application/json"
+        headers[FORWARDED_HEADER] = self.worker_id
+
+        try:
+            response = self.session.post(url + "/", data=body, headers=headers, timeout=self.forward_timeout)
+        except requests.RequestException as e:
+            metrics.ALERTS_FORWARDED.inc(result="failed")
+            event_log.error("alert_forward", owner=url, error=str(e))
+
+            return "Owner of the network is unavailable", 503
+
+        metrics.ALERTS_FORWARDED.inc(result=str(response.status_code))
+
+        return response.text, response.status_code
+
+    # leave the cluster, so the other workers take over this worker's networks right away
+    def shutdown(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+        with db.get_pool(self.db_file).connection() as conn:
+            db.delete_worker(conn, self.worker_id)
+        self.session.close()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "worker_id": self.worker_id,
+                "workers": dict(self.workers),
+                "version": self.version
+            }
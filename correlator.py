@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import threading
+import time
+import logging
+import event_log
+import metrics
+
+# this class holds alerts for a short window per network and hands each network's alerts over as one batch,
+# so an upstream outage and the flood of downstream alerts behind it are decided together
+class AlertCorrelator:
+    def __init__(self, handler, window):
+        self.handler = handler
+        self.window = window
+        self.buffers = {}
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.batches = 0
+
+    # start the thread that flushes each network's alerts when its window closes
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="alert-correlator", daemon=True)
+        self.thread.start()
+
+    # buffer an alert - the first alert for a network opens its window
+    def add(self, data):
+        network_id = data.get("networkId")
+        now = time.monotonic()
+        with self.cond:
+            buffer = self.buffers.get(network_id)
+            if buffer is None:
+                self.buffers[network_id] = (now + self.window, [(now, data)])
+                self.cond.notify()
+            else:
+                buffer[1].append((now, data))
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running:
+                    now = time.monotonic()
+                    due = [network_id for network_id, (deadline, batch) in self.buffers.items() if deadline <= now]
+                    if due:
+                        break
+                    if self.buffers:
+                        self.cond.wait(min(deadline for deadline, batch in self.buffers.values()) - now)
+                    else:
+                        self.cond.wait()
+                if not self.running:
+                    return
+                batches = [self.buffers.pop(network_id)[1] for network_id in due]
+
+            for batch in batches:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        self.batches += 1
+        now = time.monotonic()
+        for received_at, data in batch:
+            metrics.ALERT_STAGE_SECONDS.observe(now - received_at, alert_type=data.get("alertType"), stage="correlation_wait")
+        try:
+            self.handler([data for received_at, data in batch])
+        except Exception:
+            metrics.ALERT_ERRORS.inc(stage="correlation")
+            event_log.log_event("alert_batch_failed", level=logging.ERROR, exc_info=True, alerts=len(batch))
+
+    # stop the flush thread and hand over every alert that is still buffered
+    def shutdown(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+        with self.cond:
+            batches = [batch for deadline, batch in self.buffers.values()]
+            self.buffers.clear()
+        for batch in batches:
+            self._flush(batch)
+
+    # return how many networks and alerts are waiting for their window to close
+    def stats(self):
+        with self.cond:
+            return {
+                "networks": len(self.buffers),
+                "alerts": sum(len(batch) for deadline, batch in self.buffers.values()),
+                "batches": self.batches
+            }
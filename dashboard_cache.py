@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import gzip
+import hashlib
+import json
+import os
+
+# raised offline when a call was never recorded
+class CacheMiss(LookupError):
+    pass
+
+# this class stands in for meraki.DashboardAPI - with a dashboard, every call is passed on to it and the raw response is
+# written to a gzip compressed JSON file named after the call and its arguments, and without one, every call is answered
+# from those files, so the database can be rebuilt without the network
+class CachedDashboard:
+    def __init__(self, directory, dashboard=None):
+        self.directory = directory
+        self.dashboard = dashboard
+        self.organizations = _Section(self, "organizations")
+        self.networks = _Section(self, "networks")
+        self.devices = _Section(self, "devices")
+
+    def call(self, section, method, args, kwargs):
+        path = os.path.join(self.directory, _key(section, method, args, kwargs) + ".json.gz")
+        if self.dashboard is None:
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    return json.load(f)["response"]
+            except FileNotFoundError:
+                raise CacheMiss("No recorded response for " + section + "." + method + " in " + self.directory)
+
+        response = getattr(getattr(self.dashboard, section), method)(*args, **kwargs)
+
+        # write to a temporary file first, so an interrupted run never leaves a truncated response behind
+        os.makedirs(self.directory, exist_ok=True)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+            json.dump({"call": section + "." + method, "args": args, "kwargs": kwargs, "response": response}, f, default=str)
+        os.replace(path + ".tmp", path)
+
+        return response
+
+# one section of the API, such as organizations, whose methods are recorded or replayed
+class _Section:
+    def __init__(self, cache, name):
+        self._cache = cache
+        self._name = name
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            return self._cache.call(self._name, method, list(args), kwargs)
+
+        return call
+
+# name a call by its method and a hash of its arguments, so the same call made offline finds its response
+def _key(section, method, args, kwargs):
+    arguments = json.dumps([args, kwargs], sort_keys=True, default=str)
+
+    return section + "." + method + "-" + hashlib.sha1(arguments.encode()).hexdigest()[:16]
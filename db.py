@@ -16,14 +16,44 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 import sqlite3
+import json
+import os
+import threading
+import queue
+import random
+import time
+from contextlib import contextmanager
 from sqlite3 import Error
 from pprint import pprint
+import metrics
+import event_log
+
+# connection settings, tunable through environment variables
+BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)) # milliseconds to wait for a lock before giving up
+CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", -16000)) # negative values are in KiB
+SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL") # NORMAL is safe with WAL and avoids an fsync per commit
+STATEMENT_CACHE_SIZE = 128 # prepared statements kept per connection
+POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", 8)) # long-lived connections kept open per database file
+
+# writes that take longer than this many milliseconds are counted as lock waits - an UPDATE of one row by
+# primary key finishes well within it unless it had to wait for another connection's write lock
+LOCK_WAIT_THRESHOLD = float(os.getenv("SQLITE_LOCK_WAIT_THRESHOLD", 20))
+
+# connection pools, one per database file
+_pools = {}
+_pools_lock = threading.Lock()
+
+# counters for contention on the database
+_stats = {"lock_waits": 0, "lock_wait_seconds": 0.0, "pool_waits": 0}
+_stats_lock = threading.Lock()
 
 # connect to database
 def create_connection(db_file):
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT / 1000,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        configure_connection(conn)
 
         return conn
     except Error as e:
@@ -31,14 +61,151 @@ def create_connection(db_file):
 
         return None
 
-# create empty tables to hold routers, switches, and aps
+# turn on WAL mode so readers don't block the writer, and tune the connection for many small transactions
+def configure_connection(conn):
+    c = conn.cursor()
+
+    c.execute("PRAGMA journal_mode = WAL")
+    c.execute("PRAGMA synchronous = " + SYNCHRONOUS)
+    c.execute("PRAGMA busy_timeout = " + str(BUSY_TIMEOUT))
+    c.execute("PRAGMA cache_size = " + str(CACHE_SIZE))
+    c.execute("PRAGMA temp_store = MEMORY")
+
+# this class keeps a bounded set of open, configured connections that threads borrow and give back,
+# so each webhook reuses a warm connection and its prepared statements instead of opening the file again
+class ConnectionPool:
+    def __init__(self, db_file, size=POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    # borrow a connection, opening a new one if the pool is not full yet and none is idle
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+
+        if not create:
+            with _stats_lock:
+                _stats["pool_waits"] += 1
+
+            return self.idle.get()
+
+        try:
+            conn = sqlite3.connect(self.db_file, timeout=BUSY_TIMEOUT / 1000,
+                                   cached_statements=STATEMENT_CACHE_SIZE,
+                                   check_same_thread=False)
+            configure_connection(conn)
+        except Error:
+            with self.lock:
+                self.created -= 1
+            raise
+
+        return conn
+
+    # give a connection back, rolling back anything the borrower left uncommitted
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    # close the idle connections
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.created -= 1
+
+# return the shared connection pool for a database file
+def get_pool(db_file):
+    with _pools_lock:
+        pool = _pools.get(db_file)
+        if pool is None:
+            pool = _pools[db_file] = ConnectionPool(db_file)
+
+    return pool
+
+# time a write and count it as a lock wait if it was slow
+@contextmanager
+def _write_timer():
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    if elapsed * 1000 > LOCK_WAIT_THRESHOLD:
+        with _stats_lock:
+            _stats["lock_waits"] += 1
+            _stats["lock_wait_seconds"] += elapsed
+
+# a connection whose commits are held back, so the functions in this module can be called inside one transaction
+class _BatchConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+# run the writes made through the yielded connection as one transaction, committed at the end of the block
+# and rolled back if it raises
+@contextmanager
+def batch(conn):
+    try:
+        yield _BatchConnection(conn)
+    except BaseException:
+        conn.rollback()
+        raise
+    with _write_timer():
+        conn.commit()
+
+# return the contention counters - lock waits are slow writes, pool waits are threads that waited for a free connection
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+# close every pooled connection
+def close_all_connections():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+
+# create empty tables to hold routers, switches, and aps, and bring older databases up to the current schema
 def create_tables(conn):
     c = conn.cursor()
 
     c.execute("""
               CREATE TABLE IF NOT EXISTS routers
               ([serial] TEXT PRIMARY KEY,
-               [status] TEXT)
+               [status] TEXT,
+               [org_id] TEXT,
+               [network_id] TEXT)
               """)
 
     c.execute("""
@@ -46,6 +213,8 @@ def create_tables(conn):
               ([serial] TEXT PRIMARY KEY,
                [connection] TEXT,
                [status] TEXT,
+               [org_id] TEXT,
+               [network_id] TEXT,
               FOREIGN KEY (connection) REFERENCES routers (serial))
               """)
 
@@ -54,47 +223,249 @@ def create_tables(conn):
               ([serial] TEXT PRIMARY KEY,
                [connection] TEXT,
                [status] TEXT,
+               [org_id] TEXT,
+               [network_id] TEXT,
               FOREIGN KEY (connection) REFERENCES switches (serial))
               """)
 
-    conn.commit()
+    # the open_incidents table holds the Remedy tickets that are open for each device and alert type
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS open_incidents
+              ([serial] TEXT,
+               [alert_type] TEXT,
+               [network_id] TEXT,
+               [entry_id] TEXT,
+               [incident_number] TEXT,
+               [opened_at] REAL,
+              PRIMARY KEY (serial, alert_type))
+              """)
 
-# return all routers added to the database
-def query_all_routers(conn):
-    c = conn.cursor()
+    # the outbox table holds the tickets waiting to be created in Remedy - next_attempt_at is NULL once a ticket has failed for good,
+    # and a ticket being sent is leased to the dispatcher in claimed_by until lease_until, so no other process sends it too
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS outbox
+              ([id] INTEGER PRIMARY KEY AUTOINCREMENT,
+               [serial] TEXT,
+               [alert_type] TEXT,
+               [network_id] TEXT,
+               [description] TEXT,
+               [attempts] INTEGER DEFAULT 0,
+               [next_attempt_at] REAL,
+               [created_at] REAL,
+               [last_error] TEXT,
+               [claimed_by] TEXT,
+               [lease_until] REAL)
+              """)
+    c.execute("CREATE INDEX IF NOT EXISTS outbox_next_attempt ON outbox (next_attempt_at)")
 
+    # the workers table holds the receivers sharing this database, each with the time of its last heartbeat
     c.execute("""
-              SELECT *
-              FROM routers
+              CREATE TABLE IF NOT EXISTS workers
+              ([worker_id] TEXT PRIMARY KEY,
+               [url] TEXT,
+               [started_at] REAL,
+               [heartbeat_at] REAL)
+              """)
+
+    # the status_events table is an append-only record of every status change, and the outages table holds the same
+    # history rolled up into one row per outage of a device, with ended_at left empty while the device is still down -
+    # events are indexed by the hour they happened in, so recent events are found and old ones deleted by range
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS status_events
+              ([id] INTEGER PRIMARY KEY,
+               [serial] TEXT,
+               [device_type] TEXT,
+               [network_id] TEXT,
+               [status] TEXT,
+               [occurred_at] REAL,
+               [bucket] INTEGER)
+              """)
+    c.execute("CREATE INDEX IF NOT EXISTS status_events_bucket ON status_events (bucket, serial, occurred_at)")
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS outages
+              ([id] INTEGER PRIMARY KEY,
+               [serial] TEXT,
+               [device_type] TEXT,
+               [network_id] TEXT,
+               [started_at] REAL,
+               [ended_at] REAL)
+              """)
+    c.execute("CREATE INDEX IF NOT EXISTS outages_started ON outages (started_at, network_id)")
+    # the outages of a device, checked when a change written late is rolled up
+    c.execute("CREATE INDEX IF NOT EXISTS outages_serial ON outages (serial, started_at)")
+    # a device has at most one outage that hasn't ended
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS outages_open ON outages (serial) WHERE ended_at IS NULL")
+
+    # the meta table holds counters such as the topology version, which changes whenever devices are added, removed, or moved
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS meta
+              ([key] TEXT PRIMARY KEY,
+               [value] INTEGER)
               """)
+    # a random id given to the database when it is created, so files derived from one database, such as the topology
+    # snapshot, are never mistaken for another database that happens to be at the same topology version
+    c.execute("""INSERT INTO meta (key, value)
+              VALUES (?, ?)
+              ON CONFLICT (key) DO NOTHING""",
+              (DATABASE_ID, random.getrandbits(63)))
+
+    conn.commit()
+
+    migrate(conn)
+
+# the meta key holding the random id of the database
+DATABASE_ID = "database_id"
+
+# the schema version stored in PRAGMA user_version once migrate has run
+SCHEMA_VERSION = 2
+
+# upgrade a database created by an older version of this code in place - adding a column only changes the
+# table definition, so this is quick even on large tables and readers in WAL mode are not blocked
+def migrate(conn):
+    c = conn.cursor()
+
+    c.execute("PRAGMA user_version")
+    version = c.fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        # version 1: organization and network ids on every device, and indexes for lookups by network and by upstream device
+        if version < 1:
+            for table in ("routers", "switches", "aps"):
+                _add_columns(c, table, {"org_id": "TEXT", "network_id": "TEXT"})
+
+            c.execute("CREATE INDEX IF NOT EXISTS routers_network ON routers (network_id, serial, status)")
+            c.execute("CREATE INDEX IF NOT EXISTS switches_network ON switches (network_id, serial, connection, status)")
+            c.execute("CREATE INDEX IF NOT EXISTS aps_network ON aps (network_id, serial, connection, status)")
+            c.execute("CREATE INDEX IF NOT EXISTS switches_connection ON switches (connection, serial, status)")
+            c.execute("CREATE INDEX IF NOT EXISTS aps_connection ON aps (connection, serial, status)")
+
+        # version 2: the dispatcher holding the lease on an outbox ticket, and when the lease runs out
+        if version < 2:
+            _add_columns(c, "outbox", {"claimed_by": "TEXT", "lease_until": "REAL"})
+
+        c.execute("PRAGMA user_version = " + str(SCHEMA_VERSION))
+        conn.commit()
+    except Error:
+        conn.rollback()
+        raise
+
+# add the columns a table doesn't have yet, given as a dict of names and types
+def _add_columns(c, table, columns):
+    c.execute("PRAGMA table_info(" + table + ")")
+    existing = {row[1] for row in c.fetchall()}
+    for column, column_type in columns.items():
+        if column not in existing:
+            c.execute("ALTER TABLE " + table + " ADD COLUMN " + column + " " + column_type)
+
+# return all routers added to the database, or only the routers in one network
+def query_all_routers(conn, network_id=None):
+    c = conn.cursor()
+
+    if network_id is None:
+        c.execute("""
+                  SELECT serial, status
+                  FROM routers
+                  """)
+    else:
+        c.execute("""
+                  SELECT serial, status
+                  FROM routers
+                  WHERE network_id = ?
+                  """, (network_id,))
     routers = c.fetchall()
 
     return routers
 
-# return all switches added to the database
-def query_all_switches(conn):
+# return all switches added to the database, or only the switches in one network
+def query_all_switches(conn, network_id=None):
     c = conn.cursor()
 
-    c.execute("""
-              SELECT *
-              FROM switches
-              """)
+    if network_id is None:
+        c.execute("""
+                  SELECT serial, connection, status
+                  FROM switches
+                  """)
+    else:
+        c.execute("""
+                  SELECT serial, connection, status
+                  FROM switches
+                  WHERE network_id = ?
+                  """, (network_id,))
     switches = c.fetchall()
 
     return switches
 
-# return all aps added to the database
-def query_all_aps(conn):
+# return all aps added to the database, or only the aps in one network
+def query_all_aps(conn, network_id=None):
     c = conn.cursor()
 
-    c.execute("""SELECT *
-              FROM aps
-              """)
+    if network_id is None:
+        c.execute("""
+                  SELECT serial, connection, status
+                  FROM aps
+                  """)
+    else:
+        c.execute("""
+                  SELECT serial, connection, status
+                  FROM aps
+                  WHERE network_id = ?
+                  """, (network_id,))
     aps = c.fetchall()
 
     return aps
 
+# return every device in the database as (serial, device type, connection, status, network id)
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_topology")
+def query_topology(conn):
+    c = conn.cursor()
+
+    c.execute("""SELECT serial, 'router', NULL, status, network_id
+              FROM routers
+              UNION ALL
+              SELECT serial, 'switch', connection, status, network_id
+              FROM switches
+              UNION ALL
+              SELECT serial, 'AP', connection, status, network_id
+              FROM aps""")
+    devices = c.fetchall()
+
+    return devices
+
+# return the random id the database was given when it was created
+def query_database_id(conn):
+    return query_meta(conn, DATABASE_ID)
+
+# return the number of routers, switches, and aps
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_device_counts")
+def query_device_counts(conn):
+    c = conn.cursor()
+
+    c.execute("""SELECT (SELECT COUNT(*) FROM routers),
+              (SELECT COUNT(*) FROM switches),
+              (SELECT COUNT(*) FROM aps)""")
+    counts = c.fetchone()
+
+    return counts
+
+# return the serials of every router, switch, and ap that isn't up
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_down_devices")
+def query_down_devices(conn):
+    c = conn.cursor()
+
+    c.execute("""SELECT serial FROM routers WHERE status IS NOT 'up'
+              UNION ALL
+              SELECT serial FROM switches WHERE status IS NOT 'up'
+              UNION ALL
+              SELECT serial FROM aps WHERE status IS NOT 'up'""")
+    serials = [row[0] for row in c.fetchall()]
+
+    return serials
+
 # return the status of a specific router
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_router_status")
 def query_router_status(conn, serial):
     c = conn.cursor()
 
@@ -107,6 +478,7 @@ def query_router_status(conn, serial):
     return router_status
 
 # return the status of a specific switch
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_switch_status")
 def query_switch_status(conn, serial):
     c = conn.cursor()
 
@@ -119,6 +491,7 @@ def query_switch_status(conn, serial):
     return switch_status
 
 # return the status of a specific ap
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_ap_status")
 def query_ap_status(conn, serial):
     c = conn.cursor()
 
@@ -131,6 +504,7 @@ def query_ap_status(conn, serial):
     return ap_status
 
 # return the connection of a specific switch
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_switch_connection")
 def query_switch_connection(conn, serial):
     c = conn.cursor()
 
@@ -144,6 +518,7 @@ def query_switch_connection(conn, serial):
     return connection
 
 # return the connection of a specific ap
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_ap_connection")
 def query_ap_connection(conn, serial):
     c = conn.cursor()
 
@@ -157,6 +532,7 @@ def query_ap_connection(conn, serial):
     return connection
 
 # change the status of a specific device
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="update_device_status")
 def update_device_status(conn, device_type, serial, status):
     c = conn.cursor()
 
@@ -167,13 +543,63 @@ def update_device_status(conn, device_type, serial, status):
     elif device_type == "AP":
         table = "aps"
     else:
-        print("Unable to update device status because device type is not recognized")
+        event_log.warning("update_device_status", serial=serial, device_type=device_type, error="device type is not recognized")
 
         return
 
-    update_statement = "UPDATE " + table + " SET status = '" + status + "' WHERE serial = ?"
-    c.execute(update_statement, (serial,))
-    conn.commit()
+    update_statement = "UPDATE " + table + " SET status = ? WHERE serial = ?"
+    with _write_timer():
+        c.execute(update_statement, (status, serial))
+        conn.commit()
+
+# the switches behind a device, following switches connected to switches, and the aps behind the device or any of
+# those switches - the walk doesn't go past a device with an open ticket or in the :exclude JSON list of serials,
+# since it went down on its own and is brought back up by its own alert, and UNION stops it from looping on a cycle
+# in the connections
+SUBTREE_CTE = """WITH RECURSIVE excluded(serial) AS (
+                     SELECT serial FROM open_incidents
+                     UNION ALL
+                     SELECT value FROM json_each(:exclude)
+                 ),
+                 subtree_switches(serial) AS (
+                     SELECT serial FROM switches
+                     WHERE connection = :serial AND serial NOT IN excluded
+                     UNION
+                     SELECT switches.serial FROM switches JOIN subtree_switches ON switches.connection = subtree_switches.serial
+                     WHERE switches.serial NOT IN excluded
+                 ),
+                 subtree_aps(serial) AS (
+                     SELECT serial FROM aps
+                     WHERE (connection = :serial OR connection IN (SELECT serial FROM subtree_switches))
+                     AND serial NOT IN excluded
+                 )"""
+
+# mark every switch and ap behind a device that came back up as up, in one transaction with one statement per table,
+# and return the (device type, serial) of the devices that weren't up - the walk uses the connection indexes, so
+# a router with thousands of devices behind it costs two statements instead of thousands of alerts - the devices in
+# exclude, and the devices behind them, are left alone
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="update_subtree_status")
+def update_subtree_status(conn, serial, exclude=()):
+    c = conn.cursor()
+    parameters = {"serial": serial, "exclude": json.dumps(list(exclude))}
+
+    recovered = []
+    with _write_timer():
+        c.execute(SUBTREE_CTE + """
+                  UPDATE switches SET status = 'up'
+                  WHERE serial IN (SELECT serial FROM subtree_switches) AND status IS NOT 'up'
+                  RETURNING 'switch', serial""",
+                  parameters)
+        recovered.extend(c.fetchall())
+        c.execute(SUBTREE_CTE + """
+                  UPDATE aps SET status = 'up'
+                  WHERE serial IN (SELECT serial FROM subtree_aps) AND status IS NOT 'up'
+                  RETURNING 'AP', serial""",
+                  parameters)
+        recovered.extend(c.fetchall())
+        conn.commit()
+
+    return recovered
 
 # return serial number of one switch specified by serial number
 def query_specific_switch(conn, serial):
@@ -201,44 +627,444 @@ def query_specific_router(conn, serial):
 
     return router
 
-# add or update router to database
-def add_router(conn, serial, status):
+# add or update many routers, switches, and aps in one transaction - each argument is an iterable of tuples:
+# routers are (serial, status), switches and aps are (serial, status, connection)
+# a connection of None keeps the connection already stored for that device
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="add_devices")
+def add_devices(conn, routers=(), switches=(), aps=(), org_id=None, network_id=None):
     c = conn.cursor()
+    ids = (org_id, network_id)
 
-    c.execute("""INSERT OR REPLACE INTO routers (serial, status)
-              VALUES (?, ?)""",
-              (serial, status))
+    with conn:
+        c.executemany("""INSERT INTO routers (serial, status, org_id, network_id)
+                      VALUES (?, ?, ?, ?)
+                      ON CONFLICT (serial) DO UPDATE SET status = excluded.status,
+                      org_id = COALESCE(excluded.org_id, routers.org_id),
+                      network_id = COALESCE(excluded.network_id, routers.network_id)""",
+                      (tuple(router) + ids for router in routers))
+        c.executemany("""INSERT INTO switches (serial, status, connection, org_id, network_id)
+                      VALUES (?, ?, ?, ?, ?)
+                      ON CONFLICT (serial) DO UPDATE SET status = excluded.status,
+                      connection = COALESCE(excluded.connection, switches.connection),
+                      org_id = COALESCE(excluded.org_id, switches.org_id),
+                      network_id = COALESCE(excluded.network_id, switches.network_id)""",
+                      (tuple(switch) + ids for switch in switches))
+        c.executemany("""INSERT INTO aps (serial, status, connection, org_id, network_id)
+                      VALUES (?, ?, ?, ?, ?)
+                      ON CONFLICT (serial) DO UPDATE SET status = excluded.status,
+                      connection = COALESCE(excluded.connection, aps.connection),
+                      org_id = COALESCE(excluded.org_id, aps.org_id),
+                      network_id = COALESCE(excluded.network_id, aps.network_id)""",
+                      (tuple(ap) + ids for ap in aps))
+        _bump_topology_version(c)
 
-# add or update switch to database
-def add_switch(conn, serial, status, connection=None):
+# return every open incident as (serial, alert type, network id, entry id, incident number, opened at)
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_open_incidents")
+def query_open_incidents(conn):
     c = conn.cursor()
 
-    if connection is None:
-        c.execute("""INSERT OR REPLACE INTO switches (serial, status)
-                  VALUES (?, ?)""",
-                  (serial, status))
-    else:
-        c.execute("""INSERT OR REPLACE INTO switches (serial, status, connection)
-                  VALUES (?, ?, ?)""",
-                  (serial, status, connection))
+    c.execute("""SELECT serial, alert_type, network_id, entry_id, incident_number, opened_at
+              FROM open_incidents""")
+    incidents = c.fetchall()
+
+    return incidents
+
+# record the ticket opened for a device and alert type, returning False if a ticket was already recorded for them
+# (by another receiver sharing the database)
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="add_open_incident")
+def add_open_incident(conn, serial, alert_type, network_id, entry_id, incident_number, opened_at):
+    c = conn.cursor()
 
+    with _write_timer():
+        c.execute("""INSERT INTO open_incidents (serial, alert_type, network_id, entry_id, incident_number, opened_at)
+                  VALUES (?, ?, ?, ?, ?, ?)
+                  ON CONFLICT (serial, alert_type) DO NOTHING""",
+                  (serial, alert_type, network_id, entry_id, incident_number, opened_at))
+        conn.commit()
+
+    return c.rowcount > 0
+
+# forget the ticket opened for a device and alert type
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="delete_open_incident")
+def delete_open_incident(conn, serial, alert_type):
+    c = conn.cursor()
+
+    with _write_timer():
+        c.execute("""DELETE FROM open_incidents
+                  WHERE serial = ? AND alert_type = ?""",
+                  (serial, alert_type))
+        conn.commit()
+
+# record the incident number and entry id of a ticket once Remedy has created it
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="update_open_incident_ids")
+def update_open_incident_ids(conn, serial, alert_type, entry_id, incident_number):
+    c = conn.cursor()
+
+    c.execute("""UPDATE open_incidents
+              SET entry_id = ?, incident_number = ?
+              WHERE serial = ? AND alert_type = ?""",
+              (entry_id, incident_number, serial, alert_type))
     conn.commit()
 
-# add or update ap to database
-def add_ap(conn, serial, status, connection=None):
+# add a ticket to the outbox, returning its id
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="add_outbox")
+def add_outbox(conn, serial, alert_type, network_id, description, created_at):
     c = conn.cursor()
 
-    if connection is None:
-        c.execute("""INSERT OR REPLACE INTO aps (serial, status)
-                  VALUES (?, ?)""",
-                  (serial, status))
-    else:
-        c.execute("""INSERT OR REPLACE INTO aps (serial, status, connection)
-                  VALUES (?, ?, ?)""",
-                  (serial, status, connection))
+    with _write_timer():
+        c.execute("""INSERT INTO outbox (serial, alert_type, network_id, description, attempts, next_attempt_at, created_at)
+                  VALUES (?, ?, ?, ?, 0, ?, ?)""",
+                  (serial, alert_type, network_id, description, created_at, created_at))
+        conn.commit()
+
+    return c.lastrowid
+
+# lease up to limit tickets from the outbox that are due to be sent, oldest first, to the dispatcher claimed_by until
+# lease_until and return them - the tickets are picked and leased in one UPDATE, so two processes sharing the database
+# never send the same ticket, and a ticket whose lease ran out (its dispatcher stopped while sending it) is due again -
+# when a list of network ids is given, only the tickets of those networks are leased
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="claim_outbox")
+def claim_outbox(conn, claimed_by, now, lease_until, limit, network_ids=None):
+    c = conn.cursor()
+
+    due = """SELECT id
+          FROM outbox
+          WHERE next_attempt_at <= :now
+          AND (lease_until IS NULL OR lease_until <= :now)"""
+    parameters = {"claimed_by": claimed_by, "now": now, "lease_until": lease_until, "limit": limit}
+    if network_ids is not None:
+        # the ids are passed as one JSON array, so any number of networks fits in a single parameter
+        due += """
+          AND (network_id IN (SELECT value FROM json_each(:network_ids)) OR (network_id IS NULL AND :null_network))"""
+        parameters["network_ids"] = json.dumps([network_id for network_id in network_ids if network_id is not None])
+        parameters["null_network"] = None in network_ids
+
+    with _write_timer():
+        c.execute("""UPDATE outbox
+                  SET claimed_by = :claimed_by, lease_until = :lease_until
+                  WHERE id IN (""" + due + """
+                               ORDER BY next_attempt_at
+                               LIMIT :limit)
+                  RETURNING id, serial, alert_type, network_id, description, attempts""",
+                  parameters)
+        tickets = c.fetchall()
+        conn.commit()
+
+    # RETURNING gives the rows in no particular order
+    tickets.sort(key=lambda ticket: ticket[0])
+
+    return tickets
+
+# give up the lease on a ticket without sending it, so another dispatcher can send it right away
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="release_outbox")
+def release_outbox(conn, outbox_id):
+    c = conn.cursor()
 
+    c.execute("""UPDATE outbox
+              SET claimed_by = NULL, lease_until = NULL
+              WHERE id = ?""",
+              (outbox_id,))
     conn.commit()
 
+# return the number of tickets waiting in the outbox and the number that failed for good
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_outbox_counts")
+def query_outbox_counts(conn):
+    c = conn.cursor()
+
+    c.execute("""SELECT COUNT(next_attempt_at), COUNT(*) - COUNT(next_attempt_at)
+              FROM outbox""")
+
+    return c.fetchone()
+
+# schedule the next attempt to send a ticket, or pass None to stop retrying it - the lease on it is given up
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="reschedule_outbox")
+def reschedule_outbox(conn, outbox_id, attempts, next_attempt_at, error):
+    c = conn.cursor()
+
+    c.execute("""UPDATE outbox
+              SET attempts = ?, next_attempt_at = ?, last_error = ?, claimed_by = NULL, lease_until = NULL
+              WHERE id = ?""",
+              (attempts, next_attempt_at, error, outbox_id))
+    conn.commit()
+
+# remove a ticket from the outbox
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="delete_outbox")
+def delete_outbox(conn, outbox_id):
+    c = conn.cursor()
+
+    c.execute("""DELETE FROM outbox
+              WHERE id = ?""",
+              (outbox_id,))
+    conn.commit()
+
+# return the topology version, which changes whenever devices are added, removed, or moved
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_topology_version")
+def query_topology_version(conn):
+    c = conn.cursor()
+
+    try:
+        c.execute("""SELECT value
+                  FROM meta
+                  WHERE key = 'topology_version'""")
+    except Error:
+        # the database was created before the meta table existed
+        return 0
+
+    version = c.fetchone()
+
+    return version[0] if version is not None else 0
+
+def _bump_topology_version(c):
+    c.execute("""INSERT INTO meta (key, value)
+              VALUES ('topology_version', 1)
+              ON CONFLICT (key) DO UPDATE SET value = value + 1""")
+
+# record that a worker is alive
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="heartbeat_worker")
+def heartbeat_worker(conn, worker_id, url, now):
+    c = conn.cursor()
+
+    with _write_timer():
+        c.execute("""INSERT INTO workers (worker_id, url, started_at, heartbeat_at)
+                  VALUES (?, ?, ?, ?)
+                  ON CONFLICT (worker_id) DO UPDATE SET url = excluded.url, heartbeat_at = excluded.heartbeat_at""",
+                  (worker_id, url, now, now))
+        conn.commit()
+
+# return the workers that sent a heartbeat since the given time as (worker id, url), ordered by worker id
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_live_workers")
+def query_live_workers(conn, since):
+    c = conn.cursor()
+
+    c.execute("""SELECT worker_id, url
+              FROM workers
+              WHERE heartbeat_at >= ?
+              ORDER BY worker_id""",
+              (since,))
+    workers = c.fetchall()
+
+    return workers
+
+# remove a worker that is shutting down, so its networks move to the other workers right away
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="delete_worker")
+def delete_worker(conn, worker_id):
+    c = conn.cursor()
+
+    c.execute("""DELETE FROM workers
+              WHERE worker_id = ?""",
+              (worker_id,))
+    conn.commit()
+
+# return a value stored in the meta table, or the default if it isn't set
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_meta")
+def query_meta(conn, key, default=None):
+    c = conn.cursor()
+
+    c.execute("""SELECT value
+              FROM meta
+              WHERE key = ?""",
+              (key,))
+
+    value = c.fetchone()
+
+    return value[0] if value is not None else default
+
+# store a value in the meta table
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="set_meta")
+def set_meta(conn, key, value):
+    c = conn.cursor()
+
+    c.execute("""INSERT INTO meta (key, value)
+              VALUES (?, ?)
+              ON CONFLICT (key) DO UPDATE SET value = excluded.value""",
+              (key, value))
+    conn.commit()
+
+# the length of the time buckets status events are indexed by, in seconds
+STATUS_EVENT_BUCKET = 3600
+
+# the meta key holding the id of the last status event rolled up into the outages table
+STATUS_ROLLUP_CURSOR = "status_rollup_cursor"
+
+# append status changes, given as (serial, device type, network id, status, occurred at), in one transaction
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="add_status_events")
+def add_status_events(conn, events):
+    c = conn.cursor()
+
+    with _write_timer():
+        c.executemany("""INSERT INTO status_events (serial, device_type, network_id, status, occurred_at, bucket)
+                      VALUES (?, ?, ?, ?, ?, ?)""",
+                      [event + (int(event[4] // STATUS_EVENT_BUCKET),) for event in events])
+        conn.commit()
+
+# roll up to limit status events that haven't been rolled up yet into the outages table, in the order they happened,
+# and delete the rolled up events that happened before delete_before - it runs in one write transaction, so receivers
+# sharing the database never roll up the same events twice - returns the number of events rolled up
+# events are picked in the order they were written but can be written late, such as the changes backfill.py replays
+# with their original times, so a came up event older than the device's outage doesn't end it, and a went down event
+# within an outage that has already ended doesn't start another one
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="rollup_status_events")
+def rollup_status_events(conn, limit, delete_before):
+    c = conn.cursor()
+
+    with _write_timer():
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = query_meta(conn, STATUS_ROLLUP_CURSOR, 0)
+            c.execute("""SELECT id, serial, device_type, network_id, status, occurred_at
+                      FROM status_events
+                      WHERE id > ?
+                      ORDER BY id
+                      LIMIT ?""",
+                      (cursor, limit))
+            events = c.fetchall()
+
+            for event_id, serial, device_type, network_id, status, occurred_at in sorted(events, key=lambda event: (event[5], event[0])):
+                if status == "up":
+                    c.execute("""UPDATE outages
+                              SET ended_at = ?
+                              WHERE serial = ? AND ended_at IS NULL AND started_at <= ?""",
+                              (occurred_at, serial, occurred_at))
+                else:
+                    # a device that is already in an outage stays in the same one
+                    c.execute("""INSERT INTO outages (serial, device_type, network_id, started_at, ended_at)
+                              SELECT ?, ?, ?, ?, NULL
+                              WHERE NOT EXISTS (SELECT 1
+                                                FROM outages
+                                                WHERE serial = ? AND started_at <= ? AND ended_at >= ?)
+                              ON CONFLICT (serial) WHERE ended_at IS NULL DO NOTHING""",
+                              (serial, device_type, network_id, occurred_at, serial, occurred_at, occurred_at))
+
+            if events:
+                cursor = events[-1][0]
+                c.execute("""INSERT INTO meta (key, value)
+                          VALUES (?, ?)
+                          ON CONFLICT (key) DO UPDATE SET value = excluded.value""",
+                          (STATUS_ROLLUP_CURSOR, cursor))
+            c.execute("""DELETE FROM status_events
+                      WHERE bucket < ? AND id <= ?""",
+                      (int(delete_before // STATUS_EVENT_BUCKET), cursor))
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+
+    return len(events)
+
+# return the devices whose status changed at least min_changes times since a time (in one network if given), the most changes first,
+# as (serial, device type, network id, changes, last status)
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_flapping_devices")
+def query_flapping_devices(conn, since, min_changes, network_id=None, limit=100):
+    c = conn.cursor()
+
+    statement = """SELECT serial, device_type, network_id, COUNT(*) AS changes, status, MAX(occurred_at)
+                   FROM status_events
+                   WHERE bucket >= :bucket AND occurred_at >= :since"""
+    if network_id is not None:
+        statement += " AND network_id = :network_id"
+    statement += """
+                 GROUP BY serial
+                 HAVING changes >= :min_changes
+                 ORDER BY changes DESC, serial
+                 LIMIT :limit"""
+    c.execute(statement, {"bucket": int(since // STATUS_EVENT_BUCKET), "since": since, "network_id": network_id,
+                          "min_changes": min_changes, "limit": limit})
+    # with MAX, SQLite takes the other columns from the row holding the maximum, so status is the last one recorded
+    devices = [row[:5] for row in c.fetchall()]
+
+    return devices
+
+# return the minutes devices were down between two times summed per network, with the number of outages and the
+# mean minutes to recover of the outages that ended, as (network id, outage minutes, outages, mean minutes to recover) -
+# outages that haven't ended are counted up to the end of the range
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="query_outage_minutes")
+def query_outage_minutes(conn, since, until, network_id=None):
+    c = conn.cursor()
+
+    statement = """SELECT network_id,
+                   SUM(MIN(COALESCE(ended_at, :until), :until) - MAX(started_at, :since)) / 60.0,
+                   COUNT(*),
+                   AVG(ended_at - started_at) / 60.0
+                   FROM outages
+                   WHERE started_at < :until AND (ended_at IS NULL OR ended_at > :since)"""
+    if network_id is not None:
+        statement += " AND network_id = :network_id"
+    statement += """
+                 GROUP BY network_id
+                 ORDER BY 2 DESC"""
+    c.execute(statement, {"since": since, "until": until, "network_id": network_id})
+    networks = c.fetchall()
+
+    return networks
+
+# raised instead of applying a topology diff that would remove most of a network's devices
+class TopologyDiffRefused(ValueError):
+    pass
+
+# bring the routers, switches, and aps tables in line with a full set of devices in one transaction,
+# touching only the rows that were added, removed, or moved - the arguments are dictionaries keyed by serial,
+# holding (serial, status) for routers and (serial, status, connection) for switches and aps
+# when a network id is given, only that network's devices are compared, so other networks are left alone
+# the status of devices that are already in the database is left alone, since the webhooks keep it up to date
+# an empty or partial topology from a passing API problem would look like the devices were removed, so a diff that
+# removes more than max_removed_fraction of the devices compared raises TopologyDiffRefused unless force is true
+@metrics.timed(metrics.DB_QUERY_SECONDS, query="apply_topology_diff")
+def apply_topology_diff(conn, routers, switches, aps, org_id=None, network_id=None, max_removed_fraction=0.5, force=False):
+    current_routers = {row[0]: row for row in query_all_routers(conn, network_id)}
+    current_switches = {row[0]: row for row in query_all_switches(conn, network_id)}
+    current_aps = {row[0]: row for row in query_all_aps(conn, network_id)}
+
+    added_routers = [routers[serial] for serial in routers.keys() - current_routers.keys()]
+    removed_routers = [(serial,) for serial in current_routers.keys() - routers.keys()]
+
+    diff = {
+        "routers": (added_routers, removed_routers, []),
+        "switches": _diff_connected(current_switches, switches),
+        "aps": _diff_connected(current_aps, aps)
+    }
+    changes = sum(len(rows) for table in diff.values() for rows in table)
+    if changes == 0:
+        return diff
+
+    current = len(current_routers) + len(current_switches) + len(current_aps)
+    removed = sum(len(removed) for added, removed, moved in diff.values())
+    if not force and removed > 0 and removed >= current * max_removed_fraction:
+        raise TopologyDiffRefused("Refusing to remove " + str(removed) + " of " + str(current) + " devices" +
+                                  (" in network " + network_id if network_id is not None else ""))
+
+    c = conn.cursor()
+    ids = (org_id, network_id)
+    with conn:
+        # a device that is new to this network may already be in the table under another network or none,
+        # so it is claimed for this network while keeping its status
+        c.executemany("""INSERT INTO routers (serial, status, org_id, network_id)
+                      VALUES (?, ?, ?, ?)
+                      ON CONFLICT (serial) DO UPDATE SET org_id = excluded.org_id,
+                      network_id = excluded.network_id""",
+                      [router + ids for router in added_routers])
+        c.executemany("""DELETE FROM routers
+                      WHERE serial = ?""", removed_routers)
+        for table in ("switches", "aps"):
+            added, removed, moved = diff[table]
+            c.executemany("INSERT INTO " + table + " (serial, status, connection, org_id, network_id) VALUES (?, ?, ?, ?, ?) "
+                          "ON CONFLICT (serial) DO UPDATE SET connection = excluded.connection, "
+                          "org_id = excluded.org_id, network_id = excluded.network_id",
+                          [row + ids for row in added])
+            c.executemany("DELETE FROM " + table + " WHERE serial = ?", removed)
+            c.executemany("UPDATE " + table + " SET connection = ? WHERE serial = ?", moved)
+        _bump_topology_version(c)
+
+    return diff
+
+# return the rows to add, remove, and move for the switches or aps table
+def _diff_connected(current, desired):
+    added = [desired[serial] for serial in desired.keys() - current.keys()]
+    removed = [(serial,) for serial in current.keys() - desired.keys()]
+    moved = [(desired[serial][2], serial) for serial in desired.keys() & current.keys()
+             if desired[serial][2] != current[serial][1]]
+
+    return added, removed, moved
+
 # close connection to database
 def close_connection(conn):
     conn.close()
@@ -246,7 +1072,7 @@ def close_connection(conn):
 
 # if running this python file, create connection to database, create tables, and print out the results of queries of every table
 if __name__ == "__main__":
-    conn = create_connection("sqlite.db")
+    conn = create_connection(os.getenv("DB_FILE", "sqlite.db"))
     create_tables(conn)
     pprint(query_all_routers(conn))
     pprint(query_all_switches(conn))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# the lowest level of event written out
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# share of informational events kept per alert type, for example "APs went down=0.1,APs came up=0.1"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# fields whose values are never written out
+REDACTED_FIELDS = {"password", "token", "authorization", "sharedsecret", "secret", "api_key"}
+
+logger = logging.getLogger("meraki_remedy")
+logger.propagate = False
+
+_listener = None
+_lock = threading.Lock()
+
+# this class writes each event as one line of compact JSON
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage()
+        }
+        event.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            event["exception"] = record.exc_text
+
+        return json.dumps(event, separators=(",", ":"), default=str)
+
+# this class hands records to the queue as they are - the traceback is rendered here, while it is still available,
+# and everything else is formatted on the background thread
+class EventQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+# this class drops a share of the informational events for the alert types that are sampled
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        logging.Filter.__init__(self)
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not self.rates:
+            return True
+
+        rate = self.rates.get(getattr(record, "fields", {}).get("alert_type"))
+
+        return rate is None or random.random() < rate
+
+# parse the sample rates from the environment variable
+def parse_sample_rates(value):
+    rates = {}
+    for entry in value.split(","):
+        if "=" in entry:
+            alert_type, rate = entry.rsplit("=", 1)
+            rates[alert_type.strip()] = float(rate)
+
+    return rates
+
+# replace the values of secret fields, including ones nested in dictionaries
+def redact(fields):
+    redacted = {}
+    for name, value in fields.items():
+        if name.lower() in REDACTED_FIELDS:
+            redacted[name] = "[REDACTED]"
+        elif isinstance(value, dict):
+            redacted[name] = redact(value)
+        else:
+            redacted[name] = value
+
+    return redacted
+
+# route events through a queue to a background thread, so writing them never blocks the thread that logs them
+def start(stream=None):
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            return
+
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(JsonFormatter())
+
+        events = queue.SimpleQueue()
+        queue_handler = EventQueueHandler(events)
+        queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+        logger.addHandler(queue_handler)
+        logger.setLevel(LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(events, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop)
+
+# write out the events still queued and stop the background thread
+def stop():
+    global _listener
+
+    with _lock:
+        if _listener is None:
+            return
+
+        _listener.stop()
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        _listener = None
+
+# log an event with structured fields such as the alert type, serial, network, decision, and timings
+def log_event(event, level=logging.INFO, exc_info=False, **fields):
+    if _listener is None:
+        start()
+    if not logger.isEnabledFor(level):
+        return
+
+    logger.log(level, event, exc_info=exc_info, extra={"fields": redact(fields)})
+
+def error(event, **fields):
+    log_event(event, level=logging.ERROR, **fields)
+
+def warning(event, **fields):
+    log_event(event, level=logging.WARNING, **fields)
+
+# return the milliseconds since a time.perf_counter() reading, for timing fields
+def elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 3)
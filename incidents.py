@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import threading
+import time
+import db
+
+# one open Remedy ticket
+class Incident:
+    __slots__ = ("serial", "alert_type", "network_id", "entry_id", "incident_number", "opened_at")
+
+    def __init__(self, serial, alert_type, network_id, entry_id, incident_number, opened_at):
+        self.serial = serial
+        self.alert_type = alert_type
+        self.network_id = network_id
+        self.entry_id = entry_id
+        self.incident_number = incident_number
+        self.opened_at = opened_at
+
+# this class keeps the open tickets in memory, keyed by device serial and alert type, and writes every change
+# through to the open_incidents table so that duplicate alerts are caught even after a restart
+class IncidentRegistry:
+    def __init__(self):
+        self.incidents = {}
+        self.lock = threading.Lock()
+
+    # load the open tickets from the database
+    def load(self, conn):
+        incidents = {}
+        for row in db.query_open_incidents(conn):
+            incident = Incident(*row)
+            incidents[(incident.serial, incident.alert_type)] = incident
+
+        with self.lock:
+            self.incidents = incidents
+
+    def __len__(self):
+        return len(self.incidents)
+
+    # return the open ticket for a device and alert type, or None
+    def get(self, serial, alert_type):
+        return self.incidents.get((serial, alert_type))
+
+    # record a ticket that was just opened in Remedy, returning None if the database already holds a ticket
+    # for the device and alert type, recorded by another receiver sharing the database
+    def open(self, conn, serial, alert_type, network_id, entry_id, incident_number):
+        incident = Incident(serial, alert_type, network_id, entry_id, incident_number, time.time())
+        with self.lock:
+            if not db.add_open_incident(conn, serial, alert_type, network_id, entry_id, incident_number, incident.opened_at):
+                return None
+            self.incidents[(serial, alert_type)] = incident
+
+        return incident
+
+    # record the ids Remedy gave a ticket that was opened before it was sent, returning False if the ticket was closed in the meantime
+    def set_ids(self, conn, serial, alert_type, entry_id, incident_number):
+        with self.lock:
+            incident = self.incidents.get((serial, alert_type))
+            if incident is None:
+                return False
+
+            db.update_open_incident_ids(conn, serial, alert_type, entry_id, incident_number)
+            incident.entry_id = entry_id
+            incident.incident_number = incident_number
+
+            return True
+
+    # forget a ticket recorded by open in a transaction that was rolled back, without touching the database
+    def discard(self, serial, alert_type):
+        with self.lock:
+            self.incidents.pop((serial, alert_type), None)
+
+    # forget the open ticket for a device and alert type, returning it, or None if there wasn't one
+    def close(self, conn, serial, alert_type):
+        with self.lock:
+            incident = self.incidents.pop((serial, alert_type), None)
+            if incident is not None:
+                db.delete_open_incident(conn, serial, alert_type)
+
+        return incident
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import asyncio
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# every metric, in the order it is rendered
+_registry = []
+
+# the base class of the metrics below - values are kept per combination of label values
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+
+        return "{" + ",".join(name + '="' + _escape(value) + '"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.documentation, "# TYPE " + self.name + " " + self.kind]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(self.name + self._labels(key) + " " + _format(value))
+
+        return lines
+
+# a value that only goes up, such as the number of tickets created
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+# a value that goes up and down, such as the queue depth - it can also be read from a function when it is rendered
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.function = None
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def render(self):
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception:
+                pass
+
+        return Metric.render(self)
+
+# a distribution of observations, such as the latency of a stage, counted into buckets
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                # one count per bucket plus one for +Inf, then the sum of all observations
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    # time the body of a with statement
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.documentation, "# TYPE " + self.name + " " + self.kind]
+        with self.lock:
+            items = sorted((key, list(series)) for key, series in self.values.items())
+
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format(bound)
+                lines.append(self.name + "_bucket" + self._labels(key, [("le", le)]) + " " + str(cumulative))
+            lines.append(self.name + "_sum" + self._labels(key) + " " + _format(series[-1]))
+            lines.append(self.name + "_count" + self._labels(key) + " " + str(cumulative))
+
+        return lines
+
+# decorate a function so each call is observed in a histogram under the given label values
+# coroutine functions are timed until the coroutine finishes, not just until it is created
+def timed(histogram, **labels):
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, **labels)
+
+            return async_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+
+        return wrapper
+
+    return decorator
+
+# return every metric in the Prometheus text exposition format
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# the metrics of the webhook pipeline
+ALERTS_RECEIVED = Counter("alerts_received_total", "Alerts received by the webhook receiver", ["alert_type"])
+ALERT_ERRORS = Counter("alert_errors_total", "Alerts or batches of alerts whose processing raised an error", ["stage"])
+WEBHOOK_SECONDS = Histogram("webhook_request_seconds", "Time to answer a webhook", ["alert_type"])
+ALERT_STAGE_SECONDS = Histogram("alert_stage_seconds", "Time spent in each stage of processing an alert", ["alert_type", "stage"])
+TICKETS_CREATED = Counter("tickets_created_total", "Tickets created in Remedy", ["device_type"])
+TICKETS_QUEUED = Counter("tickets_queued_total", "Tickets added to the outbox", ["device_type"])
+TICKETS_SUPPRESSED = Counter("tickets_suppressed_total", "Down alerts that did not create a ticket", ["device_type", "reason"])
+DEVICES_RECOVERED = Counter("devices_recovered_total", "Devices marked up because a device upstream of them came back up", ["device_type"])
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Time spent in database functions", ["query"])
+REMEDY_REQUEST_SECONDS = Histogram("remedy_request_seconds", "Time spent in calls to the Remedy API", ["call"])
+REMEDY_ERRORS = Counter("remedy_errors_total", "Calls to the Remedy API that failed or were rejected", ["call"])
+REMEDY_TOKENS = Counter("remedy_token_requests_total", "Remedy tokens handed out from the cache (hit) or by logging in again (refresh)", ["result"])
+QUEUE_DEPTH = Gauge("alert_queue_depth", "Alerts waiting for a worker")
+ALERTS_SHED = Counter("alerts_shed_total", "Alerts turned away because their priority lane was full", ["lane"])
+OUTBOX_PENDING = Gauge("outbox_pending", "Tickets waiting in the outbox")
+CORRELATION_BUFFERED = Gauge("correlation_buffered_alerts", "Alerts held in correlation windows")
+ALERTS_FORWARDED = Counter("alerts_forwarded_total", "Alerts forwarded to the receiver that owns their network", ["result"])
+CLUSTER_WORKERS = Gauge("cluster_workers", "Live receivers sharing the database")
+STATUS_EVENTS = Counter("status_events_total", "Status changes written to the history, or dropped because too many were waiting", ["result"])
+STATUS_EVENTS_PENDING = Gauge("status_events_pending", "Status changes waiting to be written to the history")
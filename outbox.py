@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import asyncio
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import alerts
+import db
+import event_log
+import metrics
+import remedy_functions
+
+# this class sends the tickets in the outbox table to Remedy in the background - failed tickets are retried with
+# exponential backoff, a run of failures opens a circuit breaker that pauses sending, and at most max_in_flight
+# tickets are sent at once, so the webhooks never wait on Remedy and no ticket is lost if Remedy is down
+# when receivers share the database, network_ids returns the networks whose tickets this dispatcher sends - every
+# ticket is leased in the database for lease seconds while it is sent, so no other process sharing the database sends it
+class OutboxDispatcher:
+    def __init__(self, db_file, remedy, incidents, max_in_flight=4, base_delay=5, max_delay=600,
+                 breaker_threshold=5, breaker_cooldown=60, poll_interval=1, network_ids=None, lease=300):
+        self.db_file = db_file
+        self.remedy = remedy
+        self.incidents = incidents
+        self.max_in_flight = max_in_flight
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.poll_interval = poll_interval
+        self.network_ids = network_ids
+        self.lease = lease
+        self.dispatcher_id = uuid.uuid4().hex
+
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.executor = None
+        self.in_flight = set()
+        self.failures = 0
+        self.breaker_open_until = 0
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+
+    # start the thread that sends tickets
+    def start(self):
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="outbox")
+        self.thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self.thread.start()
+
+    # add a ticket to the outbox and wake the dispatcher
+    def submit(self, conn, serial, alert_type, network_id, description):
+        outbox_id = db.add_outbox(conn, serial, alert_type, network_id, description, time.time())
+        with self.cond:
+            self.cond.notify()
+
+        return outbox_id
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.running:
+                    return
+
+                now, slots = self._slots()
+
+            tickets = []
+            if slots > 0:
+                tickets = self._claim(now, slots)
+
+            with self.cond:
+                for ticket in tickets:
+                    self.in_flight.add(ticket[0])
+                    self.executor.submit(self._deliver, ticket)
+
+                if self.running:
+                    self.cond.wait(self.poll_interval)
+
+    # return the time and the number of tickets that can be sent now - call with the condition held
+    def _slots(self):
+        now = time.time()
+        slots = self.max_in_flight - len(self.in_flight)
+        if now < self.breaker_open_until:
+            slots = 0
+        elif self.failures >= self.breaker_threshold:
+            # the cooldown has passed, so send a single ticket to find out whether Remedy has recovered
+            slots = min(slots, 1 - len(self.in_flight))
+
+        return now, slots
+
+    # lease up to slots of the due tickets to this dispatcher in the database and return them
+    def _claim(self, now, slots):
+        network_ids = self.network_ids() if self.network_ids is not None else None
+        with db.get_pool(self.db_file).connection() as conn:
+            return db.claim_outbox(conn, self.dispatcher_id, now, now + self.lease, slots, network_ids)
+
+    # return whether the ticket's network still belongs to this dispatcher, which may have changed since it was read
+    def _owns(self, ticket):
+        return self.network_ids is None or ticket[3] in self.network_ids()
+
+    # give a ticket of a network this dispatcher no longer owns back to the outbox, so its new owner sends it
+    def _release(self, ticket):
+        with db.get_pool(self.db_file).connection() as conn:
+            db.release_outbox(conn, ticket[0])
+
+    def _deliver(self, ticket):
+        outbox_id, serial, alert_type, network_id, description, attempts = ticket
+        try:
+            if not self._owns(ticket):
+                self._release(ticket)
+
+                return
+
+            # the device came back up before the ticket was sent, so it is no longer needed
+            result = self._send(description) if self.incidents.get(serial, alert_type) is not None else None
+            self._settle(ticket, result)
+        finally:
+            with self.cond:
+                self.in_flight.discard(outbox_id)
+                self.cond.notify()
+
+    # send a ticket to Remedy and return its result
+    def _send(self, description):
+        try:
+            response = remedy_functions.create_incident(self.remedy, {"description": description})
+        except Exception as e:
+            return str(e), True, None, None
+
+        return self._result(response)
+
+    # return the error (None if the ticket was created), whether to retry, the entry id, and the incident number
+    def _result(self, response):
+        entry_id, incident_number = remedy_functions.get_incident_ids(response)
+        if entry_id is None and incident_number is None:
+            # a request Remedy rejects outright will be rejected again, so only server errors,
+            # timeouts, and rate limiting are retried
+            retry = response.status_code >= 500 or response.status_code in (408, 429)
+
+            return "Remedy answered " + str(response.status_code), retry, None, None
+
+        return None, False, entry_id, incident_number
+
+    # record the result of sending a ticket in the database - a result of None means the ticket is no longer needed
+    def _settle(self, ticket, result):
+        outbox_id, serial, alert_type, network_id, description, attempts = ticket
+        with db.get_pool(self.db_file).connection() as conn:
+            if result is None:
+                db.delete_outbox(conn, outbox_id)
+
+                return
+
+            error, retry, entry_id, incident_number = result
+            if error is None:
+                db.delete_outbox(conn, outbox_id)
+                if not self.incidents.set_ids(conn, serial, alert_type, entry_id, incident_number):
+                    event_log.warning("outbox_delivered", serial=serial, alert_type=alert_type,
+                                      incident=incident_number or entry_id, note="device came back up before the ticket was created")
+                self._record(success=True)
+                metrics.TICKETS_CREATED.inc(device_type=alerts.DOWN_ALERTS.get(alert_type, ""))
+                event_log.log_event("outbox_delivered", serial=serial, alert_type=alert_type, network_id=network_id,
+                                    incident=incident_number or entry_id, attempts=attempts + 1)
+            elif retry:
+                attempts += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.5, 1)
+                db.reschedule_outbox(conn, outbox_id, attempts, time.time() + delay, error)
+                self._record(success=False)
+                event_log.warning("outbox_retry", serial=serial, alert_type=alert_type, error=error,
+                                  attempts=attempts, retry_in_seconds=round(delay, 1))
+            else:
+                db.reschedule_outbox(conn, outbox_id, attempts + 1, None, error)
+                # the ticket won't be created, so let the next alert for the device try again
+                self.incidents.close(conn, serial, alert_type)
+                with self.cond:
+                    self.failed += 1
+                event_log.error("outbox_failed", serial=serial, alert_type=alert_type, error=error, attempts=attempts + 1)
+
+    # resolve a ticket in Remedy in the background, so the alert that closed it doesn't wait on Remedy - a dispatcher
+    # that was never started, as in backfill.py, resolves it right away
+    def resolve(self, incident_number, resolution):
+        if self.executor is None:
+            self._resolve(incident_number, resolution)
+        else:
+            self.executor.submit(self._resolve, incident_number, resolution)
+
+    def _resolve(self, incident_number, resolution):
+        try:
+            remedy_functions.resolve_incident(self.remedy, incident_number, resolution)
+        except Exception as e:
+            event_log.error("remedy_resolve_incident", incident=incident_number, error=str(e))
+
+    # count a delivery towards the circuit breaker - enough failures in a row pause sending for the cooldown
+    def _record(self, success):
+        with self.cond:
+            if success:
+                self.failures = 0
+                self.breaker_open_until = 0
+                self.delivered += 1
+            else:
+                self.failures += 1
+                self.retried += 1
+                if self.failures >= self.breaker_threshold:
+                    self.breaker_open_until = time.time() + self.breaker_cooldown
+
+    # stop sending and wait for the tickets being sent - the rest stay in the outbox for the next start
+    def shutdown(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+    # return the state of the outbox and the circuit breaker
+    def stats(self):
+        with db.get_pool(self.db_file).connection() as conn:
+            pending, dead = db.query_outbox_counts(conn)
+
+        with self.cond:
+            if time.time() < self.breaker_open_until:
+                breaker = "open"
+            elif self.failures >= self.breaker_threshold:
+                breaker = "half-open"
+            else:
+                breaker = "closed"
+
+            return {
+                "pending": pending,
+                "failed_permanently": dead,
+                "in_flight": len(self.in_flight),
+                "delivered": self.delivered,
+                "retried": self.retried,
+                "failed": self.failed,
+                "breaker": breaker
+            }
+
+# this class sends the tickets in the outbox table from an event loop with an async Remedy client, so a ticket
+# waiting on Remedy holds a coroutine instead of a thread - database work runs on the given executor
+class AsyncOutboxDispatcher(OutboxDispatcher):
+    def __init__(self, db_file, remedy, incidents, client, executor, **kwargs):
+        super().__init__(db_file, remedy, incidents, **kwargs)
+        self.client = client
+        self.db_executor = executor
+        self.loop = None
+        self.wake = None
+        self.task = None
+        self.tasks = set()
+
+    # start the task that sends tickets - call from the event loop
+    def start(self):
+        self.running = True
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        self.task = self.loop.create_task(self._run_async())
+
+    # add a ticket to the outbox and wake the dispatcher - safe to call from any thread
+    def submit(self, conn, serial, alert_type, network_id, description):
+        outbox_id = db.add_outbox(conn, serial, alert_type, network_id, description, time.time())
+        self.loop.call_soon_threadsafe(self.wake.set)
+
+        return outbox_id
+
+    async def _run_async(self):
+        while self.running:
+            self.wake.clear()
+            with self.cond:
+                now, slots = self._slots()
+
+            tickets = []
+            if slots > 0:
+                tickets = await self.loop.run_in_executor(self.db_executor, self._claim, now, slots)
+
+            with self.cond:
+                self.in_flight.update(ticket[0] for ticket in tickets)
+            for ticket in tickets:
+                self._spawn(self._deliver_async(ticket))
+
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver_async(self, ticket):
+        outbox_id, serial, alert_type, network_id, description, attempts = ticket
+        try:
+            if not self._owns(ticket):
+                await self.loop.run_in_executor(self.db_executor, self._release, ticket)
+
+                return
+
+            # the device came back up before the ticket was sent, so it is no longer needed
+            result = await self._send_async(description) if self.incidents.get(serial, alert_type) is not None else None
+            await self.loop.run_in_executor(self.db_executor, self._settle, ticket, result)
+        finally:
+            with self.cond:
+                self.in_flight.discard(outbox_id)
+            self.wake.set()
+
+    async def _send_async(self, description):
+        try:
+            response = await self.client.create_incident({"description": description})
+        except Exception as e:
+            return str(e), True, None, None
+
+        return self._result(response)
+
+    # resolve a ticket in Remedy on the event loop - safe to call from any thread
+    def resolve(self, incident_number, resolution):
+        self.loop.call_soon_threadsafe(self._spawn, self._resolve_async(incident_number, resolution))
+
+    async def _resolve_async(self, incident_number, resolution):
+        try:
+            await self.client.resolve_incident(incident_number, resolution)
+        except Exception as e:
+            event_log.error("remedy_resolve_incident", incident=incident_number, error=str(e))
+
+    def _spawn(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # stop sending and wait for the tickets being sent - the rest stay in the outbox for the next start
+    async def stop(self):
+        self.running = False
+        if self.task is not None:
+            self.wake.set()
+            await self.task
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -20,6 +20,7 @@ import os
 from dotenv import load_dotenv
 from pprint import pprint
 import db
+import dashboard_cache
 
 # load environmental variables
 load_dotenv()
@@ -27,115 +28,192 @@ load_dotenv()
 API_KEY = os.getenv("MERAKI_TOKEN")
 ORG_NAME = os.getenv("MERAKI_ORG")
 NET_NAME = os.getenv("MERAKI_NETWORK")
+DB_FILE = os.getenv("DB_FILE", "sqlite.db")
+# "record" saves every Meraki API response to MERAKI_CACHE_DIR, and "offline" rebuilds the database from those responses
+# without calling the API
+MERAKI_CACHE = os.getenv("MERAKI_CACHE", "")
+MERAKI_CACHE_DIR = os.getenv("MERAKI_CACHE_DIR", "meraki_cache")
+
+# return the id of the organization with the given name
+def get_org_id(dashboard, org_name):
+    orgs = dashboard.organizations.getOrganizations()
+    for org in orgs:
+        if org["name"] == org_name:
+            return org["id"]
+
+    return None
+
+# return the id of the network with the given name
+def get_network_id(dashboard, org_id, net_name):
+    networks = dashboard.organizations.getOrganizationNetworks(org_id,
+                                                               total_pages="all")
+    for net in networks:
+        if net["name"] == net_name:
+            return net["id"]
+
+    return None
+
+# return the networks of the organization, or only the ones with the given names
+def get_networks(dashboard, org_id, net_names=None):
+    networks = dashboard.organizations.getOrganizationNetworks(org_id,
+                                                               total_pages="all")
+    if net_names:
+        networks = [net for net in networks if net["name"] in net_names]
+
+    return networks
+
+# map a device model to the type of device used in the database
+def get_device_type(model):
+    if "MR" in model:
+        return "AP"
+    elif "MS" in model:
+        return "switch"
+    elif "MX" in model:
+        return "router"
+
+    return None
+
+# map a Meraki device status to the status used in the database
+def get_device_status(status):
+    if status == "online" or status == "alerting":
+        return "up"
+
+    return "down"
+
+# fetch the inventory and the statuses of the organization's devices in bulk, returning dictionaries keyed by serial
+def get_inventory(dashboard, org_id, network_ids=None):
+    kwargs = {"total_pages": "all"}
+    if network_ids is not None:
+        kwargs["networkIds"] = network_ids
+
+    devices = dashboard.organizations.getOrganizationDevices(org_id, **kwargs)
+    models = {device["serial"]: device.get("model") or "" for device in devices}
+
+    device_statuses = dashboard.organizations.getOrganizationDevicesStatuses(org_id, **kwargs)
+    statuses = {device["serial"]: get_device_status(device["status"]) for device in device_statuses}
+
+    return models, statuses
+
+# return the serials of the devices at the ends of each link in the network topology
+def get_links(topology):
+    connections = []
+    for link in topology["links"]:
+        serials = []
+        for node in link["ends"]:
+            if node["node"]["type"] == "device":
+                serials.append(node["device"]["serial"])
+        connections.append(serials)
+
+    return connections
+
+# label each end of each link with its device type and status, using the inventory dictionaries
+def classify_links(links, models, statuses):
+    connections = []
+    for serials in links:
+        connection = []
+        for serial in serials:
+            connection.append({
+                "serial": serial,
+                "type": get_device_type(models.get(serial, "")),
+                "status": statuses.get(serial, "down")
+            })
+        connections.append(connection)
+
+    return connections
+
+# return the routers, switches, and aps at the ends of the links as dictionaries keyed by serial,
+# recording which device each one connects to
+def get_devices(connections):
+    routers = {}
+    switches = {}
+    aps = {}
+    # the switches linked to each switch
+    neighbors = {}
+
+    for connection in connections:
+        if len(connection) < 2:
+            continue
 
-# connect to Meraki dashboard
-dashboard = meraki.DashboardAPI(API_KEY, suppress_logging=True)
-# connect to database
-conn = db.create_connection("sqlite.db")
-c = conn.cursor()
-
-# get org id for org name in environment variables
-orgs = dashboard.organizations.getOrganizations()
-for org in orgs:
-    if org["name"] == ORG_NAME:
-        org_id = org["id"]
-
-# get net id for net name in environment variables
-networks = dashboard.organizations.getOrganizationNetworks(org_id,
-                                                           total_pages="all")
-for net in networks:
-    if net["name"] == NET_NAME:
-        net_id = net["id"]
-
-# grab the network topology from Meraki dashboard to determine which devices are connected to each other
-topology = dashboard.networks.getNetworkTopologyLinkLayer(net_id)
-links = topology["links"]
-
-connections = []
-for link in links:
-    serials = []
-    connection = link["ends"]
-    for node in connection:
-        if node["node"]["type"] == "device":
-            device = node["device"]
-            serial = device["serial"]
-            serials.append({"serial": serial})
-    connections.append(serials)
-
-for connection in connections:
-    for node in connection:
-        device = dashboard.devices.getDevice(node["serial"])
-        if "MR" in device["model"]:
-            node["type"] = "AP"
-        elif "MS" in device["model"]:
-            node["type"] = "switch"
-        elif "MX" in device["model"]:
-            node["type"] = "router"
-        # get status to determine what to initialize database
-        device_status = dashboard.organizations.getOrganizationDevicesStatuses(org_id,
-                                                                               serials=[node["serial"]])
-        if device_status[0]["status"] == "online" or device_status[0]["status"] == "alerting":
-            node["status"] = "up"
-        else:
-            node["status"] = "down"
-    if len(connection) > 1:
         device_types = {connection[0]["type"], connection[1]["type"]}
         if "AP" in device_types and "switch" in device_types:
             # check if the first connection is a switch
             if connection[0]["type"] == "switch":
-                # check if switch already exists in the database
-                data = db.query_specific_switch(conn, connection[0]["serial"])
-                if len(data) == 0:
-                    # if switch not already in the database, add it
-                    db.add_switch(conn, connection[0]["serial"],
-                                  connection[0]["status"])
-
-                # now add the AP into the database
-                db.add_ap(conn, connection[1]["serial"],
-                          connection[1]["status"], connection[0]["serial"])
+                switch, ap = connection[0], connection[1]
             # the first connection is not a switch, so it must be an AP
             else:
-                # check if switch already exists in the database
-                data = db.query_specific_switch(conn, connection[1]["serial"])
-                if len(data) == 0:
-                    # add switch to database
-                    db.add_switch(conn, connection[1]["serial"],
-                                  connection[1]["status"])
-
-                # now add the AP to the database
-                db.add_ap(conn, connection[0]["serial"],
-                          connection[0]["status"], connection[1]["serial"])
-        elif "switch" and "router" in device_types:
+                switch, ap = connection[1], connection[0]
+
+            # add the switch without overwriting the router it connects to, if it has been seen already
+            if switch["serial"] not in switches:
+                switches[switch["serial"]] = (switch["serial"], switch["status"], None)
+            aps[ap["serial"]] = (ap["serial"], ap["status"], switch["serial"])
+        elif "switch" in device_types and "router" in device_types:
             # check if first connection is a router
             if connection[0]["type"] == "router":
-                # check if router already exists in the database
-                data = db.query_specific_router(conn, connection[0]["serial"])
-                if len(data) == 0:
-                    # router is not in database, so it must be added
-                    db.add_router(conn, connection[0]["serial"],
-                                  connection[0]["status"])
-
-                # now add switch into the database
-                db.add_switch(conn, connection[1]["serial"],
-                              connection[1]["status"], connection[0]["serial"])
+                router, switch = connection[0], connection[1]
             # the first connection is not a router, so it must be a switch
             else:
-                # check if router already exists in database
-                data = db.query_specific_router(conn, connection[1]["serial"])
-                if len(data) == 0:
-                    # router is not in database and needs to be added
-                    db.add_router(conn, connection[1]["serial"],
-                                  connection[1]["status"])
-
-                # now add switch into database
-                db.add_switch(conn, connection[0]["serial"],
-                              connection[0]["status"], connection[1]["serial"])
-
-
-# print the results of all the queries to all the tables
-pprint(db.query_all_routers(conn))
-pprint(db.query_all_switches(conn))
-pprint(db.query_all_aps(conn))
-
-# close the database connection
-db.close_connection(conn)
+                router, switch = connection[1], connection[0]
+
+            routers[router["serial"]] = (router["serial"], router["status"])
+            switches[switch["serial"]] = (switch["serial"], switch["status"], router["serial"])
+        elif device_types == {"switch"}:
+            # switches linked to each other, such as a stack or a downstream access switch - which end is upstream
+            # is decided below, once every link to a router is known
+            for switch in connection[:2]:
+                if switch["serial"] not in switches:
+                    switches[switch["serial"]] = (switch["serial"], switch["status"], None)
+            neighbors.setdefault(connection[0]["serial"], []).append(connection[1]["serial"])
+            neighbors.setdefault(connection[1]["serial"], []).append(connection[0]["serial"])
+
+    # a switch that isn't linked to a router is behind the linked switch closest to one - walk outward from the
+    # switches linked to routers, so each switch gets one upstream switch and loops in the cabling are ignored
+    reached = [serial for serial, switch in switches.items() if switch[2] in routers]
+    seen = set(reached)
+    for serial in reached:
+        for neighbor in neighbors.get(serial, ()):
+            if neighbor not in seen:
+                seen.add(neighbor)
+                switches[neighbor] = (neighbor, switches[neighbor][1], serial)
+                reached.append(neighbor)
+
+    return routers, switches, aps
+
+# add the devices at the ends of each link to the database in one transaction, tagged with their organization and network
+def add_connections(conn, connections, org_id=None, network_id=None):
+    routers, switches, aps = get_devices(connections)
+    db.add_devices(conn, routers.values(), switches.values(), aps.values(), org_id, network_id)
+
+
+if __name__ == "__main__":
+    # connect to Meraki dashboard, or answer every call from the recorded responses
+    if MERAKI_CACHE == "offline":
+        dashboard = dashboard_cache.CachedDashboard(MERAKI_CACHE_DIR)
+    else:
+        dashboard = meraki.DashboardAPI(API_KEY, suppress_logging=True)
+        if MERAKI_CACHE == "record":
+            dashboard = dashboard_cache.CachedDashboard(MERAKI_CACHE_DIR, dashboard)
+    # connect to database and bring it up to the current schema
+    conn = db.create_connection(DB_FILE)
+    db.create_tables(conn)
+
+    # get org id and net id for the org and net names in environment variables
+    org_id = get_org_id(dashboard, ORG_NAME)
+    net_id = get_network_id(dashboard, org_id, NET_NAME)
+
+    # grab the network topology from Meraki dashboard to determine which devices are connected to each other
+    topology = dashboard.networks.getNetworkTopologyLinkLayer(net_id)
+
+    # get the model and status of every device in the network with two paginated calls instead of two calls per device
+    models, statuses = get_inventory(dashboard, org_id, network_ids=[net_id])
+
+    connections = classify_links(get_links(topology), models, statuses)
+    add_connections(conn, connections, org_id, net_id)
+
+    # print the results of all the queries to all the tables
+    pprint(db.query_all_routers(conn))
+    pprint(db.query_all_switches(conn))
+    pprint(db.query_all_aps(conn))
+
+    # close the database connection
+    db.close_connection(conn)
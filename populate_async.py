@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import asyncio
+import meraki.aio
+import os
+from dotenv import load_dotenv
+import db
+import populate
+
+# load environmental variables
+load_dotenv()
+
+API_KEY = os.getenv("MERAKI_TOKEN")
+ORG_NAME = os.getenv("MERAKI_ORG")
+# comma separated network names to populate - every network in the organization if not set
+NET_NAMES = os.getenv("MERAKI_NETWORKS")
+DB_FILE = os.getenv("DB_FILE", "sqlite.db")
+# the most Meraki API calls in flight at once - the API allows 10 calls per second per organization
+MAX_CONCURRENCY = int(os.getenv("MERAKI_MAX_CONCURRENCY", 5))
+
+# return the networks to populate
+async def get_networks(dashboard, org_id, net_names=None):
+    networks = await dashboard.organizations.getOrganizationNetworks(org_id,
+                                                                     total_pages="all")
+    if net_names:
+        networks = [net for net in networks if net["name"] in net_names]
+
+    return networks
+
+# fetch the inventory and the statuses of the organization's devices in bulk, returning dictionaries keyed by serial
+async def get_inventory(dashboard, org_id, network_ids=None):
+    kwargs = {"total_pages": "all"}
+    if network_ids is not None:
+        kwargs["networkIds"] = network_ids
+
+    devices, device_statuses = await asyncio.gather(
+        dashboard.organizations.getOrganizationDevices(org_id, **kwargs),
+        dashboard.organizations.getOrganizationDevicesStatuses(org_id, **kwargs))
+    models = {device["serial"]: device.get("model") or "" for device in devices}
+    statuses = {device["serial"]: populate.get_device_status(device["status"]) for device in device_statuses}
+
+    return models, statuses
+
+# fetch the topology of one network, waiting for a free slot so the organization's rate limit is respected
+async def get_topology(dashboard, semaphore, net):
+    async with semaphore:
+        try:
+            topology = await dashboard.networks.getNetworkTopologyLinkLayer(net["id"])
+        except meraki.exceptions.AsyncAPIError as e:
+            print("Unable to get the topology of network " + net["name"] + ": " + str(e))
+            topology = {"links": []}
+
+    return net, topology
+
+# fetch every network's topology concurrently and add each one to the database as soon as it arrives
+async def populate_networks(conn, org_name, net_names=None, max_concurrency=MAX_CONCURRENCY):
+    async with meraki.aio.AsyncDashboardAPI(API_KEY, suppress_logging=True,
+                                            maximum_concurrent_requests=max_concurrency) as dashboard:
+        orgs = await dashboard.organizations.getOrganizations()
+        org_id = None
+        for org in orgs:
+            if org["name"] == org_name:
+                org_id = org["id"]
+
+        networks = await get_networks(dashboard, org_id, net_names)
+        network_ids = [net["id"] for net in networks] if net_names else None
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        inventory = asyncio.ensure_future(get_inventory(dashboard, org_id, network_ids))
+        tasks = [asyncio.ensure_future(get_topology(dashboard, semaphore, net)) for net in networks]
+
+        models, statuses = await inventory
+        for task in asyncio.as_completed(tasks):
+            net, topology = await task
+            connections = populate.classify_links(populate.get_links(topology), models, statuses)
+            populate.add_connections(conn, connections, org_id, net["id"])
+            print("Added network " + net["name"])
+
+        return len(networks)
+
+
+if __name__ == "__main__":
+    # connect to database and bring it up to the current schema
+    conn = db.create_connection(DB_FILE)
+    db.create_tables(conn)
+
+    net_names = [name.strip() for name in NET_NAMES.split(",")] if NET_NAMES else None
+    count = asyncio.run(populate_networks(conn, ORG_NAME, net_names))
+    print("Populated " + str(count) + " networks")
+
+    # print the number of devices added to each table
+    print(str(len(db.query_all_routers(conn))) + " routers")
+    print(str(len(db.query_all_switches(conn))) + " switches")
+    print(str(len(db.query_all_aps(conn))) + " aps")
+
+    # close the database connection
+    db.close_connection(conn)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import argparse
+import cProfile
+import glob
+import hmac
+import os
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import event_log
+
+load_dotenv()
+
+# profile every alert
+PROFILE_ALL = os.getenv("PROFILE_ALERTS", "false").lower() == "true"
+# profile 1 in every N alerts (0 turns sampling off)
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", 0))
+# profile the alerts sent with this value in the X-Profile-Token header (off if not set)
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+# the directory the profiles are written to, and the number of profiles kept in it - the oldest are deleted first
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 200))
+
+TOKEN_HEADER = "X-Profile-Token"
+
+_lock = threading.Lock()
+_count = 0
+
+# return whether an alert received with the given request headers should be profiled
+def should_profile(headers):
+    global _count
+
+    if PROFILE_ALL:
+        return True
+
+    # compared as bytes, since compare_digest refuses strings with non-ASCII characters
+    if PROFILE_TOKEN and hmac.compare_digest(headers.get(TOKEN_HEADER, "").encode(), PROFILE_TOKEN.encode()):
+        return True
+
+    if PROFILE_SAMPLE_EVERY > 0:
+        with _lock:
+            _count += 1
+
+            return _count % PROFILE_SAMPLE_EVERY == 0
+
+    return False
+
+# profile the body of a with statement with cProfile when enabled is true, writing the result to a pstats file
+# named after the time, the alert type, and the serial - only the calling thread is profiled
+@contextmanager
+def profile(enabled, alert_type, serial):
+    if not enabled:
+        yield
+
+        return
+
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        try:
+            path = _write(profiler, alert_type, serial)
+            event_log.log_event("profile_written", alert_type=alert_type, serial=serial, path=path,
+                                duration_ms=event_log.elapsed_ms(started))
+        except OSError as e:
+            event_log.error("profile_written", alert_type=alert_type, serial=serial, error=str(e))
+
+def _write(profiler, alert_type, serial):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = "{:.6f}-{}-{}.pstats".format(time.time(), _slug(alert_type), _slug(serial))
+    path = os.path.join(PROFILE_DIR, name)
+    profiler.dump_stats(path)
+
+    # the names start with the time, so sorting them puts the oldest first
+    with _lock:
+        paths = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.pstats")))
+        for old in paths[:max(0, len(paths) - PROFILE_MAX_FILES)]:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+    return path
+
+def _slug(value):
+    return re.sub(r"[^A-Za-z0-9]+", "_", str(value or "none")).strip("_")
+
+# return the profiles in the directory, optionally only those of one alert type or serial
+def find_profiles(directory, alert_type=None, serial=None):
+    paths = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.pstats"))):
+        parts = os.path.basename(path)[:-len(".pstats")].split("-", 2)
+        if len(parts) != 3:
+            continue
+        if alert_type is not None and parts[1] != _slug(alert_type):
+            continue
+        if serial is not None and parts[2] != _slug(serial):
+            continue
+        paths.append(path)
+
+    return paths
+
+
+if __name__ == "__main__":
+    # combine the profiles written by the web server and print the functions that took the most time
+    parser = argparse.ArgumentParser(description="Summarize the alert profiles written by the web server")
+    parser.add_argument("--dir", default=PROFILE_DIR, help="directory the profiles were written to")
+    parser.add_argument("--alert-type", default=None, help="only the profiles of this alert type")
+    parser.add_argument("--serial", default=None, help="only the profiles of this device")
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key, such as cumulative or tottime")
+    parser.add_argument("--top", type=int, default=30, help="number of functions to print")
+    parser.add_argument("--filter", default=None, help="only functions whose file matches this pattern, such as db.py")
+    args = parser.parse_args()
+
+    paths = find_profiles(args.dir, args.alert_type, args.serial)
+    if not paths:
+        print("No profiles found in " + args.dir)
+    else:
+        stats = pstats.Stats(*paths)
+        print(str(len(paths)) + " profiles")
+        stats.sort_stats(args.sort)
+        if args.filter:
+            stats.print_stats(args.filter, args.top)
+        else:
+            stats.print_stats(args.top)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import asyncio
+import json
+import time
+import aiohttp
+import remedy_client
+import remedy_functions
+import metrics
+import event_log
+
+# methods that are safe to send again after a timeout or a 502/503/504, as in remedy_client
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+RETRY_STATUSES = (502, 503, 504)
+
+# the parts of an aiohttp response that are needed once its connection has been returned to the pool,
+# shaped like a requests response so remedy_functions.get_incident_ids works on it
+class Response:
+    __slots__ = ("status_code", "headers", "text")
+
+    def __init__(self, status_code, headers, text):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+# this class caches the Remedy token for the event loop, so concurrent requests wait for a single login
+class AsyncTokenManager:
+    def __init__(self, client):
+        self.client = client
+        self.token = None
+        self.expires_at = 0
+        self.hits = 0
+        self.refreshes = 0
+        self.lock = asyncio.Lock()
+
+    # return a valid token, logging in to Remedy only if there is no cached token or it has expired
+    async def get_token(self):
+        async with self.lock:
+            if self.token is not None and time.time() < self.expires_at - remedy_functions.TOKEN_EXPIRY_MARGIN:
+                self.hits += 1
+                metrics.REMEDY_TOKENS.inc(result="hit")
+
+                return self.token
+
+            return await self._login()
+
+    # throw away the given token and log in again, unless another request already replaced it
+    async def refresh(self, stale_token=None):
+        async with self.lock:
+            if stale_token is not None and self.token is not None and self.token != stale_token:
+                self.hits += 1
+                metrics.REMEDY_TOKENS.inc(result="hit")
+
+                return self.token
+
+            return await self._login()
+
+    async def _login(self):
+        # a failed login raises before anything is cached, so the next call tries again
+        token = await self.client.get_token()
+        self.token = token
+        self.expires_at = remedy_functions.get_token_expiry(token)
+        self.refreshes += 1
+        metrics.REMEDY_TOKENS.inc(result="refresh")
+
+        return token
+
+    def stats(self):
+        return {"hits": self.hits, "refreshes": self.refreshes}
+
+# this class makes the same Remedy API calls as remedy_functions over a pooled aiohttp session, so a request
+# waiting on Remedy holds a coroutine instead of a thread - start() and close() must run on the event loop
+class AsyncRemedyClient:
+    def __init__(self, remedy, pool_size=remedy_client.POOL_SIZE, connect_timeout=remedy_client.CONNECT_TIMEOUT,
+                 read_timeout=remedy_client.READ_TIMEOUT, retries=remedy_client.RETRIES,
+                 backoff=remedy_client.RETRY_BACKOFF):
+        self.remedy = remedy
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+        self.token_manager = AsyncTokenManager(self)
+
+    # open the session whose connections are kept alive and reused for every call to Remedy
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    # close every pooled connection
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # send a request to Remedy - connection failures are always retried, and timeouts and 502/503/504 responses
+    # only for idempotent methods, since Remedy may already have created the incident for a POST
+    async def request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            retry = attempt < self.retries
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    text = await response.text()
+                    if not (retry and method in IDEMPOTENT_METHODS and response.status in RETRY_STATUSES):
+                        return Response(response.status, response.headers, text)
+            except aiohttp.ClientConnectorError:
+                if not retry:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if not (retry and method in IDEMPOTENT_METHODS):
+                    raise
+
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    # retrieve and return an access token for Remedy API calls
+    @metrics.timed(metrics.REMEDY_REQUEST_SECONDS, call="login")
+    async def get_token(self):
+        headers = {
+            "Content-type": "application/x-www-form-urlencoded"
+            }
+
+        body = {
+            "username": self.remedy["username"],
+            "password": self.remedy["password"]
+            }
+
+        response = await self.request("POST", self.remedy["url"]+remedy_functions.LOGIN_ENDPOINT, headers=headers,
+                                      data=body, ssl=False)
+        # the response body is the token itself, so only the status is logged
+        event_log.log_event("remedy_login", status_code=response.status_code)
+        if response.status_code != 200:
+            metrics.REMEDY_ERRORS.inc(call="login")
+            raise remedy_functions.RemedyLoginError("Remedy login failed with status " + str(response.status_code))
+
+        return response.text
+
+    # send an authenticated request to Remedy, logging in again and retrying once if the cached token is rejected
+    async def send_request(self, method, endpoint, **kwargs):
+        token = await self.token_manager.get_token()
+        headers = kwargs.pop("headers", {})
+        headers["Authorization"] = 'AR-JWT {}'.format(token)
+
+        response = await self.request(method, self.remedy["url"]+endpoint, headers=headers, **kwargs)
+
+        # the cached token was rejected (expired or revoked on the server), so log in again and retry once
+        if response.status_code == 401:
+            token = await self.token_manager.refresh(token)
+            headers["Authorization"] = 'AR-JWT {}'.format(token)
+            response = await self.request(method, self.remedy["url"]+endpoint, headers=headers, **kwargs)
+
+        return response
+
+    # create an incident ticket with the same values as remedy_functions.create_incident
+    @metrics.timed(metrics.REMEDY_REQUEST_SECONDS, call="create_incident")
+    async def create_incident(self, event):
+        headers = {
+            'Content-Type': 'application/json'
+            }
+
+        try:
+            response = await self.send_request("POST", remedy_functions.CREATE_INCIDENT_ENDPOINT, headers=headers,
+                                               data=remedy_functions.incident_payload(self.remedy, event))
+        except Exception:
+            metrics.REMEDY_ERRORS.inc(call="create_incident")
+            raise
+        if response.status_code != 201:
+            metrics.REMEDY_ERRORS.inc(call="create_incident")
+
+        event_log.log_event("remedy_create_incident", status_code=response.status_code)
+
+        return response
+
+    # resolve an incident ticket, looking up its entry by incident number
+    @metrics.timed(metrics.REMEDY_REQUEST_SECONDS, call="resolve_incident")
+    async def resolve_incident(self, incident_number, resolution):
+        response = await self.send_request("GET", remedy_functions.INCIDENT_ENDPOINT,
+                                           params=remedy_functions.incident_query(incident_number))
+        entries = response.json().get("entries", []) if response.status_code == 200 else []
+        if not entries:
+            metrics.REMEDY_ERRORS.inc(call="resolve_incident")
+            event_log.warning("remedy_resolve_incident", incident=incident_number, error="incident not found")
+
+            return None
+
+        request_id = entries[0]["values"]["Request ID"]
+        headers = {
+            'Content-Type': 'application/json'
+            }
+
+        response = await self.send_request("PUT", remedy_functions.INCIDENT_ENDPOINT + "/" + request_id, headers=headers,
+                                           data=remedy_functions.resolution_payload(resolution))
+        if response.status_code >= 400:
+            metrics.REMEDY_ERRORS.inc(call="resolve_incident")
+
+        event_log.log_event("remedy_resolve_incident", incident=incident_number, status_code=response.status_code)
+
+        return response
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# connection pool and timeout settings for the Remedy API, all tunable through environment variables
+POOL_SIZE = int(os.getenv("REMEDY_POOL_SIZE", 10))
+CONNECT_TIMEOUT = float(os.getenv("REMEDY_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("REMEDY_READ_TIMEOUT", 30))
+RETRIES = int(os.getenv("REMEDY_RETRIES", 3))
+RETRY_BACKOFF = float(os.getenv("REMEDY_RETRY_BACKOFF", 0.5))
+
+_session = None
+_session_lock = threading.Lock()
+
+# build a session whose connections are kept alive and reused for every call to Remedy
+def create_session(pool_size=POOL_SIZE, retries=RETRIES, backoff=RETRY_BACKOFF):
+    # only idempotent methods are retried on connection errors and 502/503/504 responses -
+    # a ticket POST is never retried here, since Remedy may already have created the incident
+    retry = Retry(total=retries,
+                  connect=retries,
+                  read=retries,
+                  backoff_factor=backoff,
+                  status_forcelist=(502, 503, 504),
+                  allowed_methods=frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"]),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry, pool_block=True)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+# return the shared session, creating it the first time it is needed
+def get_session():
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+
+    return _session
+
+# send a request to Remedy over the pooled session with the default timeouts
+def request(method, url, **kwargs):
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    return get_session().request(method, url, **kwargs)
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
+
+# close every pooled connection
+def close():
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
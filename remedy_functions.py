@@ -15,15 +15,33 @@ writing, software distributed under the License is distributed on an "AS
 IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
-import requests
+import remedy_client
 import json, os
+import base64
+import threading
+import time
 from pprint import pprint
 from dotenv import load_dotenv
+import metrics
+import event_log
+
+# seconds before the real expiry at which a cached token is treated as expired
+TOKEN_EXPIRY_MARGIN = 60
+# lifetime to assume when the token does not carry an exp claim (Remedy default is one hour)
+DEFAULT_TOKEN_TTL = int(os.getenv("REMEDY_TOKEN_TTL", 3600))
+
+LOGIN_ENDPOINT = "/api/jwt/login"
+# ask Remedy to return the incident number of the new ticket so it can be recorded
+CREATE_INCIDENT_ENDPOINT = "/api/arsys/v1/entry/HPD:IncidentInterface_Create?fields=values(Incident Number)"
+INCIDENT_ENDPOINT = "/api/arsys/v1/entry/HPD:IncidentInterface"
+
+# raised when Remedy refuses the login, so no error page is ever cached or sent as a token
+class RemedyLoginError(Exception):
+    pass
 
 # this function will retrieve and return an access token for Remedy API calls
+@metrics.timed(metrics.REMEDY_REQUEST_SECONDS, call="login")
 def get_token(remedy):
-    login_endpoint = "/api/jwt/login"
-
     headers = {
         "Content-type": "application/x-www-form-urlencoded"
         }
@@ -33,21 +51,96 @@ def get_token(remedy):
         "password": remedy["password"]
         }
 
-    response = requests.post(remedy["url"]+login_endpoint, headers=headers,
-                             data=body, verify=False)
-    print(response.text)
+    response = remedy_client.post(remedy["url"]+LOGIN_ENDPOINT, headers=headers,
+                                  data=body, verify=False)
+    # the response body is the token itself, so only the status is logged
+    event_log.log_event("remedy_login", status_code=response.status_code)
+    if response.status_code != 200:
+        metrics.REMEDY_ERRORS.inc(call="login")
+        raise RemedyLoginError("Remedy login failed with status " + str(response.status_code))
 
     return response.text
 
-# this function will create an incident ticket with pre-set values in Remedy
-def create_incident(remedy, event):
-    incident_endpoint = "/api/arsys/v1/entry/HPD:IncidentInterface_Create"
+# return the expiry time of an AR-JWT token, falling back to the default lifetime if it can't be read
+def get_token_expiry(token):
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + DEFAULT_TOKEN_TTL
+
+# this class caches the Remedy token and shares it across threads, logging in again only when it expires
+class TokenManager:
+    def __init__(self, remedy):
+        self.remedy = remedy
+        self.token = None
+        self.expires_at = 0
+        self.hits = 0
+        self.refreshes = 0
+        self.lock = threading.Lock()
+
+    # return a valid token, logging in to Remedy only if there is no cached token or it has expired
+    def get_token(self):
+        with self.lock:
+            if self.token is not None and time.time() < self.expires_at - TOKEN_EXPIRY_MARGIN:
+                self.hits += 1
+                metrics.REMEDY_TOKENS.inc(result="hit")
+
+                return self.token
+
+            return self._login()
 
+    # throw away the given token and log in again, unless another thread already replaced it
+    def refresh(self, stale_token=None):
+        with self.lock:
+            if stale_token is not None and self.token is not None and self.token != stale_token:
+                self.hits += 1
+                metrics.REMEDY_TOKENS.inc(result="hit")
+
+                return self.token
+
+            return self._login()
+
+    def _login(self):
+        # a failed login raises before anything is cached, so the next call tries again
+        token = get_token(self.remedy)
+        self.token = token
+        self.expires_at = get_token_expiry(token)
+        self.refreshes += 1
+        metrics.REMEDY_TOKENS.inc(result="refresh")
+
+        return token
+
+    def stats(self):
+        return {"hits": self.hits, "refreshes": self.refreshes}
+
+# send an authenticated request to Remedy, logging in again and retrying once if the cached token is rejected
+def send_request(remedy, method, endpoint, **kwargs):
+    token_manager = remedy["token_manager"]
+    token = token_manager.get_token()
+    headers = kwargs.pop("headers", {})
+    headers["Authorization"] = 'AR-JWT {}'.format(token)
+
+    response = remedy_client.request(method, remedy["url"]+endpoint, headers=headers, **kwargs)
+
+    # the cached token was rejected (expired or revoked on the server), so log in again and retry once
+    if response.status_code == 401:
+        token = token_manager.refresh(token)
+        headers["Authorization"] = 'AR-JWT {}'.format(token)
+        response = remedy_client.request(method, remedy["url"]+endpoint, headers=headers, **kwargs)
+
+    return response
+
+# return the body of the request that creates an incident ticket for the event
+def incident_payload(remedy, event):
     # to change ticket fields such as the description, impact, urgency, status, etc. modify the following values
-    payload = json.dumps({
+    return json.dumps({
         "values": {
             "Description": "Meraki REST API: Incident Creation",
-            "Detailed_Decription": "Meraki REST API TEST",
+            "Detailed_Decription": event["description"],
             "Product Name": "BMC Remedy",
             "Login_ID": remedy["username"],
             "Impact": "4-Minor/Localized",
@@ -58,11 +151,81 @@ def create_incident(remedy, event):
             "z1D_Action": "CREATE"
             }
         })
+
+# return the query parameters that look up the entry of an incident by its incident number
+def incident_query(incident_number):
+    return {
+        "q": "'Incident Number'=\"" + incident_number + "\"",
+        "fields": "values(Request ID)"
+        }
+
+# return the body of the request that resolves an incident ticket
+def resolution_payload(resolution):
+    return json.dumps({
+        "values": {
+            "Status": "Resolved",
+            "Status_Reason": "Automated Resolution Reported",
+            "Resolution": resolution
+            }
+        })
+
+# this function will create an incident ticket with pre-set values in Remedy
+@metrics.timed(metrics.REMEDY_REQUEST_SECONDS, call="create_incident")
+def create_incident(remedy, event):
+    payload = incident_payload(remedy, event)
     headers = {
-        'Content-Type': 'application/json',
-        'Authorization': 'AR-JWT {}'.format(remedy["token"])
+        'Content-Type': 'application/json'
         }
 
-    response = requests.post(remedy["url"]+incident_endpoint, headers=headers, data=payload)
+    try:
+        response = send_request(remedy, "POST", CREATE_INCIDENT_ENDPOINT, headers=headers, data=payload)
+    except Exception:
+        metrics.REMEDY_ERRORS.inc(call="create_incident")
+        raise
+    if response.status_code != 201:
+        metrics.REMEDY_ERRORS.inc(call="create_incident")
+
+    event_log.log_event("remedy_create_incident", status_code=response.status_code)
+
+    return response
+
+# return the entry id and incident number of a ticket from the response to create_incident, or None for each if it wasn't created
+def get_incident_ids(response):
+    if response.status_code != 201:
+        return None, None
+
+    # the entry id is the last part of the URL in the Location header
+    location = response.headers.get("Location")
+    entry_id = location.rstrip("/").rsplit("/", 1)[-1] if location else None
+
+    try:
+        incident_number = response.json()["values"]["Incident Number"]
+    except (ValueError, KeyError, TypeError):
+        incident_number = None
+
+    return entry_id, incident_number
+
+# this function will resolve an incident ticket in Remedy, looking up its entry by incident number
+@metrics.timed(metrics.REMEDY_REQUEST_SECONDS, call="resolve_incident")
+def resolve_incident(remedy, incident_number, resolution):
+    response = send_request(remedy, "GET", INCIDENT_ENDPOINT, params=incident_query(incident_number))
+    entries = response.json().get("entries", []) if response.status_code == 200 else []
+    if not entries:
+        metrics.REMEDY_ERRORS.inc(call="resolve_incident")
+        event_log.warning("remedy_resolve_incident", incident=incident_number, error="incident not found")
+
+        return None
+
+    request_id = entries[0]["values"]["Request ID"]
+    headers = {
+        'Content-Type': 'application/json'
+        }
+
+    response = send_request(remedy, "PUT", INCIDENT_ENDPOINT + "/" + request_id, headers=headers,
+                            data=resolution_payload(resolution))
+    if response.status_code >= 400:
+        metrics.REMEDY_ERRORS.inc(call="resolve_incident")
+
+    event_log.log_event("remedy_resolve_incident", incident=incident_number, status_code=response.status_code)
 
-    print(response.status_code)
+    return response
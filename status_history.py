@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import argparse
+import os
+import threading
+import time
+from dotenv import load_dotenv
+import db
+import event_log
+import metrics
+
+load_dotenv()
+
+# record every status change in the database (set to false to turn the history off)
+STATUS_HISTORY = os.getenv("STATUS_HISTORY", "true").lower() == "true"
+# seconds between writes of the changes waiting in memory, and the most changes written in one transaction
+STATUS_HISTORY_FLUSH_INTERVAL = float(os.getenv("STATUS_HISTORY_FLUSH_INTERVAL", 1))
+STATUS_HISTORY_BATCH_SIZE = int(os.getenv("STATUS_HISTORY_BATCH_SIZE", 1000))
+# the most changes held in memory - past it, new changes are dropped rather than slowing down the alerts
+STATUS_HISTORY_MAX_PENDING = int(os.getenv("STATUS_HISTORY_MAX_PENDING", 100000))
+# seconds between roll ups of the changes into outages, and seconds the changes themselves are kept after that
+STATUS_HISTORY_ROLLUP_INTERVAL = float(os.getenv("STATUS_HISTORY_ROLLUP_INTERVAL", 60))
+STATUS_HISTORY_RETENTION = float(os.getenv("STATUS_HISTORY_RETENTION", 7 * 86400))
+# the most changes rolled up in one transaction
+ROLLUP_BATCH_SIZE = 5000
+
+# this class records every status change of a device in the status_events table - changes are held in memory and
+# written by a background thread in one transaction per batch, so recording one never waits on the database, and
+# the thread periodically rolls them up into one row per outage in the outages table and deletes the old changes
+class StatusHistory:
+    def __init__(self, db_file, flush_interval=STATUS_HISTORY_FLUSH_INTERVAL, batch_size=STATUS_HISTORY_BATCH_SIZE,
+                 max_pending=STATUS_HISTORY_MAX_PENDING, rollup_interval=STATUS_HISTORY_ROLLUP_INTERVAL,
+                 retention=STATUS_HISTORY_RETENTION):
+        self.db_file = db_file
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.rollup_interval = rollup_interval
+        self.retention = retention
+
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.pending = []
+        self.written = 0
+        self.dropped = 0
+        self.rolled_up = 0
+
+    # start the thread that writes and rolls up the changes
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="status-history", daemon=True)
+        self.thread.start()
+
+    # record that a device changed to a status at a time (now if not given)
+    def record(self, device, status, occurred_at=None):
+        event = (device.serial, device.device_type, device.network_id, status, occurred_at or time.time())
+        with self.cond:
+            if len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                metrics.STATUS_EVENTS.inc(result="dropped")
+
+                return
+            self.pending.append(event)
+            if len(self.pending) == self.batch_size:
+                self.cond.notify()
+
+    def _run(self):
+        next_rollup = time.monotonic()
+        while True:
+            with self.cond:
+                if self.running and len(self.pending) < self.batch_size:
+                    self.cond.wait(self.flush_interval)
+                running = self.running
+
+            self._flush()
+            if not running:
+                return
+
+            if time.monotonic() >= next_rollup:
+                self._rollup()
+                next_rollup = time.monotonic() + self.rollup_interval
+
+    # write the changes waiting in memory, a batch per transaction
+    def _flush(self):
+        while True:
+            with self.cond:
+                events = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+            if not events:
+                return
+
+            try:
+                with db.get_pool(self.db_file).connection() as conn:
+                    db.add_status_events(conn, events)
+            except Exception as e:
+                metrics.STATUS_EVENTS.inc(len(events), result="failed")
+                event_log.error("status_history_write", events=len(events), error=str(e))
+
+                return
+
+            metrics.STATUS_EVENTS.inc(len(events), result="written")
+            with self.cond:
+                self.written += len(events)
+
+    # roll every change written so far up into outages
+    def _rollup(self):
+        started = time.perf_counter()
+        count = 0
+        try:
+            with db.get_pool(self.db_file).connection() as conn:
+                while True:
+                    rolled_up = db.rollup_status_events(conn, ROLLUP_BATCH_SIZE, time.time() - self.retention)
+                    count += rolled_up
+                    if rolled_up < ROLLUP_BATCH_SIZE:
+                        break
+        except Exception as e:
+            event_log.error("status_history_rollup", error=str(e))
+
+        if count:
+            with self.cond:
+                self.rolled_up += count
+            event_log.log_event("status_history_rollup", events=count, duration_ms=event_log.elapsed_ms(started))
+
+    # stop the thread once every change waiting in memory is written
+    def shutdown(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self._flush()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "pending": len(self.pending),
+                "written": self.written,
+                "dropped": self.dropped,
+                "rolled_up": self.rolled_up
+            }
+
+
+if __name__ == "__main__":
+    # report the devices that changed status the most and the outage minutes of each network
+    parser = argparse.ArgumentParser(description="Report flapping devices and outage minutes from the status history")
+    parser.add_argument("report", choices=("flapping", "outages"))
+    parser.add_argument("--db", default=os.getenv("DB_FILE", "sqlite.db"), help="database file")
+    parser.add_argument("--hours", type=float, default=None, help="hours to look back (1 for flapping, 24 for outages)")
+    parser.add_argument("--min-changes", type=int, default=4, help="status changes that make a device flapping")
+    parser.add_argument("--network", default=None, help="only this network id")
+    args = parser.parse_args()
+
+    now = time.time()
+    with db.get_pool(args.db).connection() as conn:
+        db.create_tables(conn)
+        if args.report == "flapping":
+            since = now - (args.hours or 1) * 3600
+            for serial, device_type, network_id, changes, status in db.query_flapping_devices(conn, since, args.min_changes, args.network):
+                print(serial + " (" + device_type + ", " + str(network_id) + "): " + str(changes) + " changes, now " + status)
+        else:
+            # bring the outages up to date with the changes written since the last roll up
+            while db.rollup_status_events(conn, ROLLUP_BATCH_SIZE, now - STATUS_HISTORY_RETENTION) == ROLLUP_BATCH_SIZE:
+                pass
+            since = now - (args.hours or 24) * 3600
+            for network_id, minutes, outages, mttr in db.query_outage_minutes(conn, since, now, args.network):
+                print(str(network_id) + ": " + "{:.1f}".format(minutes) + " outage minutes over " + str(outages) + " outages, " +
+                      ("mean time to recover {:.1f} minutes".format(mttr) if mttr is not None else "none recovered yet"))
+    db.close_all_connections()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import meraki
+import os
+import time
+from dotenv import load_dotenv
+import db
+import populate
+
+# load environmental variables
+load_dotenv()
+
+API_KEY = os.getenv("MERAKI_TOKEN")
+ORG_NAME = os.getenv("MERAKI_ORG")
+# comma separated network names to sync - every network in the organization if not set
+NET_NAMES = os.getenv("MERAKI_NETWORKS")
+DB_FILE = os.getenv("DB_FILE", "sqlite.db")
+# seconds between topology polls
+SYNC_INTERVAL = float(os.getenv("SYNC_INTERVAL", 300))
+# a poll that would remove this fraction of a network's devices or more is skipped, since it is more likely an
+# incomplete answer from the API than a real change - set SYNC_FORCE to true to apply it anyway
+SYNC_MAX_REMOVED_FRACTION = float(os.getenv("SYNC_MAX_REMOVED_FRACTION", 0.5))
+SYNC_FORCE = os.getenv("SYNC_FORCE", "false").lower() == "true"
+
+# fetch the current topology of one network and apply the differences to the database, using the organization's
+# inventory dictionaries
+def sync_network(dashboard, conn, org_id, net_id, models, statuses):
+    topology = dashboard.networks.getNetworkTopologyLinkLayer(net_id)
+
+    connections = populate.classify_links(populate.get_links(topology), models, statuses)
+    routers, switches, aps = populate.get_devices(connections)
+
+    return db.apply_topology_diff(conn, routers, switches, aps, org_id, net_id,
+                                  max_removed_fraction=SYNC_MAX_REMOVED_FRACTION, force=SYNC_FORCE)
+
+# sync every network of the organization, or only the ones with the given names, fetching the inventory of all
+# of them at once - a network whose topology can't be fetched or whose diff is refused is skipped with a message
+# and the others are still synced - returns the diff applied to each network, by network name
+def sync_once(dashboard, conn, org_id, net_names=None):
+    networks = populate.get_networks(dashboard, org_id, net_names)
+    network_ids = [net["id"] for net in networks] if net_names else None
+    models, statuses = populate.get_inventory(dashboard, org_id, network_ids=network_ids)
+
+    diffs = {}
+    for net in networks:
+        try:
+            diffs[net["name"]] = diff = sync_network(dashboard, conn, org_id, net["id"], models, statuses)
+            print_diff(net["name"], diff)
+        except meraki.exceptions.APIError as e:
+            print("Topology sync of network " + net["name"] + " failed: " + str(e))
+        except db.TopologyDiffRefused as e:
+            print("Topology sync of network " + net["name"] + " skipped: " + str(e) +
+                  " - set SYNC_FORCE=true if the devices were really removed")
+
+    return diffs
+
+# print how many devices of each type were added, removed, and moved in a network
+def print_diff(net_name, diff):
+    for table, (added, removed, moved) in diff.items():
+        if added or removed or moved:
+            print(net_name + " " + table + ": " + str(len(added)) + " added, " + str(len(removed)) + " removed, " +
+                  str(len(moved)) + " moved")
+
+
+if __name__ == "__main__":
+    # connect to Meraki dashboard
+    dashboard = meraki.DashboardAPI(API_KEY, suppress_logging=True)
+    # connect to database
+    conn = db.create_connection(DB_FILE)
+    db.create_tables(conn)
+
+    org_id = populate.get_org_id(dashboard, ORG_NAME)
+    net_names = [name.strip() for name in NET_NAMES.split(",")] if NET_NAMES else None
+
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                sync_once(dashboard, conn, org_id, net_names)
+            except meraki.exceptions.APIError as e:
+                print("Topology sync failed: " + str(e))
+
+            time.sleep(max(0, SYNC_INTERVAL - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # close the database connection
+        db.close_connection(conn)
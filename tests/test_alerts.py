@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import alerts
+import db
+from topology import Topology
+from incidents import IncidentRegistry
+
+# stands in for the outbox dispatcher, writing the ticket to the outbox table without sending it
+class FakeOutbox:
+    def submit(self, conn, serial, alert_type, network_id, description):
+        return db.add_outbox(conn, serial, alert_type, network_id, description, 0)
+
+    def resolve(self, incident_number, resolution):
+        pass
+
+def alert(alert_type, serial, occurred_at):
+    return {
+        "alertType": alert_type,
+        "deviceSerial": serial,
+        "networkId": "N1",
+        "networkName": "Network 1",
+        "occurredAt": occurred_at
+    }
+
+# a router R1 with a switch S1 behind it and an AP A1 behind the switch
+class CascadeRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = db.create_connection(":memory:")
+        db.create_tables(self.conn)
+        db.add_devices(self.conn, [("R1", "up")], [("S1", "up", "R1")], [("A1", "up", "S1")], "O1", "N1")
+        self.topology = Topology()
+        self.topology.load(self.conn)
+        self.incidents = IncidentRegistry()
+        self.remedy = {"outbox": FakeOutbox()}
+
+    def tearDown(self):
+        self.conn.close()
+
+    def handle(self, batch):
+        alerts.handle_alerts(self.conn, self.remedy, self.topology, self.incidents, batch)
+
+    def ticketed(self):
+        return sorted(row[0] for row in self.conn.execute("SELECT serial FROM outbox"))
+
+    def status(self, serial):
+        return self.topology.get(serial).status
+
+    # an AP that failed before its router keeps its ticket when the router comes back up in the same batch
+    def test_independent_failure_below_recovering_router(self):
+        self.handle([
+            alert("APs went down", "A1", "2024-01-01T00:00:00Z"),
+            alert("Cellular went down", "R1", "2024-01-01T00:01:40Z"),
+            alert("switches went down", "S1", "2024-01-01T00:01:45Z"),
+            alert("Cellular came up", "R1", "2024-01-01T00:06:40Z")
+        ])
+
+        self.assertEqual(self.ticketed(), ["A1"])
+        self.assertEqual(self.status("A1"), "down")
+        self.assertEqual(self.status("S1"), "up")
+        self.assertEqual(db.query_ap_status(self.conn, "A1"), [("down",)])
+
+    # devices that went down behind the router are brought back up with it and need no ticket
+    def test_devices_behind_recovering_router_come_up(self):
+        self.handle([
+            alert("Cellular went down", "R1", "2024-01-01T00:00:00Z"),
+            alert("switches went down", "S1", "2024-01-01T00:00:05Z"),
+            alert("APs went down", "A1", "2024-01-01T00:00:06Z"),
+            alert("Cellular came up", "R1", "2024-01-01T00:05:00Z")
+        ])
+
+        self.assertEqual(self.ticketed(), [])
+        self.assertEqual([self.status(serial) for serial in ("R1", "S1", "A1")], ["up", "up", "up"])
+
+    # a device whose down alert was handled in an earlier batch comes back up with its router
+    def test_devices_down_from_earlier_batch_come_up(self):
+        self.handle([alert("Cellular went down", "R1", "2024-01-01T00:00:00Z")])
+        self.handle([alert("switches went down", "S1", "2024-01-01T00:00:05Z")])
+        self.handle([alert("Cellular came up", "R1", "2024-01-01T00:05:00Z")])
+
+        self.assertEqual(self.ticketed(), ["R1"])
+        self.assertEqual(self.status("S1"), "up")
+        self.assertEqual(db.query_switch_status(self.conn, "S1"), [("up",)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import datetime
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import backfill
+import db
+from topology import Topology
+from incidents import IncidentRegistry
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+
+def iso(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# an availability change of a device in the form Meraki's change history returns it, seconds after START
+def change(serial, old, new, seconds):
+    return {
+        "ts": iso(START + seconds),
+        "device": {"serial": serial},
+        "network": {"name": "Network 1"},
+        "details": {"old": [{"name": "status", "value": old}], "new": [{"name": "status", "value": new}]}
+    }
+
+# answers the change history call from a list of changes, recording the time range of every call
+class Dashboard:
+    def __init__(self, changes):
+        self.changes = changes
+        self.calls = []
+        self.organizations = self
+
+    def getOrganizationDevicesAvailabilitiesChangeHistory(self, org_id, total_pages=None, perPage=None, t0=None, t1=None):
+        self.calls.append((t0, t1))
+
+        return [change for change in self.changes if t0 <= change["ts"] < t1]
+
+# stands in for the outbox dispatcher, writing the ticket to the outbox table without sending it - it raises
+# for the devices in fail, like a database error in the middle of a window
+class FakeOutbox:
+    def __init__(self, fail=()):
+        self.fail = fail
+
+    def submit(self, conn, serial, alert_type, network_id, description):
+        if serial in self.fail:
+            raise RuntimeError("outbox unavailable")
+
+        return db.add_outbox(conn, serial, alert_type, network_id, description, 0)
+
+    def resolve(self, incident_number, resolution):
+        pass
+
+def alert(serial, occurred_at):
+    return {"alertType": "APs went down", "deviceSerial": serial, "occurredAt": iso(START + occurred_at)}
+
+class GetBatchesTest(unittest.TestCase):
+    # without a correlation window every change is decided on its own
+    def test_no_window_replays_one_change_at_a_time(self):
+        network_alerts = [alert("A1", 0), alert("A2", 1), alert("A3", 2)]
+
+        self.assertEqual(backfill.get_batches(network_alerts, 0), [[data] for data in network_alerts])
+
+    # the changes within the window of the first change of a batch are decided together
+    def test_window_groups_changes(self):
+        network_alerts = [alert("A1", 0), alert("A2", 29), alert("A3", 30), alert("A4", 45), alert("A5", 100)]
+
+        batches = backfill.get_batches(network_alerts, 30)
+
+        self.assertEqual([[data["deviceSerial"] for data in batch] for batch in batches], [["A1", "A2"], ["A3", "A4"], ["A5"]])
+
+class BackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = db.create_connection(":memory:")
+        db.create_tables(self.conn)
+        db.add_devices(self.conn, [("R1", "up")], [("S1", "up", "R1")], [("A1", "up", "S1"), ("A2", "up", "S1")], "O1", "N1")
+        self.topology = Topology()
+        self.topology.load(self.conn)
+        self.incidents = IncidentRegistry()
+        self.remedy = {"outbox": FakeOutbox()}
+
+    def tearDown(self):
+        self.conn.close()
+
+    def window(self, changes, t0=START, t1=START + 3600):
+        return backfill.backfill_window(Dashboard(changes), self.conn, self.remedy, self.topology, self.incidents, "O1", t0, t1)
+
+    def ticketed(self):
+        return sorted(row[0] for row in self.conn.execute("SELECT serial FROM outbox"))
+
+    # changes are turned into alerts per network in the order they happened, skipping unknown devices and repeats
+    def test_get_alerts(self):
+        batches = backfill.get_alerts([
+            change("A1", "online", "offline", 20),
+            change("X1", "online", "offline", 5),
+            change("R1", "online", "offline", 10),
+            change("A1", "offline", "offline", 30)
+        ], self.topology)
+
+        self.assertEqual([(data["alertType"], data["deviceSerial"]) for data in batches["N1"]],
+                         [("Cellular went down", "R1"), ("APs went down", "A1")])
+
+    # the replayed changes update the statuses and create tickets, and the cursor moves to the end of the window
+    def test_window_replays_changes(self):
+        fetched, replayed = self.window([change("S1", "online", "offline", 10), change("A2", "online", "offline", 20),
+                                         change("A1", "online", "offline", 30), change("A1", "offline", "online", 40)])
+
+        self.assertEqual((fetched, replayed), (4, 4))
+        self.assertEqual(self.ticketed(), ["S1"])
+        self.assertEqual(db.query_switch_status(self.conn, "S1"), [("down",)])
+        self.assertEqual(db.query_meta(self.conn, backfill.cursor_key("O1")), START + 3600)
+
+    # an AP that failed on its own before its router went down and came back keeps its ticket
+    def test_independent_failure_is_ticketed(self):
+        self.window([change("A1", "online", "offline", 0), change("R1", "online", "offline", 100),
+                     change("S1", "online", "offline", 105), change("R1", "offline", "online", 400)])
+
+        self.assertEqual(self.ticketed(), ["A1", "R1"])
+        self.assertEqual(self.topology.get("A1").status, "down")
+
+    # a window that fails part way leaves the cursor alone, keeps the batches already written, and reloads the
+    # statuses and tickets of the batch that was rolled back, so memory matches the database
+    def test_failed_window_is_rolled_back_per_batch(self):
+        self.remedy["outbox"] = FakeOutbox(fail={"A2"})
+        with self.assertRaises(RuntimeError):
+            self.window([change("A1", "online", "offline", 10), change("A2", "online", "offline", 20)])
+
+        self.assertIsNone(db.query_meta(self.conn, backfill.cursor_key("O1")))
+        self.assertEqual(self.ticketed(), ["A1"])
+        self.assertEqual(db.query_ap_status(self.conn, "A2"), [("up",)])
+        self.assertEqual(self.topology.get("A2").status, "up")
+        self.assertIsNone(self.incidents.get("A2", "APs went down"))
+
+        # the next run replays the window without a second ticket for the AP that was already written
+        self.remedy["outbox"] = FakeOutbox()
+        self.window([change("A1", "online", "offline", 10), change("A2", "online", "offline", 20)])
+        self.assertEqual(self.ticketed(), ["A1", "A2"])
+
+    # history is replayed from the stored cursor up to a minute ago, one window at a time
+    def test_backfill_resumes_from_cursor(self):
+        now = time.time()
+        db.set_meta(self.conn, backfill.cursor_key("O1"), now - 2.5 * backfill.BACKFILL_WINDOW)
+        dashboard = Dashboard([])
+
+        backfill.backfill(dashboard, self.conn, self.remedy, self.topology, self.incidents, "O1")
+
+        self.assertEqual(len(dashboard.calls), 3)
+        self.assertEqual(dashboard.calls[0][0], iso(now - 2.5 * backfill.BACKFILL_WINDOW))
+        self.assertGreaterEqual(db.query_meta(self.conn, backfill.cursor_key("O1")), now - backfill.BACKFILL_LAG)
+
+    # a cursor older than the 14 days Meraki keeps starts the backfill 14 days back instead
+    def test_backfill_start_is_clamped(self):
+        now = time.time()
+        db.set_meta(self.conn, backfill.cursor_key("O1"), now - 30 * 86400)
+        dashboard = Dashboard([])
+
+        backfill.backfill(dashboard, self.conn, self.remedy, self.topology, self.incidents, "O1")
+
+        oldest = datetime.datetime.strptime(dashboard.calls[0][0], "%Y-%m-%dT%H:%M:%SZ")
+        oldest = oldest.replace(tzinfo=datetime.timezone.utc).timestamp()
+        self.assertGreaterEqual(oldest, now - backfill.MERAKI_HISTORY_LIMIT)
+        self.assertLess(oldest, now - backfill.MERAKI_HISTORY_LIMIT + 2 * backfill.BACKFILL_LAG)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+from outbox import OutboxDispatcher
+from incidents import IncidentRegistry
+
+# a dispatcher whose tickets get the scripted results, in place of Remedy's answers - an error of None creates the ticket
+class ScriptedDispatcher(OutboxDispatcher):
+    def __init__(self, db_file, results, **kwargs):
+        super().__init__(db_file, {}, IncidentRegistry(), **kwargs)
+        self.results = list(results)
+
+    def _send(self, description):
+        error, retry = self.results.pop(0)
+        if error is None:
+            return None, False, "000000000000001", "INC000000000001"
+
+        return error, retry, None, None
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.dir.name, "outbox.db")
+        with db.get_pool(self.db_file).connection() as conn:
+            db.create_tables(conn)
+
+    def tearDown(self):
+        db.get_pool(self.db_file).close()
+        self.dir.cleanup()
+
+    # queue a ticket for the AP and record it as open, as alerts.open_ticket does
+    def add_ticket(self, dispatcher, serial="A1", network_id="N1"):
+        with db.get_pool(self.db_file).connection() as conn:
+            dispatcher.incidents.open(conn, serial, "APs went down", network_id, None, None)
+
+            return db.add_outbox(conn, serial, "APs went down", network_id, "AP " + serial + " is down", 0)
+
+    def row(self, outbox_id):
+        with db.get_pool(self.db_file).connection() as conn:
+            return conn.execute("""SELECT attempts, next_attempt_at, claimed_by, lease_until
+                                FROM outbox
+                                WHERE id = ?""", (outbox_id,)).fetchone()
+
+    # claim the due tickets and send them one after another, as the dispatcher thread does
+    def deliver(self, dispatcher, now=None):
+        tickets = dispatcher._claim(time.time() if now is None else now, dispatcher.max_in_flight)
+        for ticket in tickets:
+            dispatcher.in_flight.add(ticket[0])
+            dispatcher._deliver(ticket)
+
+        return tickets
+
+    # two dispatchers sharing the database never lease the same ticket
+    def test_claim_is_exclusive(self):
+        first = ScriptedDispatcher(self.db_file, [])
+        second = ScriptedDispatcher(self.db_file, [])
+        ids = [self.add_ticket(first, "A" + str(i)) for i in range(5)]
+
+        claimed = [ticket[0] for ticket in first._claim(time.time(), 3)]
+        claimed += [ticket[0] for ticket in second._claim(time.time(), 3)]
+
+        self.assertEqual(sorted(claimed), ids)
+        self.assertEqual(second._claim(time.time(), 3), [])
+
+    # a ticket whose dispatcher stopped while sending it is due again once the lease runs out
+    def test_expired_lease_is_claimed_again(self):
+        first = ScriptedDispatcher(self.db_file, [], lease=60)
+        second = ScriptedDispatcher(self.db_file, [])
+        outbox_id = self.add_ticket(first)
+        now = time.time()
+        first._claim(now, 1)
+
+        self.assertEqual(second._claim(now + 30, 1), [])
+        self.assertEqual([ticket[0] for ticket in second._claim(now + 61, 1)], [outbox_id])
+        self.assertEqual(self.row(outbox_id)[2], second.dispatcher_id)
+
+    # only the tickets of the networks the dispatcher owns are leased
+    def test_claim_only_owned_networks(self):
+        dispatcher = ScriptedDispatcher(self.db_file, [], network_ids=lambda: {"N2"})
+        self.add_ticket(dispatcher, "A1", "N1")
+        outbox_id = self.add_ticket(dispatcher, "A2", "N2")
+
+        self.assertEqual([ticket[0] for ticket in dispatcher._claim(time.time(), 4)], [outbox_id])
+
+    # a delivered ticket leaves the outbox and its incident gets Remedy's ids
+    def test_delivered_ticket_is_removed(self):
+        dispatcher = ScriptedDispatcher(self.db_file, [(None, False)])
+        outbox_id = self.add_ticket(dispatcher)
+
+        self.deliver(dispatcher)
+
+        self.assertIsNone(self.row(outbox_id))
+        self.assertEqual(dispatcher.incidents.get("A1", "APs went down").incident_number, "INC000000000001")
+        self.assertEqual(dispatcher.stats()["delivered"], 1)
+
+    # a failed ticket is retried after a backoff that doubles with every attempt, and keeps no lease while it waits
+    def test_retry_backs_off_exponentially(self):
+        dispatcher = ScriptedDispatcher(self.db_file, [("Remedy answered 503", True)] * 3, base_delay=10, max_delay=25)
+        outbox_id = self.add_ticket(dispatcher)
+
+        delays = []
+        for _ in range(3):
+            sent_at = time.time()
+            self.deliver(dispatcher, now=1e12)
+            attempts, next_attempt_at, claimed_by, lease_until = self.row(outbox_id)
+            delays.append(next_attempt_at - sent_at)
+            self.assertIsNone(claimed_by)
+            self.assertIsNone(lease_until)
+
+        self.assertEqual(attempts, 3)
+        # the delay is jittered down to half of 10, 20, and then the 25 second cap
+        for delay, full in zip(delays, (10, 20, 25)):
+            self.assertGreaterEqual(delay, full / 2 - 1)
+            self.assertLessEqual(delay, full + 1)
+
+    # a ticket Remedy rejects outright is not retried, and the device's next alert may queue another
+    def test_rejected_ticket_fails_for_good(self):
+        dispatcher = ScriptedDispatcher(self.db_file, [("Remedy answered 400", False)])
+        outbox_id = self.add_ticket(dispatcher)
+
+        self.deliver(dispatcher)
+
+        self.assertIsNone(self.row(outbox_id)[1])
+        self.assertIsNone(dispatcher.incidents.get("A1", "APs went down"))
+        self.assertEqual(dispatcher.stats()["failed_permanently"], 1)
+
+    # a run of failures opens the breaker, which lets a single ticket through once the cooldown has passed
+    def test_breaker_opens_after_failures(self):
+        dispatcher = ScriptedDispatcher(self.db_file, [("Remedy answered 503", True)] * 2 + [(None, False)],
+                                        breaker_threshold=2, breaker_cooldown=60)
+        self.add_ticket(dispatcher)
+        self.deliver(dispatcher, now=1e12)
+        self.deliver(dispatcher, now=1e12)
+
+        self.assertEqual(dispatcher.stats()["breaker"], "open")
+        self.assertEqual(dispatcher._slots()[1], 0)
+
+        dispatcher.breaker_open_until = time.time() - 1
+        self.assertEqual(dispatcher.stats()["breaker"], "half-open")
+        self.assertEqual(dispatcher._slots()[1], 1)
+
+        self.deliver(dispatcher, now=1e12)
+        self.assertEqual(dispatcher.stats()["breaker"], "closed")
+        self.assertEqual(dispatcher._slots()[1], dispatcher.max_in_flight)
+
+    # a ticket of a network the dispatcher no longer owns is handed back to the outbox unsent
+    def test_ticket_of_lost_network_is_released(self):
+        owned = {"N1"}
+        dispatcher = ScriptedDispatcher(self.db_file, [], network_ids=lambda: owned)
+        outbox_id = self.add_ticket(dispatcher)
+        ticket = dispatcher._claim(time.time(), 1)[0]
+
+        owned.clear()
+        dispatcher.in_flight.add(outbox_id)
+        dispatcher._deliver(ticket)
+
+        self.assertEqual(self.row(outbox_id)[2:], (None, None))
+        self.assertEqual(dispatcher.in_flight, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import remedy_client
+import remedy_functions
+from remedy_async import AsyncRemedyClient
+
+# return an AR-JWT shaped token that expires at the given time
+def make_token(name, expires_at):
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    return encode({"alg": "HS256"}) + "." + encode({"exp": int(expires_at), "sub": name}) + ".test"
+
+# this class answers the Remedy login and incident creation endpoints with the statuses queued by the test,
+# and records the token sent with every ticket
+class ScriptedRemedy(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    logins = []
+    tickets = []
+    sent_tokens = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+        if path == remedy_functions.LOGIN_ENDPOINT:
+            status, token = self.logins.pop(0)
+            self._respond(status, token.encode())
+        else:
+            self.sent_tokens.append(self.headers.get("Authorization"))
+            status = self.tickets.pop(0)
+            self._respond(status, b"{}", {"Location": "http://remedy/entry/000000000000001"} if status == 201 else None)
+
+class RemedyTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedRemedy)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        remedy_client.close()
+
+    def setUp(self):
+        ScriptedRemedy.logins = []
+        ScriptedRemedy.tickets = []
+        ScriptedRemedy.sent_tokens = []
+        self.remedy = {"url": "http://127.0.0.1:" + str(self.server.server_address[1]),
+                       "username": "user", "password": "secret"}
+
+class TokenManagerTest(RemedyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.token_manager = self.remedy["token_manager"] = remedy_functions.TokenManager(self.remedy)
+
+    def create_incident(self):
+        return remedy_functions.create_incident(self.remedy, {"description": "AP A1 is down"})
+
+    # the token is fetched once and reused until it expires
+    def test_token_is_cached(self):
+        first = make_token("first", time.time() + 3600)
+        ScriptedRemedy.logins = [(200, first)]
+        ScriptedRemedy.tickets = [201, 201]
+
+        self.create_incident()
+        self.create_incident()
+
+        self.assertEqual(ScriptedRemedy.sent_tokens, ["AR-JWT " + first] * 2)
+        self.assertEqual(self.token_manager.stats(), {"hits": 1, "refreshes": 1})
+
+    # a token about to expire is replaced before it is sent
+    def test_expiring_token_is_replaced(self):
+        expiring = make_token("expiring", time.time() + remedy_functions.TOKEN_EXPIRY_MARGIN / 2)
+        fresh = make_token("fresh", time.time() + 3600)
+        ScriptedRemedy.logins = [(200, expiring), (200, fresh)]
+
+        self.assertEqual(self.token_manager.get_token(), expiring)
+        self.assertEqual(self.token_manager.get_token(), fresh)
+
+    # a token Remedy rejects is replaced and the request sent once more
+    def test_rejected_token_is_refreshed(self):
+        revoked = make_token("revoked", time.time() + 3600)
+        fresh = make_token("fresh", time.time() + 3600)
+        ScriptedRemedy.logins = [(200, revoked), (200, fresh)]
+        ScriptedRemedy.tickets = [401, 201]
+
+        response = self.create_incident()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ScriptedRemedy.sent_tokens, ["AR-JWT " + revoked, "AR-JWT " + fresh])
+        self.assertEqual(self.token_manager.get_token(), fresh)
+
+    # a token another thread already replaced is reused rather than logging in again
+    def test_refresh_of_replaced_token_reuses_it(self):
+        current = make_token("current", time.time() + 3600)
+        ScriptedRemedy.logins = [(200, current)]
+        self.token_manager.get_token()
+
+        self.assertEqual(self.token_manager.refresh("stale"), current)
+        self.assertEqual(self.token_manager.stats()["refreshes"], 1)
+
+    # a refused login raises, and nothing is cached, so the next call logs in again
+    def test_failed_login_is_not_cached(self):
+        token = make_token("token", time.time() + 3600)
+        ScriptedRemedy.logins = [(401, "<html>Authentication failed</html>"), (200, token)]
+
+        with self.assertRaises(remedy_functions.RemedyLoginError):
+            self.token_manager.get_token()
+        self.assertIsNone(self.token_manager.token)
+
+        self.assertEqual(self.token_manager.get_token(), token)
+        self.assertEqual(ScriptedRemedy.logins, [])
+
+    # a ticket is never sent with a failed login's response as its token
+    def test_failed_login_sends_no_ticket(self):
+        ScriptedRemedy.logins = [(500, "Internal Server Error")]
+
+        with self.assertRaises(remedy_functions.RemedyLoginError):
+            self.create_incident()
+        self.assertEqual(ScriptedRemedy.sent_tokens, [])
+
+# the async client's token manager behaves like the threaded one
+class AsyncTokenManagerTest(RemedyTestCase):
+    # run the calls on a client started on a new event loop, returning their results and the client's token stats
+    def run_client(self, *calls):
+        async def run():
+            client = AsyncRemedyClient(self.remedy, retries=0)
+            await client.start()
+            try:
+                results = []
+                for call in calls:
+                    try:
+                        results.append(await call(client))
+                    except remedy_functions.RemedyLoginError as e:
+                        results.append(e)
+
+                return results, client.token_manager.stats()
+            finally:
+                await client.close()
+
+        return asyncio.run(run())
+
+    # a token Remedy rejects is replaced and the request sent once more
+    def test_rejected_token_is_refreshed(self):
+        revoked = make_token("revoked", time.time() + 3600)
+        fresh = make_token("fresh", time.time() + 3600)
+        ScriptedRemedy.logins = [(200, revoked), (200, fresh)]
+        ScriptedRemedy.tickets = [401, 201]
+
+        (response,), stats = self.run_client(lambda client: client.create_incident({"description": "AP A1 is down"}))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ScriptedRemedy.sent_tokens, ["AR-JWT " + revoked, "AR-JWT " + fresh])
+        self.assertEqual(stats, {"hits": 0, "refreshes": 2})
+
+    # a refused login raises, and nothing is cached, so the next call logs in again
+    def test_failed_login_is_not_cached(self):
+        token = make_token("token", time.time() + 3600)
+        ScriptedRemedy.logins = [(401, "<html>Authentication failed</html>"), (200, token)]
+
+        (error, result), stats = self.run_client(lambda client: client.token_manager.get_token(),
+                                                 lambda client: client.token_manager.get_token())
+
+        self.assertIsInstance(error, remedy_functions.RemedyLoginError)
+        self.assertEqual(result, token)
+        self.assertEqual(stats, {"hits": 0, "refreshes": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+from topology import Device
+from status_history import StatusHistory
+
+HOUR = 3600
+START = 1704067200
+
+class StatusEventsTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = db.create_connection(":memory:")
+        db.create_tables(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    # record status changes of an AP in network N1, given as (serial, status, seconds after START)
+    def add(self, *changes, network_id="N1"):
+        db.add_status_events(self.conn, [(serial, "AP", network_id, status, START + seconds) for serial, status, seconds in changes])
+
+    def rollup(self, limit=1000, delete_before=0):
+        return db.rollup_status_events(self.conn, limit, delete_before)
+
+    def outages(self):
+        return [(serial, started_at - START, None if ended_at is None else ended_at - START) for serial, started_at, ended_at in
+                self.conn.execute("SELECT serial, started_at, ended_at FROM outages ORDER BY serial, started_at")]
+
+    # every went down starts an outage, which the next came up ends
+    def test_rollup_builds_outages(self):
+        self.add(("A1", "down", 0), ("A1", "up", 60), ("A1", "down", 120), ("A2", "down", 30))
+
+        self.assertEqual(self.rollup(), 4)
+        self.assertEqual(self.outages(), [("A1", 0, 60), ("A1", 120, None), ("A2", 30, None)])
+
+    # a repeated went down stays in the same outage
+    def test_repeated_down_keeps_outage(self):
+        self.add(("A1", "down", 0), ("A1", "down", 30), ("A1", "up", 60))
+        self.rollup()
+
+        self.assertEqual(self.outages(), [("A1", 0, 60)])
+
+    # events are rolled up in batches, continuing where the last one stopped, and each event only once
+    def test_rollup_continues_from_cursor(self):
+        self.add(("A1", "down", 0), ("A1", "up", 60), ("A1", "down", 120))
+
+        self.assertEqual(self.rollup(limit=2), 2)
+        self.assertEqual(self.rollup(limit=2), 1)
+        self.assertEqual(self.rollup(limit=2), 0)
+        self.assertEqual(self.outages(), [("A1", 0, 60), ("A1", 120, None)])
+
+    # events written out of order, such as by a backfill, are rolled up in the order they happened
+    def test_late_events_are_rolled_up_in_time_order(self):
+        self.add(("A1", "up", 60), ("A1", "down", 0))
+        self.rollup()
+        self.assertEqual(self.outages(), [("A1", 0, 60)])
+
+        # an earlier outage replayed after the later one was rolled up, and a repeat of a went down inside it
+        self.add(("A1", "up", -60), ("A1", "down", -120), ("A1", "down", 30))
+        self.rollup()
+        self.assertEqual(self.outages(), [("A1", -120, -60), ("A1", 0, 60)])
+
+        # a came up older than the outage that is still open doesn't end it
+        self.add(("A1", "down", 300))
+        self.rollup()
+        self.add(("A1", "up", 200))
+        self.rollup()
+
+        self.assertEqual(self.outages(), [("A1", -120, -60), ("A1", 0, 60), ("A1", 300, None)])
+
+    # rolled up events older than the retention are deleted, and the rest are kept
+    def test_old_events_are_deleted(self):
+        self.add(("A1", "down", 0), ("A1", "up", 3 * HOUR))
+        self.rollup(delete_before=START + 2 * HOUR)
+
+        self.assertEqual([row[0] - START for row in self.conn.execute("SELECT occurred_at FROM status_events")], [3 * HOUR])
+        self.assertEqual(self.outages(), [("A1", 0, 3 * HOUR)])
+
+    # devices whose status changed at least the given number of times are reported, the most changes first
+    def test_flapping_devices(self):
+        self.add(("A1", "down", 0), ("A1", "up", 10), ("A1", "down", 20), ("A1", "up", 30),
+                 ("A2", "down", 5), ("A2", "up", 15), ("A2", "down", 25))
+        self.add(("A3", "down", 0), ("A3", "up", 10), ("A3", "down", 20), network_id="N2")
+
+        self.assertEqual(db.query_flapping_devices(self.conn, START, 3), [
+            ("A1", "AP", "N1", 4, "up"),
+            ("A2", "AP", "N1", 3, "down"),
+            ("A3", "AP", "N2", 3, "down")
+        ])
+        self.assertEqual([row[0] for row in db.query_flapping_devices(self.conn, START, 3, network_id="N2")], ["A3"])
+        # only the changes since the given time count
+        self.assertEqual([row[0] for row in db.query_flapping_devices(self.conn, START + 12, 3)], [])
+
+    # outage minutes are summed per network over the range, counting open outages up to its end
+    def test_outage_minutes(self):
+        self.add(("A1", "down", 0), ("A1", "up", 600), ("A2", "down", 1200), ("A2", "up", 1800), ("A3", "down", 3000))
+        self.add(("A4", "down", 0), ("A4", "up", 300), network_id="N2")
+        self.rollup()
+
+        networks = db.query_outage_minutes(self.conn, START, START + HOUR)
+
+        self.assertEqual(networks, [("N1", 30.0, 3, 10.0), ("N2", 5.0, 1, 5.0)])
+        # outages are clipped to the range
+        self.assertEqual(db.query_outage_minutes(self.conn, START + 300, START + 1500, network_id="N1"), [("N1", 10.0, 2, 10.0)])
+
+class StatusHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.dir.name, "history.db")
+        with db.get_pool(self.db_file).connection() as conn:
+            db.create_tables(conn)
+
+    def tearDown(self):
+        db.get_pool(self.db_file).close()
+        self.dir.cleanup()
+
+    # changes recorded in memory are written by the background thread and all flushed on shutdown
+    def test_recorded_changes_are_written(self):
+        history = StatusHistory(self.db_file, flush_interval=60, batch_size=2, rollup_interval=60)
+        history.start()
+        device = Device("A1", "AP", "up", "N1")
+        for i, status in enumerate(("down", "up", "down")):
+            history.record(device, status, START + i)
+        history.shutdown()
+
+        with db.get_pool(self.db_file).connection() as conn:
+            rows = conn.execute("SELECT serial, status, occurred_at FROM status_events ORDER BY id").fetchall()
+        self.assertEqual(rows, [("A1", "down", START), ("A1", "up", START + 1), ("A1", "down", START + 2)])
+        self.assertEqual(history.stats()["written"], 3)
+
+    # changes past the limit held in memory are dropped rather than waiting on the database
+    def test_changes_past_limit_are_dropped(self):
+        history = StatusHistory(self.db_file, max_pending=2)
+        device = Device("A1", "AP", "up", "N1")
+        for i in range(3):
+            history.record(device, "down", START + i)
+
+        self.assertEqual(history.stats()["pending"], 2)
+        self.assertEqual(history.stats()["dropped"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+import sync
+
+MODELS = {"R": "MX68", "S": "MS120", "A": "MR36"}
+
+def link(a, b):
+    return {"ends": [{"node": {"type": "device"}, "device": {"serial": a}},
+                     {"node": {"type": "device"}, "device": {"serial": b}}]}
+
+# answers the Meraki calls sync.py makes from the links of each network - the model of a device comes from the first
+# letter of its serial
+class Dashboard:
+    def __init__(self, networks):
+        self.topologies = networks
+        self.organizations = self
+        self.networks = self
+
+    def getOrganizationNetworks(self, org_id, total_pages=None):
+        return [{"id": net_id, "name": "Network " + net_id} for net_id in self.topologies]
+
+    def _devices(self):
+        return {serial for links in self.topologies.values() for pair in links for serial in pair}
+
+    def getOrganizationDevices(self, org_id, total_pages=None, networkIds=None):
+        return [{"serial": serial, "model": MODELS[serial[0]]} for serial in self._devices()]
+
+    def getOrganizationDevicesStatuses(self, org_id, total_pages=None, networkIds=None):
+        return [{"serial": serial, "status": "online"} for serial in self._devices()]
+
+    def getNetworkTopologyLinkLayer(self, net_id):
+        return {"links": [link(a, b) for a, b in self.topologies[net_id]]}
+
+class TopologyDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = db.create_connection(":memory:")
+        db.create_tables(self.conn)
+        db.add_devices(self.conn, [("R1", "up")], [("S1", "up", "R1"), ("S2", "down", "R1")],
+                       [("A1", "up", "S1"), ("A2", "up", "S1")], "O1", "N1")
+
+    def tearDown(self):
+        self.conn.close()
+
+    # the current devices, with the ones in the aps table given as (serial, connection)
+    def aps(self):
+        return sorted((serial, connection) for serial, connection, status in db.query_all_aps(self.conn, "N1"))
+
+    # only the devices added, removed, or moved are written, and the status of the others is kept
+    def test_diff_applies_changes(self):
+        version = db.query_topology_version(self.conn)
+        diff = db.apply_topology_diff(self.conn, {"R1": ("R1", "up")},
+                                      {"S1": ("S1", "up", "R1"), "S2": ("S2", "up", "R1")},
+                                      {"A1": ("A1", "up", "S2"), "A2": ("A2", "up", "S1"), "A3": ("A3", "up", "S2")},
+                                      "O1", "N1")
+
+        self.assertEqual(diff["aps"], ([("A3", "up", "S2")], [], [("S2", "A1")]))
+        self.assertEqual(self.aps(), [("A1", "S2"), ("A2", "S1"), ("A3", "S2")])
+        self.assertEqual(db.query_switch_status(self.conn, "S2"), [("down",)])
+        self.assertGreater(db.query_topology_version(self.conn), version)
+
+    # an unchanged topology writes nothing and leaves the version alone
+    def test_unchanged_topology_keeps_version(self):
+        version = db.query_topology_version(self.conn)
+        db.apply_topology_diff(self.conn, {"R1": ("R1", "up")},
+                               {"S1": ("S1", "up", "R1"), "S2": ("S2", "up", "R1")},
+                               {"A1": ("A1", "up", "S1"), "A2": ("A2", "up", "S1")}, "O1", "N1")
+
+        self.assertEqual(db.query_topology_version(self.conn), version)
+
+    # a diff that would remove half of the network's devices or more is refused and changes nothing
+    def test_large_removal_is_refused(self):
+        version = db.query_topology_version(self.conn)
+        with self.assertRaises(db.TopologyDiffRefused):
+            db.apply_topology_diff(self.conn, {"R1": ("R1", "up")}, {"S1": ("S1", "up", "R1")}, {}, "O1", "N1")
+
+        self.assertEqual(self.aps(), [("A1", "S1"), ("A2", "S1")])
+        self.assertEqual(db.query_topology_version(self.conn), version)
+
+    # an empty answer would delete the whole network
+    def test_empty_topology_is_refused(self):
+        with self.assertRaises(db.TopologyDiffRefused):
+            db.apply_topology_diff(self.conn, {}, {}, {}, "O1", "N1")
+
+    # a refused diff is applied when forced
+    def test_forced_removal_is_applied(self):
+        db.apply_topology_diff(self.conn, {"R1": ("R1", "up")}, {"S1": ("S1", "up", "R1")}, {}, "O1", "N1", force=True)
+
+        self.assertEqual(self.aps(), [])
+        self.assertEqual(db.query_all_switches(self.conn, "N1"), [("S1", "R1", "up")])
+
+    # removing fewer than the limit is applied
+    def test_small_removal_is_applied(self):
+        db.apply_topology_diff(self.conn, {"R1": ("R1", "up")},
+                               {"S1": ("S1", "up", "R1"), "S2": ("S2", "up", "R1")},
+                               {"A1": ("A1", "up", "S1")}, "O1", "N1")
+
+        self.assertEqual(self.aps(), [("A1", "S1")])
+
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = db.create_connection(":memory:")
+        db.create_tables(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def serials(self, network_id):
+        return sorted(row[0] for row in db.query_all_routers(self.conn, network_id) + db.query_all_switches(self.conn, network_id) +
+                      db.query_all_aps(self.conn, network_id))
+
+    # every network of the organization is synced
+    def test_every_network_is_synced(self):
+        dashboard = Dashboard({"N1": [("R1", "S1"), ("S1", "A1")], "N2": [("R2", "S2"), ("S2", "A2")]})
+
+        diffs = sync.sync_once(dashboard, self.conn, "O1")
+
+        self.assertEqual(sorted(diffs), ["Network N1", "Network N2"])
+        self.assertEqual(self.serials("N1"), ["A1", "R1", "S1"])
+        self.assertEqual(self.serials("N2"), ["A2", "R2", "S2"])
+
+    # only the named networks are synced when names are given
+    def test_named_networks_are_synced(self):
+        dashboard = Dashboard({"N1": [("R1", "S1")], "N2": [("R2", "S2")]})
+
+        sync.sync_once(dashboard, self.conn, "O1", ["Network N2"])
+
+        self.assertEqual(self.serials("N1"), [])
+        self.assertEqual(self.serials("N2"), ["R2", "S2"])
+
+    # a network whose diff is refused is skipped, and the others are still synced
+    def test_refused_network_does_not_stop_the_others(self):
+        sync.sync_once(Dashboard({"N1": [("R1", "S1"), ("S1", "A1")], "N2": [("R2", "S2")]}), self.conn, "O1")
+
+        diffs = sync.sync_once(Dashboard({"N1": [], "N2": [("R2", "S2"), ("S2", "A2")]}), self.conn, "O1")
+
+        self.assertEqual(list(diffs), ["Network N2"])
+        self.assertEqual(self.serials("N1"), ["A1", "R1", "S1"])
+        self.assertEqual(self.serials("N2"), ["A2", "R2", "S2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
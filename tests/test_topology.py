@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+import topology
+from topology import Topology
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.snapshot = os.path.join(self.dir.name, "sqlite.db.topology")
+        self.conn = self.create_database("sqlite.db")
+        db.add_devices(self.conn, [("R1", "up")], [("S1", "up", "R1"), ("S2", "up", "S1")], [("A1", "down", "S2")], "O1", "N1")
+
+    def tearDown(self):
+        self.conn.close()
+        self.dir.cleanup()
+
+    def create_database(self, name):
+        conn = db.create_connection(os.path.join(self.dir.name, name))
+        db.create_tables(conn)
+
+        return conn
+
+    # load a new index from the database with the snapshot, returning it and the devices in the snapshot it leaves behind
+    def load(self, conn=None):
+        index = Topology(snapshot_path=self.snapshot)
+        index.load(conn or self.conn)
+        devices = topology.read_snapshot(self.snapshot, db.query_database_id(conn or self.conn),
+                                         db.query_topology_version(conn or self.conn),
+                                         db.query_device_counts(conn or self.conn))
+
+        return index, devices
+
+    def links(self, index):
+        return {serial: (device.parent.serial if device.parent else None, device.device_type, device.status, device.network_id)
+                for serial, device in index.devices.items()}
+
+    # the index read from the snapshot matches the one read from the tables, with statuses from the database
+    def test_snapshot_matches_database(self):
+        from_database, _ = self.load()
+        db.update_device_status(self.conn, "router", "R1", "down")
+        # the links are read from the snapshot, so a link changed without moving the topology version goes unseen
+        self.conn.execute("UPDATE aps SET connection = 'S1' WHERE serial = 'A1'")
+        self.conn.commit()
+        from_snapshot, _ = self.load()
+
+        self.assertTrue(os.path.exists(self.snapshot))
+        expected = self.links(from_database)
+        expected["R1"] = (None, "router", "down", "N1")
+        self.assertEqual(self.links(from_snapshot), expected)
+        self.assertEqual(from_snapshot.get("A1").status, "down")
+        self.assertEqual([child.serial for child in from_snapshot.get("S1").children], ["S2"])
+
+    # a snapshot written at an older topology version is not used
+    def test_snapshot_of_other_version_is_ignored(self):
+        self.load()
+        version = db.query_topology_version(self.conn)
+        db.add_devices(self.conn, [], [], [("A2", "up", "S1")], "O1", "N1")
+
+        self.assertIsNone(topology.read_snapshot(self.snapshot, db.query_database_id(self.conn), version + 1,
+                                                 db.query_device_counts(self.conn)))
+        index, _ = self.load()
+        self.assertEqual(index.get("A2").parent.serial, "S1")
+
+    # a snapshot of another database at the same topology version is not used
+    def test_snapshot_of_other_database_is_ignored(self):
+        self.load()
+        other = self.create_database("rebuilt.db")
+        db.add_devices(other, [("R1", "up")], [("S1", "up", "R1"), ("S2", "up", "R1")], [("A1", "up", "S2")], "O1", "N1")
+        self.assertEqual(db.query_topology_version(other), db.query_topology_version(self.conn))
+        self.assertNotEqual(db.query_database_id(other), db.query_database_id(self.conn))
+
+        self.assertIsNone(topology.read_snapshot(self.snapshot, db.query_database_id(other), db.query_topology_version(other),
+                                                 db.query_device_counts(other)))
+        index, _ = self.load(other)
+        self.assertEqual(index.get("S2").parent.serial, "R1")
+        other.close()
+
+    # a snapshot written from other numbers of devices, such as after the tables were edited by hand, is not used
+    def test_snapshot_of_other_device_counts_is_ignored(self):
+        self.load()
+        self.conn.execute("DELETE FROM aps WHERE serial = 'A1'")
+        self.conn.commit()
+
+        self.assertIsNone(topology.read_snapshot(self.snapshot, db.query_database_id(self.conn),
+                                                 db.query_topology_version(self.conn), db.query_device_counts(self.conn)))
+        index, _ = self.load()
+        self.assertIsNone(index.get("A1"))
+
+    # a damaged or truncated snapshot is not used
+    def test_damaged_snapshot_is_ignored(self):
+        self.load()
+        with open(self.snapshot, "rb") as f:
+            data = f.read()
+        arguments = (self.snapshot, db.query_database_id(self.conn), db.query_topology_version(self.conn),
+                     db.query_device_counts(self.conn))
+        self.assertIsNotNone(topology.read_snapshot(*arguments))
+
+        with open(self.snapshot, "wb") as f:
+            f.write(data[:-3])
+        self.assertIsNone(topology.read_snapshot(*arguments))
+
+        with open(self.snapshot, "wb") as f:
+            f.write(b"XXXX" + data[4:])
+        self.assertIsNone(topology.read_snapshot(*arguments))
+
+        index, _ = self.load()
+        self.assertEqual(len(index), 4)
+
+    # a missing snapshot is written on the first load
+    def test_missing_snapshot_is_written(self):
+        _, devices = self.load()
+
+        self.assertEqual(sorted(devices), ["A1", "R1", "S1", "S2"])
+
+class StatusUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.dir.name, "sqlite.db")
+        self.conn = db.create_connection(self.db_file)
+        db.create_tables(self.conn)
+        db.add_devices(self.conn, [("R1", "up")], [("S1", "up", "R1")], [("A1", "up", "S1")], "O1", "N1")
+        self.index = Topology()
+        self.index.load(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        self.dir.cleanup()
+
+    # a status change is written through to the database, and repeating it changes nothing
+    def test_status_is_written_through(self):
+        self.assertTrue(self.index.update_status(self.conn, "S1", "down"))
+        self.assertFalse(self.index.update_status(self.conn, "S1", "down"))
+
+        self.assertEqual(db.query_switch_status(self.conn, "S1"), [("down",)])
+        self.assertEqual(self.index.down_ancestor("A1").serial, "S1")
+
+    # the index isn't locked while a status is waiting to be written, so other devices can be checked and changed
+    def test_index_is_not_locked_during_write(self):
+        def write():
+            conn = db.create_connection(self.db_file)
+            try:
+                self.index.update_status(conn, "R1", "down")
+            finally:
+                conn.close()
+
+        blocker = db.create_connection(self.db_file)
+        blocker.execute("BEGIN IMMEDIATE")
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            # the router is marked down in memory while its write waits for the database
+            for _ in range(100):
+                if self.index.get("R1").status == "down":
+                    break
+                writer.join(0.01)
+            self.assertEqual(self.index.get("R1").status, "down")
+            self.assertTrue(writer.is_alive())
+            self.assertTrue(self.index.lock.acquire(timeout=1))
+            self.index.lock.release()
+            self.assertEqual(self.index.root_cause("A1").serial, "R1")
+        finally:
+            blocker.rollback()
+            writer.join()
+            blocker.close()
+
+        self.assertEqual(db.query_router_status(self.conn, "R1"), [("down",)])
+
+    # a status that could not be written is put back in memory
+    def test_failed_write_is_undone(self):
+        closed = db.create_connection(self.db_file)
+        closed.close()
+
+        with self.assertRaises(sqlite3.ProgrammingError):
+            self.index.update_status(closed, "A1", "down")
+        self.assertEqual(self.index.get("A1").status, "up")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import alerts
+from worker import AlertWorkerPool
+
+def alert(alert_type, serial):
+    return {"alertType": alert_type, "deviceSerial": serial, "networkId": "N1"}
+
+# a pool with a single worker that is held on a first alert until release is called, so the alerts submitted
+# in the meantime stay queued
+class HeldPool:
+    def __init__(self, lane_sizes=None):
+        self.handled = []
+        self.holding = threading.Event()
+        self.released = threading.Event()
+        self.pool = AlertWorkerPool(self.handle, workers=1, lanes=alerts.PRIORITY_LANES, lane_of=alerts.alert_lane,
+                                    lane_sizes=lane_sizes)
+        self.pool.start()
+        self.pool.submit(alert("APs came up", "HOLD"))
+        self.holding.wait(5)
+
+    def handle(self, data):
+        if data["deviceSerial"] == "HOLD":
+            self.holding.set()
+            self.released.wait(5)
+        else:
+            self.handled.append((data["alertType"], data["deviceSerial"]))
+
+    # let the worker go and wait until everything queued has been handled
+    def release(self):
+        self.released.set()
+        self.pool.shutdown(timeout=5)
+
+        return self.handled
+
+class PriorityLaneTest(unittest.TestCase):
+    def test_alert_lanes(self):
+        self.assertEqual(alerts.alert_lane(alert("Cellular went down", "R1")), "router down")
+        self.assertEqual(alerts.alert_lane(alert("switches came up", "S1")), "switch up")
+        self.assertEqual(alerts.alert_lane(alert("APs went down", "A1")), "AP down")
+        self.assertEqual(alerts.alert_lane({"alertType": "Settings changed"}), "AP up")
+
+    # queued alerts are handled routers first, then switches, then APs, down before up, and in order within a lane
+    def test_higher_lanes_are_handled_first(self):
+        held = HeldPool()
+        for data in (alert("APs came up", "A1"), alert("APs went down", "A2"), alert("switches went down", "S1"),
+                     alert("APs went down", "A3"), alert("Cellular came up", "R2"), alert("Cellular went down", "R1")):
+            self.assertTrue(held.pool.submit(data))
+
+        self.assertEqual(held.release(), [
+            ("Cellular went down", "R1"),
+            ("Cellular came up", "R2"),
+            ("switches went down", "S1"),
+            ("APs went down", "A2"),
+            ("APs went down", "A3"),
+            ("APs came up", "A1")
+        ])
+
+    # a full lane rejects its alerts while the lanes above it still accept theirs
+    def test_full_lane_rejects_only_its_alerts(self):
+        held = HeldPool(lane_sizes={"AP down": 2})
+        accepted = [held.pool.submit(alert("APs went down", "A" + str(i))) for i in range(4)]
+        router_accepted = held.pool.submit(alert("Cellular went down", "R1"))
+        stats = held.pool.stats()
+
+        self.assertEqual(accepted, [True, True, False, False])
+        self.assertTrue(router_accepted)
+        self.assertEqual(stats["rejected"], 2)
+        self.assertEqual(stats["lanes"]["AP down"]["rejected"], 2)
+        self.assertEqual(stats["lanes"]["AP down"]["max_queue"], 2)
+        self.assertEqual(stats["lanes"]["router down"]["rejected"], 0)
+        self.assertEqual(held.release(), [("Cellular went down", "R1"), ("APs went down", "A0"), ("APs went down", "A1")])
+
+    # an alert overtaken by a newer alert for the same device from a higher lane is dropped instead of undoing it
+    def test_overtaken_alert_is_dropped(self):
+        held = HeldPool()
+        held.pool.submit(alert("Cellular came up", "R1"))
+        held.pool.submit(alert("Cellular went down", "R1"))
+
+        self.assertEqual(held.release(), [("Cellular went down", "R1")])
+        self.assertEqual(held.pool.stats()["stale"], 1)
+
+    # a pool that is shutting down rejects new alerts
+    def test_shutdown_rejects_alerts(self):
+        held = HeldPool()
+        held.release()
+
+        self.assertFalse(held.pool.submit(alert("APs went down", "A1")))
+
+
+if __name__ == "__main__":
+    unittest.main()
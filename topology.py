@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import os
+import struct
+import threading
+import time
+import db
+import event_log
+
+UP = "up"
+DOWN = "down"
+# longest chain of upstream devices that will be followed, so a loop in the data can't hang a walk
+MAX_DEPTH = 64
+
+# the snapshot starts with a header of the magic bytes, the format, the database id, the topology version, the number
+# of routers, switches, and aps it was written from, the number of strings, and the number of devices - then the string
+# table, each string as its length and its UTF-8 bytes, and then one record per device of its serial, its network id,
+# its parent's position in the records, and its type
+SNAPSHOT_MAGIC = b"MRTS"
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_HEADER = struct.Struct("<4sHqqIIIII")
+SNAPSHOT_STRING = struct.Struct("<H")
+SNAPSHOT_DEVICE = struct.Struct("<IIiB")
+SNAPSHOT_NONE = 0xFFFFFFFF
+DEVICE_TYPES = ("router", "switch", "AP")
+
+# one device in the topology - __slots__ keeps each entry small enough to hold 100k+ devices in memory
+class Device:
+    __slots__ = ("serial", "device_type", "status", "network_id", "parent", "children")
+
+    def __init__(self, serial, device_type, status, network_id=None, parent=None):
+        self.serial = serial
+        self.device_type = device_type
+        self.status = status
+        self.network_id = network_id
+        self.parent = parent
+        self.children = None
+
+# this class holds the router, switch, and ap tables in memory as a tree of devices, so finding out whether
+# anything upstream of a device is down is a walk up parent links instead of a database query per hop - every
+# status change is also passed to the status history, if one is given
+class Topology:
+    def __init__(self, snapshot_path=None, history=None):
+        self.snapshot_path = snapshot_path
+        self.history = history
+        self.devices = {}
+        self.version = None
+        self.checked_at = 0
+        self.lock = threading.RLock()
+
+    # build the index from the routers, switches, and aps tables in the database - with a snapshot path, the devices and
+    # links are read from the snapshot file when it was written at the current topology version, and only the devices
+    # that aren't up are read from the database, otherwise the tables are read and a new snapshot is written
+    def load(self, conn):
+        started = time.perf_counter()
+        # hold the lock for the whole load so no status change made while reading is lost when the index is swapped
+        with self.lock:
+            # read the version and every table from one snapshot of the database
+            in_transaction = conn.in_transaction
+            if not in_transaction:
+                conn.execute("BEGIN")
+            try:
+                database_id = db.query_database_id(conn)
+                version = db.query_topology_version(conn)
+                devices = None
+                if self.snapshot_path is not None:
+                    devices = read_snapshot(self.snapshot_path, database_id, version, db.query_device_counts(conn))
+                source = "snapshot"
+                if devices is not None:
+                    for serial in db.query_down_devices(conn):
+                        if serial in devices:
+                            devices[serial].status = DOWN
+                else:
+                    source = "database"
+                    devices = _read_devices(conn)
+            finally:
+                if not in_transaction:
+                    conn.commit()
+
+            self.devices = devices
+            self.version = version
+            if source == "database" and self.snapshot_path is not None and database_id is not None:
+                try:
+                    write_snapshot(self.snapshot_path, database_id, version, devices)
+                except OSError as e:
+                    event_log.error("topology_snapshot", path=self.snapshot_path, error=str(e))
+
+        event_log.log_event("topology_loaded", source=source, devices=len(devices), version=version,
+                            duration_ms=event_log.elapsed_ms(started))
+
+    # reload the index if devices were added, removed, or moved in the database since it was loaded,
+    # checking the topology version at most once every interval seconds
+    def refresh(self, conn, interval=0):
+        now = time.monotonic()
+        if now - self.checked_at < interval:
+            return False
+
+        self.checked_at = now
+        if db.query_topology_version(conn) == self.version:
+            return False
+
+        self.load(conn)
+
+        return True
+
+    def __len__(self):
+        return len(self.devices)
+
+    # return the ids of the networks that have devices in the index
+    def network_ids(self):
+        with self.lock:
+            return {device.network_id for device in self.devices.values()}
+
+    # return the device with the given serial - when a network id is given, a device recorded in another network is not returned
+    def get(self, serial, network_id=None):
+        device = self.devices.get(serial)
+        if device is not None and network_id is not None and device.network_id is not None and device.network_id != network_id:
+            return None
+
+        return device
+
+    # change the status of a device in memory and in the database, returning False if it already had that status -
+    # with a status history, the change is recorded at occurred_at (now if not given)
+    # only the change in memory is made under the lock, so alerts for other devices don't wait on the database write - if
+    # another thread changed the device again while the status was being written, the write is repeated with its status,
+    # so the database always ends up with the last status set in memory
+    def update_status(self, conn, serial, status, occurred_at=None):
+        status = _status(status)
+        with self.lock:
+            device = self.devices.get(serial)
+            if device is None or device.status == status:
+                return False
+            previous = device.status
+            device.status = status
+
+        written = status
+        try:
+            while True:
+                db.update_device_status(conn, device.device_type, serial, written)
+                with self.lock:
+                    if device.status == written:
+                        break
+                    written = device.status
+        except Exception:
+            # the status never reached the database, so put back the one it still holds
+            with self.lock:
+                if device.status == status:
+                    device.status = previous
+            raise
+
+        if self.history is not None:
+            self.history.record(device, status, occurred_at)
+
+        return True
+
+    # mark the devices behind a device that came back up as up, in the database with one set-based update and then in
+    # memory, and return them - devices with an open ticket or in exclude, and the devices behind them, are left alone,
+    # and a device with nothing behind it in the index skips the database - the lock is only held for the change in memory
+    def recover_subtree(self, conn, serial, occurred_at=None, exclude=()):
+        device = self.devices.get(serial)
+        if device is None or not device.children:
+            return []
+
+        rows = db.update_subtree_status(conn, serial, exclude)
+        recovered = []
+        with self.lock:
+            for _, child_serial in rows:
+                child = self.devices.get(child_serial)
+                if child is not None:
+                    child.status = UP
+                    recovered.append(child)
+
+        if self.history is not None:
+            for child in recovered:
+                self.history.record(child, UP, occurred_at)
+
+        return recovered
+
+    # return the closest device upstream of the given device that is down, or None if every upstream device is up
+    def down_ancestor(self, serial):
+        device = self.devices.get(serial)
+        if device is None:
+            return None
+
+        parent = device.parent
+        depth = 0
+        while parent is not None and depth < MAX_DEPTH:
+            if parent.status != UP:
+                return parent
+            parent = parent.parent
+            depth += 1
+
+        return None
+
+    # return the device furthest upstream of the given device that is down, or None if every upstream device is up
+    def root_cause(self, serial):
+        device = self.devices.get(serial)
+        if device is None:
+            return None
+
+        root = None
+        parent = device.parent
+        depth = 0
+        while parent is not None and depth < MAX_DEPTH:
+            if parent.status != UP:
+                root = parent
+            parent = parent.parent
+            depth += 1
+
+        return root
+
+# read the routers, switches, and aps tables into devices linked to their upstream devices
+def _read_devices(conn):
+    devices = {}
+    links = []
+    for serial, device_type, connection, status, network_id in db.query_topology(conn):
+        devices[serial] = Device(serial, device_type, _status(status), network_id)
+        if connection is not None:
+            links.append((serial, connection))
+
+    for serial, connection in links:
+        if connection in devices:
+            _link(devices[serial], devices[connection])
+
+    return devices
+
+# write the devices and their links to a snapshot file for the given database id and topology version - the file is
+# written next to the old one and moved over it, so a receiver starting at the same time never reads half a snapshot -
+# each process writes its own temporary file, since several receivers can share one database
+def write_snapshot(path, database_id, version, devices):
+    strings = {}
+    counts = [0, 0, 0]
+    index = {serial: i for i, serial in enumerate(devices)}
+    records = []
+    for device in devices.values():
+        type_index = DEVICE_TYPES.index(device.device_type)
+        counts[type_index] += 1
+        network = SNAPSHOT_NONE if device.network_id is None else strings.setdefault(device.network_id, len(strings))
+        parent = -1 if device.parent is None else index[device.parent.serial]
+        records.append(SNAPSHOT_DEVICE.pack(strings.setdefault(device.serial, len(strings)), network, parent, type_index))
+
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, database_id, version, *counts, len(strings), len(records))]
+    for string in strings:
+        encoded = string.encode()
+        parts.append(SNAPSHOT_STRING.pack(len(encoded)))
+        parts.append(encoded)
+    parts.extend(records)
+
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"".join(parts))
+    os.replace(tmp_path, path)
+
+# read the devices and their links from a snapshot file, every device up - returns None if the file is missing or
+# damaged, or was written from another database, at another topology version, or from other numbers of routers,
+# switches, and aps
+def read_snapshot(path, database_id, version, counts):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    try:
+        (magic, file_format, file_database_id, file_version,
+         routers, switches, aps, string_count, device_count) = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or file_format != SNAPSHOT_FORMAT:
+            return None
+        if database_id is None or file_database_id != database_id or file_version != version:
+            return None
+        if (routers, switches, aps) != tuple(counts):
+            return None
+
+        offset = SNAPSHOT_HEADER.size
+        strings = []
+        for _ in range(string_count):
+            (length,) = SNAPSHOT_STRING.unpack_from(data, offset)
+            offset += SNAPSHOT_STRING.size
+            strings.append(data[offset:offset + length].decode())
+            offset += length
+        if len(data) - offset != device_count * SNAPSHOT_DEVICE.size:
+            return None
+
+        order = []
+        devices = {}
+        for serial, network, parent, type_index in SNAPSHOT_DEVICE.iter_unpack(memoryview(data)[offset:]):
+            device = Device(strings[serial], DEVICE_TYPES[type_index], UP, None if network == SNAPSHOT_NONE else strings[network])
+            order.append((device, parent))
+            devices[device.serial] = device
+        for device, parent in order:
+            if parent >= 0:
+                _link(device, order[parent][0])
+    except (struct.error, IndexError, UnicodeDecodeError):
+        return None
+
+    if len(devices) != device_count:
+        return None
+
+    return devices
+
+# map the status stored in the database to one of the shared status strings
+def _status(status):
+    return UP if status == UP else DOWN
+
+def _link(device, parent):
+    device.parent = parent
+    if parent.children is None:
+        parent.children = []
+    parent.children.append(device)
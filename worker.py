@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+import collections
+import threading
+import time
+import logging
+import event_log
+import metrics
+import profiling
+
+# sentinel put on a lane to tell a worker thread to exit
+_STOP = object()
+
+# this class queues alert payloads in priority lanes and processes them on a pool of background threads - a worker
+# always takes the oldest alert of the highest priority lane that has one, and each lane has its own bound, so a flood
+# in a low priority lane is shed without delaying or crowding out the alerts in the lanes above it
+# lane_of maps an alert to one of the lanes, which are listed from the highest priority to the lowest
+class AlertWorkerPool:
+    def __init__(self, handler, workers=4, max_queue=10000, lanes=("default",), lane_of=None, lane_sizes=None):
+        self.handler = handler
+        self.workers = workers
+        self.lanes = tuple(lanes)
+        self.lane_of = lane_of if lane_of is not None else (lambda data: self.lanes[0])
+        lane_sizes = lane_sizes or {}
+        self.max_sizes = {lane: lane_sizes.get(lane, max_queue) for lane in self.lanes}
+        self.queues = {lane: collections.deque() for lane in self.lanes}
+        self.cond = threading.Condition()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.sequence = 0
+        # the sequence number of the newest alert started for each device, so an older alert that a higher
+        # priority lane overtook is dropped instead of undoing the newer one
+        self.latest = {}
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.stale = 0
+        self.rejected = collections.Counter()
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.accepting = False
+
+    # start the worker threads
+    def start(self):
+        self.accepting = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name="alert-worker-{}".format(i), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # add an alert to its lane, returning False if the lane is full or the pool is shutting down
+    # a profiled alert is profiled on the worker thread that processes it
+    def submit(self, data, profiled=False):
+        if not self.accepting:
+            return False
+
+        lane = self.lane_of(data)
+        with self.cond:
+            if len(self.queues[lane]) >= self.max_sizes[lane]:
+                self.rejected[lane] += 1
+                metrics.ALERTS_SHED.inc(lane=lane)
+
+                return False
+
+            self.sequence += 1
+            self.queues[lane].append((time.monotonic(), self.sequence, data, profiled))
+            self.cond.notify()
+
+        return True
+
+    # wait for the next alert, taking from the highest priority lane that isn't empty
+    def _next(self):
+        with self.cond:
+            while True:
+                for lane in self.lanes:
+                    if self.queues[lane]:
+                        return lane, self.queues[lane].popleft()
+                self.cond.wait()
+
+    def _run(self):
+        while True:
+            lane, item = self._next()
+            if item is _STOP:
+                return
+
+            enqueued_at, sequence, data, profiled = item
+            lag = time.monotonic() - enqueued_at
+            metrics.ALERT_STAGE_SECONDS.observe(lag, alert_type=data.get("alertType"), stage="queue_wait")
+            serial = data.get("deviceSerial")
+            with self.lock:
+                if sequence < self.latest.get(serial, 0):
+                    self.stale += 1
+
+                    continue
+                if serial is not None:
+                    self.latest[serial] = sequence
+                self.in_flight += 1
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+
+            try:
+                with profiling.profile(profiled, data.get("alertType"), serial):
+                    self.handler(data)
+                failed = False
+            except Exception:
+                metrics.ALERT_ERRORS.inc(stage="worker")
+                event_log.log_event("alert_failed", level=logging.ERROR, exc_info=True, alert_type=data.get("alertType"),
+                                    serial=data.get("deviceSerial"), network_id=data.get("networkId"), lane=lane)
+                failed = True
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                    self.processed += 1
+                    if failed:
+                        self.failed += 1
+
+    # stop accepting alerts, let the workers finish everything already queued, then stop the threads
+    def shutdown(self, timeout=None):
+        if not self.accepting:
+            return
+
+        self.accepting = False
+        # the stop sentinels go in the lowest priority lane, so they are only reached once every lane is empty
+        with self.cond:
+            for thread in self.threads:
+                self.queues[self.lanes[-1]].append(_STOP)
+            self.cond.notify_all()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+    # return the number of alerts waiting in every lane
+    def depth(self):
+        with self.cond:
+            return sum(len(items) for items in self.queues.values())
+
+    # return the queue depth and processing lag of the pool, in total and for each lane
+    def stats(self):
+        now = time.monotonic()
+        lanes = {}
+        with self.cond:
+            for lane in self.lanes:
+                items = self.queues[lane]
+                lanes[lane] = {
+                    "queue_depth": len(items),
+                    "max_queue": self.max_sizes[lane],
+                    "rejected": self.rejected[lane],
+                    "oldest_queued_seconds": now - items[0][0] if items and items[0] is not _STOP else 0.0
+                }
+            rejected = sum(self.rejected.values())
+
+        with self.lock:
+            return {
+                "queue_depth": sum(lane["queue_depth"] for lane in lanes.values()),
+                "in_flight": self.in_flight,
+                "processed": self.processed,
+                "failed": self.failed,
+                "stale": self.stale,
+                "rejected": rejected,
+                "oldest_queued_seconds": max(lane["oldest_queued_seconds"] for lane in lanes.values()),
+                "last_lag_seconds": self.last_lag,
+                "max_lag_seconds": self.max_lag,
+                "lanes": lanes
+            }